@@ -11,11 +11,18 @@ Saves results
 
 """
 import argparse as ap
-import pandas as pd
 import numpy as np
+import pandas as pd
 
 from shakemap_utils import USGSshakemapGrid
-from shakemap_utils import FragilityCurve
+from shakemap_utils import GridFileCache
+from shakemap_utils import FragilityCurve, FragilityLibrary
+from shakemap_utils.location_lookup import process_locations
+from shakemap_utils.fragility_library import LocationCurves
+from shakemap_utils.damage_raster import DamageRaster
+from shakemap_utils.damage_simulation import simulate_damage
+from shakemap_utils.loss_aggregation import read_damage_ratios, expected_loss
+from shakemap_utils.loss_aggregation import LossAggregator
 
 
 def get_args():
@@ -28,7 +35,7 @@ def get_args():
                         metavar='input_coordinates.csv',
                         type=str,
                         nargs='?',
-                        help='.csv file with columns "lon" and "lat"')
+                        help='.csv, .parquet or .feather file with columns "lon" and "lat"')
 
     parser.add_argument('-s', '--shakemap',
                         metavar='shakemap_grid.xml',
@@ -49,12 +56,114 @@ def get_args():
                         nargs='?',
                         help='Fragility file in csv format')
 
+    parser.add_argument('--class_column',
+                        type=str,
+                        default=None,
+                        help='Column of the locations with their vulnerability class. The fragility file then has the class in its first column and the curves of each class in its rows, e.g. vulnerability_class,mmi,negligible,...')
+
+    parser.add_argument('--default_class',
+                        type=str,
+                        default=None,
+                        help='Vulnerability class used for locations of a class not in the fragility file, used with --class_column. Default gives them no damage probabilities')
+
+    parser.add_argument('--fragility_step',
+                        type=float,
+                        default=None,
+                        help='Look up damage probabilities in a table of the fragility curves at this intensity step, quicker for many locations. Default interpolates the curves exactly')
+
+    parser.add_argument('--use_uncertainty',
+                        action='store_true',
+                        help='Average the damage probabilities over the uncertainty in the intensity at each location, from the ShakeMap uncertainty grid')
+
+    parser.add_argument('--nnodes',
+                        type=int,
+                        default=9,
+                        help='Number of quadrature points per location used to average over the uncertainty')
+
+    parser.add_argument('--damage_raster',
+                        action='store_true',
+                        help='Apply the fragility curves once to every ShakeMap grid cell and look up the damage probabilities of the locations in that raster, kept in the cache with --use_cache for later runs. Quicker when the locations outnumber the grid cells, or with --use_uncertainty. With bilinear lookup the probabilities rather than the intensities are interpolated')
+
+    parser.add_argument('--damage_ratios',
+                        type=str,
+                        default=None,
+                        help='Damage ratio of each damage state, as comma separated values in the order of the fragility file or a csv file of damage states and ratios. Adds the expected loss of each location')
+
+    parser.add_argument('--tiv_column',
+                        type=str,
+                        default='tiv',
+                        help='Column of the locations with their total insured value, used with --damage_ratios')
+
+    parser.add_argument('--group_by',
+                        type=str,
+                        default=None,
+                        help='Comma separated list of location columns to total the expected losses by, e.g. island,route')
+
+    parser.add_argument('--ofile_totals',
+                        metavar='loss_totals.csv',
+                        type=str,
+                        default=None,
+                        help='Output csv file for the totals of the expected losses by group')
+
+    parser.add_argument('--nrealisations',
+                        type=int,
+                        default=0,
+                        help='Number of Monte Carlo realisations of the damage to all the locations, to report the distribution of the number of locations at or above each damage state. Default does not simulate')
+
+    parser.add_argument('--corr_range',
+                        type=float,
+                        default=None,
+                        help='Distance in km over which the intensity residuals of the realisations are correlated, falling to 5%%. Default samples each location independently')
+
+    parser.add_argument('--seed',
+                        type=int,
+                        default=None,
+                        help='Seed of the random numbers of the realisations, for results that can be repeated')
+
     parser.add_argument('-o', '--ofile',
                         metavar='lookup_results.csv',
                         type=str,
                         nargs='?',
                         default='locations_with_damageprob.csv',
-                        help='Output filename for locations with their probability of damage.')
+                        help='Output filename for locations with their probability of damage. Written as csv, parquet or feather depending on the extension.')
+
+    parser.add_argument('--dtype',
+                        type=str,
+                        choices=['float64', 'float32', 'int16'],
+                        default='float64',
+                        help='How the ShakeMap grids are stored in memory. float32 and int16 use half and a quarter of the memory')
+
+    parser.add_argument('--lookup_method',
+                        type=str,
+                        choices=['nearest', 'bilinear'],
+                        default='nearest',
+                        help='Take the intensity of the grid cell containing each location, or interpolate between the four nearest grid cells')
+
+    parser.add_argument('--columns',
+                        type=str,
+                        default=None,
+                        help='Comma separated list of the location columns to read and write, as well as lon and lat. Default is all columns')
+
+    parser.add_argument('--chunksize',
+                        type=int,
+                        default=None,
+                        help='Number of locations read, looked up and written at one time. Use for location files too large to hold in memory. Default reads all locations at once')
+
+    parser.add_argument('--nworkers',
+                        type=int,
+                        default=1,
+                        help='Number of worker processes used to read the ShakeMap and uncertainty grids at the same time, and to run the realisations')
+
+    parser.add_argument('--use_cache',
+                        action='store_true',
+                        help='Keep the parsed ShakeMap grids in an on-disk cache so later runs load them quickly')
+
+    parser.add_argument('--cache_dir',
+                        metavar='path/to/cache/',
+                        type=str,
+                        nargs='?',
+                        default=None,
+                        help='Folder for the ShakeMap cache. Default is a .shakemap_cache folder next to the ShakeMap files')
 
     args = parser.parse_args()
 
@@ -66,46 +175,178 @@ def main(args=get_args()):
 
     # Read fragility file into class object
     print("\nReading fragility curves from file...")
-    frag = FragilityCurve(args.fragility_file)
+    if args.class_column is not None:
+        frag = FragilityLibrary(args.fragility_file, args.default_class)
+        print(f"\tVulnerability classes: {frag.classes}")
+    else:
+        frag = FragilityCurve(args.fragility_file)
     print(f"\tIntensity Measure: {frag.intensity_measure}")
     print(f"\tDamage States: {frag.damagestates().values}")
+    if args.fragility_step is not None:
+        err = frag.tabulate(args.fragility_step)
+        print(f"\tTabulated at steps of {frag.tableStep:.4g}, within {err:.2g} of the curves")
 
     # Read Shakemap into class object
     print("\nReading shakemap from file...")
-    if args.shakemap_unc is not None:
-        shakemap = USGSshakemapGrid(args.shakemap, frag.intensity_measure, args.shakemap_unc)
-    else:
-        shakemap = USGSshakemapGrid(args.shakemap, frag.intensity_measure)
-
-    # Read locations into pandas array
-    print("\nReading Locations...")
-    locns = pd.read_csv(args.ifile)
-    print(f"\t...{len(locns):,d} locations")
-
-    # Get the mean/median and std deviation from the shakemap.
-    median, stddev = shakemap.lookup(locns['lon'].values, locns['lat'].values)
-    locns[frag.intensity_measure] = median
-    print(f"\t...{locns[frag.intensity_measure].count():d} locations with an intensity")
-
-    # Remove locations where no intensity is found
-    print("Removing %i locations without any intensity" %
-          sum(np.isnan(locns[frag.intensity_measure])))
-    locns = locns[~np.isnan(locns[frag.intensity_measure])]
-
-    # Convert intensities to probability of damage at each state
-    print("Getting damage at locations...")
-
-    # Loop through all damage states in the fragility curve
+    cache = None
+    if args.use_cache or args.cache_dir is not None:
+        cache = GridFileCache(args.cache_dir)
+
+    shakemap = USGSshakemapGrid(args.shakemap, frag.intensity_measure, args.shakemap_unc,
+                                cache=cache, dtype=args.dtype,
+                                nWorkers=args.nworkers)
+    if args.use_uncertainty and not shakemap.has_std():
+        print("WARNING: no uncertainty file given. " +
+              "Damage probabilities only based on median intensities")
+
+    # Damage probabilities of every grid cell
+    raster = None
+    if args.damage_raster and args.class_column is not None:
+        print("ERROR: --damage_raster needs a single fragility curve, " +
+              "interpolating the curves of each class instead")
+    elif args.damage_raster:
+        raster = DamageRaster(args.shakemap, frag, args.shakemap_unc,
+                              cache=cache, shakemap=shakemap,
+                              useUncertainty=args.use_uncertainty,
+                              nNodes=args.nnodes)
+        print("\tDamage raster %s" % ("loaded from cache" if raster.isCached
+                                       else "computed"))
+
+    # Damage ratios, and the columns to total the losses by
+    ratios = None
+    groupBy = []
+    if args.damage_ratios is not None:
+        ratios = read_damage_ratios(args.damage_ratios, frag.damagestates())
+        print(f"\tDamage ratios: {ratios}")
+        if args.group_by is not None:
+            groupBy = args.group_by.split(',')
+    losses = LossAggregator(groupBy)
+
+    # Columns of the locations to keep
+    columns = None
+    if args.columns is not None:
+        columns = args.columns.split(',')
+        if ratios is not None:
+            columns += [c for c in [args.tiv_column] + groupBy
+                        if c not in columns]
+        if args.class_column is not None and args.class_column not in columns:
+            columns.append(args.class_column)
+
+    # Look up the locations and their damage a chunk at a time
+    print("\nGetting damage at locations...")
+    nFound = 0
+    nOver = {c: 0 for c in frag.damagestates()}
+    found = []
+
+    def damage_chunk(locns):
+        """Add the intensity and damage probabilities to a chunk of locations,
+        keeping those with an intensity"""
+        nonlocal nFound
+
+        # Get the mean/median and std deviation from the shakemap.
+        median, stddev = shakemap.lookup(locns['lon'].values,
+                                         locns['lat'].values,
+                                         args.lookup_method)
+        locns[frag.intensity_measure] = median
+        if args.use_uncertainty:
+            locns[frag.intensity_measure + '_std'] = stddev
+
+        # Remove locations where no intensity is found
+        locns = locns[~np.isnan(locns[frag.intensity_measure])].copy()
+        nFound += len(locns)
+
+        # Curve of each location from its class
+        curves = frag
+        if args.class_column is not None:
+            curves = frag.for_locations(locns[args.class_column].values)
+
+        # Keep the intensities of all the locations for the realisations
+        if args.nrealisations > 0:
+            isFound = ~np.isnan(median)
+            found.append((median[isFound], stddev[isFound],
+                          locns['lon'].values, locns['lat'].values,
+                          locns[args.tiv_column].values if ratios is not None
+                          else np.zeros(len(locns)),
+                          curves.codes if args.class_column is not None
+                          else np.zeros(len(locns), dtype=np.intp)))
+
+        # Interpolate all damage states in the fragility curve at once,
+        # averaged over the uncertainty in the intensity if asked
+        if raster is not None:
+            probs = raster.lookup(locns['lon'].values, locns['lat'].values,
+                                  args.lookup_method)
+        elif args.use_uncertainty:
+            probs = curves.interp_uncertain(
+                locns[frag.intensity_measure].values,
+                locns[frag.intensity_measure + '_std'].values, args.nnodes)
+        else:
+            probs = curves.interp_all(locns[frag.intensity_measure].values)
+        for i, c in enumerate(frag.damagestates()):
+            locns['prob_' + c] = probs[:, i]
+            nOver[c] += (probs[:, i] >= 0.01).sum()
+
+        # Expected loss of each location, added to the totals
+        if ratios is not None:
+            tiv = locns[args.tiv_column].values.astype(float)
+            locns['expected_loss'] = expected_loss(probs, tiv, ratios)
+            losses.add(locns, tiv, locns['expected_loss'].values)
+
+        return locns
+
+    nRead, nWritten = process_locations(args.ifile, args.ofile,
+                                        damage_chunk, args.chunksize,
+                                        columns=columns)
+    print(f"\t...{nRead:,d} locations")
+    print(f"\t...{nFound:d} locations with an intensity")
+    print("Removed %i locations without any intensity" % (nRead - nFound))
     for c in frag.damagestates():
-        # Get the result of the interpolation, allow values over the max by setting them equal to the max.
-        locns['prob_' + c] = frag.interp_damagestate(locns[frag.intensity_measure], c)
-
-        print(f"\t{c:>16s}: {sum(locns['prob_' + c] >= 0.01):>6d} locations with >1% chance")
+        print(f"\t{c:>16s}: {nOver[c]:>6d} locations with >1% chance")
 
-    # Write the output file
-    locns.to_csv(args.ofile, index=False)
     print(f"\nWritten location details to {args.ofile}")
 
+    # Totals of the expected losses
+    if ratios is not None:
+        n, tiv, loss = losses.total
+        print(f"\nExpected loss {loss:,.2f} of {tiv:,.2f} total insured value at {n:,.0f} locations")
+        tables = []
+        for c in groupBy:
+            table = losses.table(c)
+            print(f"\nBy {c}:")
+            print(table.to_string())
+            tables.append(table.reset_index().rename(columns={c: 'group'})
+                          .assign(group_by=c))
+        if args.ofile_totals is not None and tables:
+            totals = pd.concat(tables)
+            totals[['group_by'] + list(totals.columns[:-1])].to_csv(
+                args.ofile_totals, index=False)
+            print(f"\nWritten loss totals to {args.ofile_totals}")
+
+    # Distribution of the damage to all locations
+    if args.nrealisations > 0 and nFound > 0:
+        print(f"\nSimulating {args.nrealisations:,d} realisations...")
+        median, stddev, lon, lat, tiv, codes = [np.concatenate(v)
+                                                for v in zip(*found)]
+        curves = frag
+        if args.class_column is not None:
+            curves = LocationCurves(frag, codes)
+
+        # Residuals correlated between nearby locations
+        sampler = None
+        if args.corr_range is not None:
+            from shakemap_utils.ground_motion_field import CorrelatedField
+            sampler = CorrelatedField(shakemap, args.corr_range).sampler(lon, lat)
+
+        counts = simulate_damage(curves, median, stddev, args.nrealisations,
+                                 seed=args.seed, nWorkers=args.nworkers,
+                                 sampler=sampler,
+                                 tiv=tiv if ratios is not None else None,
+                                 damageRatios=ratios)
+        print("Number of locations at or above each damage state:")
+        print(counts.summary().to_string())
+        if ratios is not None:
+            print("Loss to all the locations:")
+            print(counts.loss_summary().to_string())
+
     print("Finished")
 
     return
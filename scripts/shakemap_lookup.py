@@ -4,9 +4,10 @@ looks up the hazard values at those locations and saves results
 
 """
 import argparse as ap
-import pandas as pd
 
 from shakemap_utils import USGSshakemapGrid
+from shakemap_utils import GridFileCache
+from shakemap_utils.location_lookup import process_locations
 
 def get_args():
     """Get script arguments"""
@@ -18,7 +19,7 @@ def get_args():
                         metavar='input_coordinates.csv',
                         type=str,
                         nargs='?',
-                        help='.csv file with columns "lon" and "lat"')
+                        help='.csv, .parquet or .feather file with columns "lon" and "lat"')
 
     parser.add_argument('-s', '--shakemap',
                         metavar='shakemap_grid.xml',
@@ -45,7 +46,45 @@ def get_args():
                         type=str,
                         nargs='?',
                         default='locations_with_intensity.csv',
-                        help='Output filename for locations with their shakemap intensity.')
+                        help='Output filename for locations with their shakemap intensity. Written as csv, parquet or feather depending on the extension.')
+
+    parser.add_argument('--dtype',
+                        type=str,
+                        choices=['float64', 'float32', 'int16'],
+                        default='float64',
+                        help='How the ShakeMap grids are stored in memory. float32 and int16 use half and a quarter of the memory')
+
+    parser.add_argument('--lookup_method',
+                        type=str,
+                        choices=['nearest', 'bilinear'],
+                        default='nearest',
+                        help='Take the intensity of the grid cell containing each location, or interpolate between the four nearest grid cells')
+
+    parser.add_argument('--columns',
+                        type=str,
+                        default=None,
+                        help='Comma separated list of the location columns to read and write, as well as lon and lat. Default is all columns')
+
+    parser.add_argument('--chunksize',
+                        type=int,
+                        default=None,
+                        help='Number of locations read, looked up and written at one time. Use for location files too large to hold in memory. Default reads all locations at once')
+
+    parser.add_argument('--nworkers',
+                        type=int,
+                        default=1,
+                        help='Number of worker processes used to read the ShakeMap and uncertainty grids at the same time')
+
+    parser.add_argument('--use_cache',
+                        action='store_true',
+                        help='Keep the parsed ShakeMap grids in an on-disk cache so later runs load them quickly')
+
+    parser.add_argument('--cache_dir',
+                        metavar='path/to/cache/',
+                        type=str,
+                        nargs='?',
+                        default=None,
+                        help='Folder for the ShakeMap cache. Default is a .shakemap_cache folder next to the ShakeMap files')
 
     args = parser.parse_args()
 
@@ -57,22 +96,38 @@ def main(args=get_args()):
 
     # Read Shakemap into class object
     print("Reading shakemap from file...")
-    if args.shakemap_unc is not None:
-        shakemap = USGSshakemapGrid(args.shakemap, args.intensity_measure, args.shakemap_unc)
-    else:
-        shakemap = USGSshakemapGrid(args.shakemap, args.intensity_measure)
-
-    # Read locations into pandas array
-    locns = pd.read_csv(args.ifile)
-    print("\t...%i locations" % len(locns))
-
-    # Get the mean/median and std deviation from the shakemap.
-    median, stddev = shakemap.lookup(locns['lon'].values, locns['lat'].values)
-    locns[args.intensity_measure] = median
-    print(f"\t...{locns[args.intensity_measure].count():d} locations with an intensity")
-
-    # Write the output file
-    locns.to_csv(args.ofile, index=False)
+    cache = None
+    if args.use_cache or args.cache_dir is not None:
+        cache = GridFileCache(args.cache_dir)
+
+    shakemap = USGSshakemapGrid(args.shakemap, args.intensity_measure, args.shakemap_unc,
+                                cache=cache, dtype=args.dtype,
+                                nWorkers=args.nworkers)
+
+    # Columns of the locations to keep
+    columns = None
+    if args.columns is not None:
+        columns = args.columns.split(',')
+
+    # Look up the locations a chunk at a time
+    print("Looking up locations from %s..." % args.ifile)
+    nFound = 0
+
+    def lookup_chunk(locns):
+        """Add the median intensity to a chunk of locations"""
+        nonlocal nFound
+        median, stddev = shakemap.lookup(locns['lon'].values,
+                                         locns['lat'].values,
+                                         args.lookup_method)
+        locns[args.intensity_measure] = median
+        nFound += locns[args.intensity_measure].count()
+        return locns
+
+    nRead, nWritten = process_locations(args.ifile, args.ofile,
+                                        lookup_chunk, args.chunksize,
+                                        columns=columns)
+    print(f"\t...{nRead:d} locations")
+    print(f"\t...{nFound:d} locations with an intensity")
     print(f"Written location details to {args.ofile:s}")
 
     print("DONE")
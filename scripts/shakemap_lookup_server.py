@@ -0,0 +1,94 @@
+"""
+Script runs a local server that keeps ShakeMap grids and fragility curves in
+memory and answers batches of point lookups over HTTP.
+
+POST /lookup?shakemap=grid.xml&fragility=my_fragility.csv with a JSON body
+{"lon": [...], "lat": [...]} or an .npy array of lon, lat. GET /metrics for
+the request latencies. See shakemap_utils.lookup_server.
+
+"""
+import argparse as ap
+
+from shakemap_utils import GridFileCache
+from shakemap_utils.memory_cache import GridCache
+from shakemap_utils.lookup_server import LookupServer
+
+
+def get_args():
+    """Get script arguments"""
+
+    parser = ap.ArgumentParser(description='Serve shakemap lookups from grids kept in memory',
+                               formatter_class=ap.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('--host',
+                        type=str,
+                        default='127.0.0.1',
+                        help='Address to listen on')
+
+    parser.add_argument('--port',
+                        type=int,
+                        default=8765,
+                        help='Port to listen on')
+
+    parser.add_argument('--data_dir',
+                        metavar='path/to/shakemaps/',
+                        type=str,
+                        default=None,
+                        help='Only serve files within this folder, with file names relative to it. Default allows any file')
+
+    parser.add_argument('--max_memory',
+                        type=float,
+                        default=1000,
+                        help='Memory in MB used to keep ShakeMap grids loaded. The least recently used are dropped beyond this')
+
+    parser.add_argument('--dtype',
+                        type=str,
+                        choices=['float64', 'float32', 'int16'],
+                        default='float64',
+                        help='How the ShakeMap grids are stored in memory. float32 and int16 use half and a quarter of the memory')
+
+    parser.add_argument('--use_cache',
+                        action='store_true',
+                        help='Keep the parsed ShakeMap grids in an on-disk cache so later loads are quick')
+
+    parser.add_argument('--cache_dir',
+                        metavar='path/to/cache/',
+                        type=str,
+                        nargs='?',
+                        default=None,
+                        help='Folder for the ShakeMap cache. Default is a .shakemap_cache folder next to the ShakeMap files')
+
+    parser.add_argument('--quiet',
+                        action='store_true',
+                        help='Do not log each request')
+
+    args = parser.parse_args()
+
+    return args
+
+
+def main(args=get_args()):
+    """Main script."""
+
+    cache = None
+    if args.use_cache or args.cache_dir is not None:
+        cache = GridFileCache(args.cache_dir)
+
+    grids = GridCache(args.max_memory*1e6)
+    server = LookupServer((args.host, args.port), grids=grids,
+                          dataDir=args.data_dir, isQuiet=args.quiet,
+                          cache=cache, dtype=args.dtype)
+
+    print(f"Serving shakemap lookups on {server.url()}, Ctrl-C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping")
+    finally:
+        server.server_close()
+
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -19,7 +19,8 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     scripts=['scripts/find_and_download_shakemap.py',
              'scripts/shakemap_lookup.py',
-             'scripts/shakemap_estimate_damage.py'],
+             'scripts/shakemap_estimate_damage.py',
+             'scripts/shakemap_lookup_server.py'],
     packages=setuptools.find_packages(),
     classifiers=(
         "Programming Language :: Python :: 3",
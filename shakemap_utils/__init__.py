@@ -1,6 +1,12 @@
 from .usgs_web import search_usgsevents
 from .usgs_web import query_shakemapdetail, get_shakemapgrid_url
 from .usgs_web import download_shakemapgrid
-from .usgs_shakemap_grid import USGSshakemapGrid
+from .usgs_shakemap_grid import USGSshakemapGrid, USGSshakemapFields
 from .fragility_curve import FragilityCurve
+from .fragility_library import FragilityLibrary
+from .grid_cache import GridFileCache
+from .catalog import ShakemapCatalog
+from .event_set import LocationBlocks, lookup_events
+from .portfolio_index import PortfolioIndex
+from .memory_cache import GridCache
 name = "shakemap_utils"
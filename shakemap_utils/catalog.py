@@ -0,0 +1,189 @@
+"""Local catalog of downloaded ShakeMap grid files.
+
+The header of each grid and uncertainty file in a folder is read (without
+the grid data) and stored in an SQLite database, indexed by event id and
+version, so the file for an event can be found without opening any files.
+
+"""
+import os
+import glob
+import sqlite3
+
+from .usgs_shakemap_grid import USGSshakemapGrid, read_header
+
+
+# Columns of the table of files
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    folder TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    kind TEXT,
+    event_id TEXT,
+    shakemap_id TEXT,
+    version REAL,
+    magnitude REAL,
+    event_time TEXT,
+    lon_min REAL,
+    lon_max REAL,
+    lat_min REAL,
+    lat_max REAL,
+    nx INTEGER,
+    ny INTEGER,
+    fields TEXT
+);
+CREATE INDEX IF NOT EXISTS files_folder ON files (folder);
+CREATE INDEX IF NOT EXISTS files_event ON files (event_id, kind, version);
+CREATE INDEX IF NOT EXISTS files_shakemap ON files (shakemap_id, kind, version);
+"""
+
+
+def header_record(ifile):
+    """Return a dict of the catalog columns for a grid file from its header"""
+    header = read_header(ifile)
+    hdr, ev = header['hdr'], header['eventInfo']
+    st = os.stat(ifile)
+
+    # Uncertainty files only hold standard deviations
+    fields = [f for f in header['fieldNames'] if f not in ('LON', 'LAT')]
+    isUnc = len(fields) > 0 and all(f.startswith('STD') for f in fields)
+
+    return {'path': os.path.abspath(ifile),
+            'folder': os.path.dirname(os.path.abspath(ifile)),
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'kind': 'uncertainty' if isUnc else 'grid',
+            'event_id': hdr.get('event_id'),
+            'shakemap_id': hdr.get('shakemap_id'),
+            'version': float(hdr.get('shakemap_version', 'nan')),
+            'magnitude': float(ev.get('magnitude', 'nan')),
+            'event_time': ev.get('event_timestamp'),
+            'lon_min': header['xylims'][0],
+            'lon_max': header['xylims'][1],
+            'lat_min': header['xylims'][2],
+            'lat_max': header['xylims'][3],
+            'nx': header['nx'],
+            'ny': header['ny'],
+            'fields': ','.join(fields)}
+
+
+class ShakemapCatalog:
+    """ Class defines an SQLite catalog of local ShakeMap grid files
+
+    Properties
+     dbFile: name of the SQLite database file
+     conn: connection to the database
+    """
+
+    def __init__(self, dbFile):
+        """Open the catalog, creating the database if it doesn't exist.
+
+        Keyword arguments:
+        dbFile : (string) SQLite database file, e.g.
+                 'path/to/usgs_shakemap/catalog.sqlite'
+        """
+        self.dbFile = dbFile
+        self.conn = sqlite3.connect(dbFile)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        return
+
+    def close(self):
+        self.conn.close()
+        return
+
+    def scan(self, idir, pattern='*.xml*', isQuiet=False):
+        """Add the grid files in a folder to the catalog.
+
+        Only files that are new or have changed size or modification time
+        since the last scan have their header read. Files in the catalog that
+        are no longer in the folder are removed.
+
+        Returns the number of files (re)read.
+        """
+        # What we already know about the folder
+        idir = os.path.abspath(idir)
+        known = {r['path']: (r['size'], r['mtime_ns'])
+                 for r in self.conn.execute(
+                     'SELECT path, size, mtime_ns FROM files WHERE folder = ?',
+                     (idir,))}
+
+        nRead = 0
+        found = set()
+        for ifile in sorted(glob.glob(os.path.join(idir, pattern))):
+            st = os.stat(ifile)
+            path = os.path.abspath(ifile)
+            found.add(path)
+            if known.get(path) == (st.st_size, st.st_mtime_ns):
+                continue
+
+            try:
+                rec = header_record(ifile)
+            except Exception as e:
+                if not isQuiet:
+                    print("WARNING: skipping %s: %s" % (ifile, e))
+                continue
+
+            self.conn.execute(
+                'INSERT OR REPLACE INTO files (%s) VALUES (%s)' %
+                (', '.join(rec), ', '.join(['?']*len(rec))),
+                list(rec.values()))
+            nRead += 1
+
+        # Remove files that have gone
+        for path in set(known) - found:
+            self.conn.execute('DELETE FROM files WHERE path = ?', (path,))
+
+        self.conn.commit()
+
+        if not isQuiet:
+            print("Catalog scan of %s: %i files read, %i removed" %
+                  (idir, nRead, len(set(known) - found)))
+
+        return nRead
+
+    def find(self, eventId, version=None, kind='grid'):
+        """Return the path of the grid file for an event, or None if it is not
+        in the catalog.
+
+        Keyword arguments:
+        eventId : (string) event_id or shakemap_id of the shakemap
+        version : (float) shakemap version. Default is the latest version.
+        kind : (string) 'grid' or 'uncertainty'
+        """
+        query = ('SELECT path FROM files WHERE kind = ? AND '
+                 '(event_id = ? OR shakemap_id = ?)')
+        params = [kind, eventId, eventId]
+        if version is not None:
+            query += ' AND version = ?'
+            params.append(float(version))
+
+        row = self.conn.execute(query + ' ORDER BY version DESC LIMIT 1',
+                                params).fetchone()
+
+        return None if row is None else row['path']
+
+    def events(self):
+        """Return a list of dicts of the catalog details of all grid files"""
+        return [dict(r) for r in self.conn.execute(
+            "SELECT * FROM files WHERE kind = 'grid' "
+            "ORDER BY event_time, version")]
+
+    def open(self, eventId, intensMeasure, version=None, **kwargs):
+        """Return the USGSshakemapGrid for an event, with its uncertainty grid
+        of the same version if it is in the catalog.
+
+        Other keyword arguments are passed on to USGSshakemapGrid.
+        """
+        ifile = self.find(eventId, version)
+        if ifile is None:
+            raise ValueError('Event %s (version %s) not in catalog %s' %
+                             (eventId, version, self.dbFile))
+
+        # Use the version found for the uncertainty
+        version = self.conn.execute('SELECT version FROM files WHERE path = ?',
+                                    (ifile,)).fetchone()['version']
+        ifile_unc = self.find(eventId, version, kind='uncertainty')
+
+        return USGSshakemapGrid(ifile, intensMeasure, ifile_unc, **kwargs)
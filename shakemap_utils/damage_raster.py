@@ -0,0 +1,234 @@
+"""Damage probabilities on the lattice of a ShakeMap grid.
+
+The fragility curves are applied once to every cell of the grid, giving a
+raster of the exceedance probability of each damage state. The damage
+probabilities of any portfolio are then a lookup in the raster, with no
+fragility interpolation per location, and the raster can be kept in a
+GridFileCache next to the parsed grid so that later runs against the same
+event share it.
+
+The raster is a numpy array (lat, lon, damage state) with the south-west
+cell first, so that the probabilities of all damage states of a cell are
+next to each other in memory and one gather per point looks them all up.
+Building it costs about as much as evaluating the curves at one location per
+grid cell, so it pays off once portfolios add up to more locations than the
+grid has cells, less when it is loaded from the cache.
+
+"""
+import hashlib
+import numpy as np
+
+from .grid_lookup import cell_index, lookup_points, BLOCK_SIZE
+from .fragility_curve import QUAD_NODES
+from .usgs_shakemap_grid import USGSshakemapGrid, decode
+
+
+def fragility_key(fragilityCurve):
+    """Return a string identifying the values of a fragility curve, and its
+    table if it has one"""
+    h = hashlib.sha1()
+    h.update(('%s|%s' % (fragilityCurve.intensity_measure,
+                         '|'.join(fragilityCurve.damagestates()))).encode())
+    h.update(np.ascontiguousarray(fragilityCurve.intensities,
+                                  dtype=float).tobytes())
+    h.update(np.ascontiguousarray(fragilityCurve.exceedprob.values,
+                                  dtype=float).tobytes())
+    if fragilityCurve.table is not None:
+        h.update(('|%r|%r' % (fragilityCurve.tableStep,
+                              fragilityCurve.isTableLinear)).encode())
+
+    return h.hexdigest()[:24]
+
+
+def grid_probabilities(shakemap, fragilityCurve, useUncertainty=False,
+                       nNodes=QUAD_NODES, dtype=np.float32):
+    """Return the exceedance probabilities of each damage state at every cell
+    of a USGSshakemapGrid, as a numpy array (lat, lon, damage state) with the
+    south-west cell first. nan where the grid has no intensity.
+
+    Keyword arguments:
+    useUncertainty : (logical) average over the uncertainty in the intensity
+                     of each cell, see FragilityCurve.interp_uncertain.
+    nNodes : (int) number of quadrature points per cell if useUncertainty.
+    dtype : numpy float type of the raster.
+    """
+    median = np.ravel(decode(shakemap.grid, shakemap.scale))
+    if useUncertainty:
+        std = np.ravel(decode(shakemap.grid_std, shakemap.stdScale))
+        probs = fragilityCurve.interp_uncertain(median, std, nNodes)
+    else:
+        probs = fragilityCurve.interp_all(median)
+
+    return probs.astype(dtype).reshape(shakemap.ny(), shakemap.nx(), -1)
+
+
+class DamageRaster:
+    """ Class defines the exceedance probabilities of each damage state of a
+    fragility curve at every cell of a ShakeMap grid
+
+    Properties
+     raster: numpy array (lat, lon, damage state) of the probabilities, the
+       south-west cell first. A read-only memory map of the cache file if
+       asked for.
+     damagestates: names of the damage states
+     intensMeasure: intensity measure of the grid and fragility curve
+     x0, x1, y0, y1: lon and lat of the first and last grid cell centers
+     hdr, eventInfo: the ShakeMap details, as in USGSshakemapGrid
+     isCached: (logical) True if the raster was loaded from the cache
+    """
+
+    def __init__(self, ifile_xml, fragilityCurve, ifile_unc=None, cache=None,
+                 shakemap=None, useUncertainty=False, nNodes=QUAD_NODES,
+                 dtype=np.float32, useMemmap=False, ignoreSVEL600=False,
+                 gridDtype=np.float64):
+        """Constructor
+
+        Keyword arguments:
+        ifile_xml : (string) ShakeMap grid xml file, or a USGSshakemapGrid
+                    that has already been read, in which case nothing is
+                    cached.
+        fragilityCurve : (FragilityCurve) curves applied to the grid. A
+                         tabulated curve gives a raster of the table values.
+        ifile_unc : (string) uncertainty xml file, used if useUncertainty.
+        cache : (GridFileCache) if given, the raster is loaded from this
+                cache, or stored there after it is computed. Entries are
+                keyed on the grid file, the fragility curve and the options
+                below, and dropped when the grid file changes.
+        shakemap : (USGSshakemapGrid) grid already read from ifile_xml and
+                   ifile_unc, used to compute the raster if it is not in the
+                   cache rather than reading the files again.
+        useUncertainty : (logical) average the probabilities over the
+                         uncertainty in the intensity of each cell. Default
+                         is False.
+        nNodes : (int) number of quadrature points per cell if
+                 useUncertainty.
+        dtype : numpy float type of the raster, float32 (default) or
+                float64.
+        useMemmap : (logical) keep a cached raster as a read-only memory map
+                    rather than reading it into memory. Default is False.
+        ignoreSVEL600 : (logical) as USGSshakemapGrid, no probabilities in
+                        the sea.
+        gridDtype : numpy type the grid is read as, see USGSshakemapGrid.
+                    The type of shakemap if it is given. Compact types
+                    round the intensities, so give other rasters.
+        """
+        self.isCached = False
+
+        if isinstance(ifile_xml, USGSshakemapGrid):
+            shakemap = ifile_xml
+            ifile_xml = None
+            cache = None
+
+        if shakemap is not None:
+            gridDtype = shakemap.grid.dtype
+
+        # Everything the raster depends on other than the grid file
+        variant = None
+        if cache is not None:
+            uncKey = ''
+            if useUncertainty and ifile_unc is not None:
+                uncKey = cache.key(ifile_unc)
+            variant = 'damage|%s|%s|%s|%i|%i|%s|%s|%s' % (
+                fragilityCurve.intensity_measure, fragility_key(fragilityCurve),
+                uncKey, useUncertainty, nNodes, ignoreSVEL600,
+                np.dtype(dtype).str, np.dtype(gridDtype).str)
+
+            cached = cache.get(ifile_xml, 'r' if useMemmap else None, variant)
+            if cached is not None:
+                self.set_meta(cached[0])
+                self.raster = cached[1]
+                self.isCached = True
+                return
+
+        # Compute from the grid, reading it if we have to
+        if shakemap is None:
+            shakemap = USGSshakemapGrid(
+                ifile_xml, fragilityCurve.intensity_measure,
+                ifile_unc if useUncertainty else None, isQuiet=True,
+                ignoreSVEL600=ignoreSVEL600, dtype=gridDtype)
+        if useUncertainty and not shakemap.has_std():
+            print("WARNING: no uncertainty grid. " +
+                  "Damage probabilities only based on median intensities")
+
+        meta = {'hdr': shakemap.hdr, 'eventInfo': shakemap.eventInfo,
+                'xylims': [float(v) for v in (shakemap.x0, shakemap.x1,
+                                               shakemap.y0, shakemap.y1)],
+                'intensMeasure': fragilityCurve.intensity_measure,
+                'damagestates': list(fragilityCurve.damagestates())}
+        self.set_meta(meta)
+        self.raster = grid_probabilities(shakemap, fragilityCurve,
+                                         useUncertainty, nNodes, dtype)
+
+        if cache is not None:
+            cache.put(ifile_xml, meta, self.raster, variant)
+            if useMemmap:
+                # Keep the raster in memory if it was not kept in the cache
+                cached = cache.get(ifile_xml, 'r', variant)
+                if cached is not None:
+                    self.raster = cached[1]
+
+        return
+
+    def set_meta(self, meta):
+        """Set the grid details from a meta data dict"""
+        self.hdr = meta['hdr']
+        self.eventInfo = meta['eventInfo']
+        self.x0, self.x1, self.y0, self.y1 = meta['xylims']
+        self.intensMeasure = meta['intensMeasure']
+        self.damagestates = list(meta['damagestates'])
+        return
+
+    # Grid dimensions and spacing, as USGSshakemapGrid
+    def nx(self):
+        return self.raster.shape[1]
+
+    def ny(self):
+        return self.raster.shape[0]
+
+    def dx(self):
+        return (self.x1 - self.x0)/(self.nx()-1)
+
+    def dy(self):
+        return (self.y1 - self.y0)/(self.ny()-1)
+
+    def lookup(self, xpts, ypts, method='nearest', out=None):
+        """Return the exceedance probabilities at each of the points, as a
+        numpy array with a row for each point and a column for each damage
+        state, as FragilityCurve.interp_all. nan outside the grid or where
+        it has no intensity.
+
+        Keyword arguments:
+        xpts, ypts : numpy arrays of the lon and lat of the points
+        method : 'nearest' (default) takes the probabilities of the grid cell
+                 containing the point, the same as interpolating the curves
+                 at the intensity USGSshakemapGrid.lookup gives. 'bilinear'
+                 interpolates the probabilities, not the intensity, between
+                 the four nearest grid cell centers.
+        out : array of shape (number of points, number of damage states) and
+              the type of the raster to write the probabilities into.
+        """
+        xpts = np.asarray(xpts, dtype=float).ravel()
+        ypts = np.asarray(ypts, dtype=float).ravel()
+        nPts = len(xpts)
+        nx, ny, nStates = self.nx(), self.ny(), len(self.damagestates)
+        if out is None:
+            out = np.empty((nPts, nStates), dtype=self.raster.dtype)
+
+        if method != 'nearest':
+            lookup_points([self.raster[:, :, j] for j in range(nStates)],
+                          [None]*nStates, xpts, ypts, self.x0, self.y0,
+                          self.dx(), self.dy(), method,
+                          [out[:, j] for j in range(nStates)])
+            return out
+
+        # One row of the flattened raster per point holds all the states
+        cells = self.raster.reshape(ny*nx, nStates)
+        for i0 in range(0, nPts, BLOCK_SIZE):
+            i1 = min(i0 + BLOCK_SIZE, nPts)
+            iLon, iLat, isIn = cell_index(xpts[i0:i1], ypts[i0:i1], self.x0,
+                                          self.y0, self.dx(), self.dy(), nx,
+                                          ny)
+            np.take(cells, iLat*nx + iLon, axis=0, out=out[i0:i1])
+            out[i0:i1][~isIn] = np.nan
+
+        return out
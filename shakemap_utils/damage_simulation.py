@@ -0,0 +1,265 @@
+"""Monte Carlo simulation of the damage to a portfolio of locations.
+
+Each realisation samples the intensity at every location from its median and
+standard deviation, then a damage state from the fragility curve, and counts
+the locations at or above each damage state. Realisations are run in batches
+of vectorised arrays, each batch with its own random generator spawned from
+one seed, so results are the same however many workers run them. Only a
+histogram of the counts is kept, so memory does not grow with the number of
+realisations, apart from one float per realisation for the loss to the
+portfolio if asked for.
+
+"""
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from .fragility_library import LocationCurves
+
+
+# Number of location-realisations sampled at a time
+SAMPLES_PER_BATCH = 2**20
+
+
+class DamageCounts:
+    """ Class defines the distribution over realisations of the number of
+    locations at or above each damage state
+
+    Properties
+     damagestates: names of the damage states
+     nLocations: number of locations in the portfolio
+     nRealisations: number of realisations added
+     histogram: 2-d numpy array, histogram[j, k] is the number of
+       realisations with k locations at or above damage state j
+     losses: numpy vector of the loss to the portfolio in each realisation,
+       if simulated, otherwise empty. Takes 8 bytes per realisation.
+    """
+
+    def __init__(self, damagestates, nLocations):
+        self.damagestates = list(damagestates)
+        self.nLocations = nLocations
+        self.nRealisations = 0
+        self.histogram = np.zeros((len(self.damagestates), nLocations + 1),
+                                  dtype=np.int64)
+
+        # Losses of each batch, joined when first read
+        self._losses = []
+
+        return
+
+    @property
+    def losses(self):
+        if len(self._losses) != 1:
+            self._losses = [np.concatenate([np.zeros(0)] + self._losses)]
+        return self._losses[0]
+
+    def add(self, counts, losses=None):
+        """Add realisations, given as an array with a row for each
+        realisation and a column for each damage state of the number of
+        locations at or above it, and optionally their losses"""
+        for j in range(len(self.damagestates)):
+            self.histogram[j] += np.bincount(counts[:, j],
+                                             minlength=self.nLocations + 1)
+        self.nRealisations += len(counts)
+        if losses is not None:
+            self._losses.append(np.asarray(losses, dtype=float))
+
+        return
+
+    def merge(self, other):
+        """Add the realisations of another DamageCounts of the same
+        portfolio"""
+        if (other.damagestates != self.damagestates or
+                other.nLocations != self.nLocations):
+            raise ValueError("Cannot merge counts of different portfolios")
+        self.histogram += other.histogram
+        self.nRealisations += other.nRealisations
+        self._losses.extend(other._losses)
+
+        return
+
+    def mean(self):
+        """Return the mean number of locations at or above each damage
+        state"""
+        k = np.arange(self.nLocations + 1)
+        return self.histogram @ k / self.nRealisations
+
+    def std(self):
+        """Return the standard deviation of the number of locations at or
+        above each damage state"""
+        k = np.arange(self.nLocations + 1)
+        mean = self.mean()
+        return np.sqrt(self.histogram @ k**2 / self.nRealisations - mean**2)
+
+    def percentile(self, q):
+        """Return the q-th percentile (0-100) of the number of locations at
+        or above each damage state, the lowest count reached by at least q%
+        of the realisations"""
+        cdf = np.cumsum(self.histogram, axis=1)
+        target = q / 100 * self.nRealisations
+        return np.array([np.searchsorted(c, target) for c in cdf])
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """Return a pandas dataframe of the mean, standard deviation and
+        percentiles for each damage state"""
+        out = pd.DataFrame({'mean': self.mean(), 'std': self.std()},
+                           index=pd.Index(self.damagestates,
+                                          name='damage_state'))
+        for q in percentiles:
+            out['p%g' % q] = self.percentile(q)
+
+        return out
+
+    def loss_summary(self, percentiles=(50, 90, 99)):
+        """Return a pandas series of the mean, standard deviation and
+        percentiles of the loss to the portfolio"""
+        out = {'mean': np.mean(self.losses), 'std': np.std(self.losses)}
+        for q in percentiles:
+            out['p%g' % q] = np.percentile(self.losses, q)
+
+        return pd.Series(out, name='loss')
+
+
+def sample_intensities(medians, stddevs, eps, isLognormal):
+    """Return intensities of each location for each realisation given the
+    standard normal deviates eps, with a row for each realisation"""
+    if isLognormal:
+        return medians * np.exp(stddevs * eps)
+    return medians + stddevs * eps
+
+
+def simulate_batch(fragilityCurve, medians, stddevs, rng, nRealisations,
+                   isLognormal, eps=None, tiv=None, damageRatios=None):
+    """Simulate a batch of realisations with one random generator.
+
+    Returns an integer array with a row for each realisation and a column
+    for each damage state, of the number of locations at or above it, and
+    a vector of the loss of each realisation if tiv and damageRatios are
+    given, otherwise None.
+    eps are the standard normal residuals of each realisation and location,
+    sampled independently if not given.
+    """
+    nPts = len(medians)
+
+    # Intensity at each location, then the exceedance probabilities there
+    if eps is None:
+        eps = rng.standard_normal((nRealisations, nPts))
+    x = sample_intensities(medians, stddevs, eps, isLognormal)
+    probs = fragilityCurve.interp_all(x.ravel())
+    probs = probs.reshape(nRealisations, nPts, -1)
+
+    # One uniform per location and realisation picks the damage state, so
+    # that a location above one state is above all the lower ones
+    u = rng.random((nRealisations, nPts))
+    counts = np.empty((nRealisations, probs.shape[2]), dtype=np.int64)
+    losses = None
+    if tiv is not None:
+        # Each state adds its increase in ratio over the state below
+        steps = np.diff(damageRatios, prepend=0.0)
+        losses = np.zeros(nRealisations)
+    for j in range(probs.shape[2]):
+        isAbove = u < probs[:, :, j]
+        counts[:, j] = np.count_nonzero(isAbove, axis=1)
+        if tiv is not None:
+            losses += (isAbove @ tiv) * steps[j]
+
+    return counts, losses
+
+
+def simulate_batches(fragilityCurve, medians, stddevs, seeds, batchSizes,
+                     isLognormal, sampler=None, isValid=None, tiv=None,
+                     damageRatios=None):
+    """Simulate batches of realisations, each with its own seed, returning
+    a DamageCounts"""
+    out = DamageCounts(fragilityCurve.damagestates(), len(medians))
+    for seed, n in zip(seeds, batchSizes):
+        rng = np.random.default_rng(seed)
+
+        # Residuals from the sampler, of the locations kept
+        eps = None
+        if sampler is not None:
+            eps = np.nan_to_num(sampler(rng, n)[:, isValid])
+
+        out.add(*simulate_batch(fragilityCurve, medians, stddevs, rng, n,
+                                isLognormal, eps, tiv, damageRatios))
+
+    return out
+
+
+def simulate_damage(fragilityCurve, medians, stddevs, nRealisations,
+                    seed=None, batchSize=None, nWorkers=1, isLognormal=None,
+                    sampler=None, tiv=None, damageRatios=None):
+    """Simulate the number of locations of a portfolio at or above each
+    damage state.
+
+    Returns a DamageCounts of the distribution over the realisations.
+
+    Keyword arguments:
+    fragilityCurve : (FragilityCurve) curve used for every location, or
+                     LocationCurves of a curve per location from
+                     FragilityLibrary.for_locations. Use tabulate() on the
+                     curves first for a quicker simulation.
+    medians, stddevs : numpy vectors of the median intensity at each location
+                       and its standard deviation, as from
+                       USGSshakemapGrid.lookup. Locations with no median are
+                       left out.
+    nRealisations : (int) number of realisations.
+    seed : (int) seed of the random numbers. Default is a random seed.
+    batchSize : (int) number of realisations sampled together. Memory used is
+                about batchSize*(number of locations)*(number of damage
+                states) floats. Default keeps that near SAMPLES_PER_BATCH.
+                Results depend on seed and batchSize but not nWorkers.
+    nWorkers : (int) number of processes running batches at the same time.
+    isLognormal : see FragilityCurve.interp_uncertain.
+    sampler : function sampler(rng, n) returning standard normal residuals
+              with a row for each of n realisations and a column for each
+              location, e.g. CorrelatedField.sampler(lon, lat) for spatially
+              correlated intensities. Default samples every location
+              independently. nan residuals are taken as zero.
+    tiv, damageRatios : numpy vectors of the total insured value of each
+                        location and the damage ratio of each damage state,
+                        to also simulate the loss to the portfolio. See
+                        loss_aggregation.read_damage_ratios.
+    """
+    medians = np.asarray(medians, dtype=float)
+    stddevs = np.asarray(stddevs, dtype=float)
+    if medians.shape != stddevs.shape:
+        raise ValueError("Medians and standard deviations differ in shape")
+    if isLognormal is None:
+        isLognormal = fragilityCurve.intensity_measure.upper() != 'MMI'
+
+    # Leave out locations without an intensity
+    isValid = ~np.isnan(medians)
+    medians = medians[isValid]
+    stddevs = np.nan_to_num(stddevs[isValid])
+    if isinstance(fragilityCurve, LocationCurves):
+        fragilityCurve = fragilityCurve.subset(isValid)
+    if tiv is not None:
+        tiv = np.asarray(tiv, dtype=float)[isValid]
+        damageRatios = np.asarray(damageRatios, dtype=float)
+
+    # Split into batches, each with its own seed
+    if batchSize is None:
+        batchSize = max(1, SAMPLES_PER_BATCH // max(len(medians), 1))
+    batchSizes = [min(batchSize, nRealisations - i)
+                  for i in range(0, nRealisations, batchSize)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batchSizes))
+
+    if nWorkers <= 1 or len(batchSizes) <= 1:
+        return simulate_batches(fragilityCurve, medians, stddevs, seeds,
+                                batchSizes, isLognormal, sampler, isValid,
+                                tiv, damageRatios)
+
+    # Share the batches between the processes and merge their counts
+    nWorkers = min(nWorkers, len(batchSizes))
+    out = DamageCounts(fragilityCurve.damagestates(), len(medians))
+    with ProcessPoolExecutor(nWorkers) as pool:
+        futures = [pool.submit(simulate_batches, fragilityCurve, medians,
+                               stddevs, seeds[i::nWorkers],
+                               batchSizes[i::nWorkers], isLognormal,
+                               sampler, isValid, tiv, damageRatios)
+                   for i in range(nWorkers)]
+        for f in futures:
+            out.merge(f.result())
+
+    return out
@@ -0,0 +1,204 @@
+"""Look up a fixed set of locations against many ShakeMaps.
+
+The locations are sorted once along a space-filling (Morton) curve of coarse
+lat/lon cells and split into blocks of neighbouring points, each with its
+bounding box. Each ShakeMap is then only looked up for the blocks that
+overlap its extent, and the results for all events are collected into
+(location x event) matrices of median and standard deviation. Events are
+processed by a pool of threads, each writing its own column.
+
+"""
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from .usgs_shakemap_grid import USGSshakemapGrid
+
+
+# Number of locations in each block. Smaller blocks fit the extent of an
+# event more closely, at the cost of more lookups
+BLOCK_SIZE = 8192
+
+# Size in degrees of the cells used to order the locations
+CELL_SIZE = 0.5
+
+
+def spread_bits(v):
+    """Return integers below 2**16 with a zero bit inserted between each bit"""
+    v = np.asarray(v, dtype=np.uint64)
+    for shift, mask in ((8, 0x00FF00FF), (4, 0x0F0F0F0F), (2, 0x33333333),
+                        (1, 0x55555555)):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+
+    return v
+
+
+def morton_key(ix, iy):
+    """Return the Morton (z-order) key of integer cell indices below 2**16,
+    interleaving the bits of ix and iy.
+
+    """
+    return spread_bits(ix) | (spread_bits(iy) << np.uint64(1))
+
+
+class LocationBlocks:
+    """ Class defines a set of locations sorted into blocks of neighbours
+
+    Properties
+     order: index of the original location of each sorted location
+     lon, lat: sorted location coordinates
+     starts: index of the first sorted location of each block, plus the
+       number of locations at the end
+     bounds: numpy array (number of blocks, 4) of the [xmin, xmax, ymin, ymax]
+       of the locations in each block
+    """
+
+    def __init__(self, xpts, ypts, blockSize=BLOCK_SIZE, cellSize=CELL_SIZE):
+        """Sort the locations and work out the extent of each block.
+
+        Keyword arguments:
+        xpts, ypts : numpy arrays of the lon and lat of the locations
+        blockSize : (int) number of locations in each block
+        cellSize : (float) size in degrees of the cells used to order the
+                   locations. Locations without coordinates go last.
+        """
+        xpts = np.asarray(xpts, dtype=float).ravel()
+        ypts = np.asarray(ypts, dtype=float).ravel()
+
+        # Order along the curve through the cells
+        isOk = np.isfinite(xpts) & np.isfinite(ypts)
+        ix = np.floor((np.where(isOk, xpts, 0) + 180.0)/cellSize)
+        iy = np.floor((np.where(isOk, ypts, 0) + 90.0)/cellSize)
+        key = morton_key(np.clip(ix, 0, 2**16 - 1), np.clip(iy, 0, 2**16 - 1))
+        key[~isOk] = np.iinfo(np.uint64).max
+        self.order = np.argsort(key, kind='stable')
+        self.lon = xpts[self.order]
+        self.lat = ypts[self.order]
+
+        # Extent of each block, ignoring missing coordinates
+        self.starts = np.r_[np.arange(0, len(xpts), blockSize), len(xpts)]
+        if len(xpts) == 0:
+            self.bounds = np.empty((0, 4))
+        else:
+            with np.errstate(invalid='ignore'):
+                self.bounds = np.column_stack([
+                    np.fmin.reduceat(self.lon, self.starts[:-1]),
+                    np.fmax.reduceat(self.lon, self.starts[:-1]),
+                    np.fmin.reduceat(self.lat, self.starts[:-1]),
+                    np.fmax.reduceat(self.lat, self.starts[:-1])])
+
+        return
+
+    def npoints(self):
+        return len(self.order)
+
+    def nblocks(self):
+        return len(self.starts) - 1
+
+    def blocks_in(self, xylims):
+        """Return the indices of the blocks overlapping an extent
+        [xmin, xmax, ymin, ymax]
+
+        """
+        b = self.bounds
+        isIn = ((b[:, 1] >= xylims[0]) & (b[:, 0] <= xylims[1]) &
+                (b[:, 3] >= xylims[2]) & (b[:, 2] <= xylims[3]))
+        return np.flatnonzero(isIn)
+
+    def ranges_in(self, xylims):
+        """Return a list of (start, end) of the runs of sorted locations in
+        the blocks overlapping an extent, joining neighbouring blocks
+
+        """
+        iBlocks = self.blocks_in(xylims)
+        if len(iBlocks) == 0:
+            return []
+
+        # Split where the blocks are not consecutive
+        iSplit = np.flatnonzero(np.diff(iBlocks) > 1) + 1
+        firsts = iBlocks[np.r_[0, iSplit]]
+        lasts = iBlocks[np.r_[iSplit - 1, len(iBlocks) - 1]]
+
+        return list(zip(self.starts[firsts], self.starts[lasts + 1]))
+
+
+def load_shakemap(item, intensMeasure, grids=None, **kwargs):
+    """Return a USGSshakemapGrid from an item of an event set.
+
+    Keyword arguments:
+    item : USGSshakemapGrid, grid file name, or tuple of grid and
+           uncertainty file names.
+    intensMeasure : (string) intensity measure read from files.
+    grids : (GridCache) in-memory cache used to load files.
+    Other keyword arguments are passed on to USGSshakemapGrid.
+    """
+    if isinstance(item, USGSshakemapGrid):
+        return item
+
+    if isinstance(item, (tuple, list)):
+        ifile_xml, ifile_unc = item
+    else:
+        ifile_xml, ifile_unc = item, None
+
+    if grids is not None:
+        return grids.shakemap(ifile_xml, intensMeasure, ifile_unc, **kwargs)
+
+    return USGSshakemapGrid(ifile_xml, intensMeasure, ifile_unc,
+                            isQuiet=True, **kwargs)
+
+
+def lookup_events(locations, shakemaps, intensMeasure=None, method='nearest',
+                  nWorkers=1, outDtype=float, grids=None, **kwargs):
+    """Look up a set of locations in every ShakeMap of an event set.
+
+    Returns numpy arrays of the median and standard deviation with shape
+    (number of locations, number of events), in the order of the locations
+    and events given. Values are nan where an event doesn't cover a location.
+
+    Keyword arguments:
+    locations : LocationBlocks, or tuple of numpy arrays (lon, lat). Pass
+                a LocationBlocks to reuse the sorting over several calls.
+    shakemaps : list of USGSshakemapGrid, grid file names or tuples of grid
+                and uncertainty file names. Files are read when their event
+                is processed, so only nWorkers grids are held at a time
+                unless they are kept in grids.
+    intensMeasure : (string) intensity measure read from files.
+    method : 'nearest' or 'bilinear', see USGSshakemapGrid.lookup.
+    nWorkers : (int) number of threads processing events at the same time.
+    outDtype : numpy data type of the output arrays.
+    grids : (GridCache) in-memory cache used to load files, so that grids
+            used again in later calls are not read again.
+    Other keyword arguments are passed on to USGSshakemapGrid, e.g. cache,
+    useMemmap, dtype.
+    """
+    if not isinstance(locations, LocationBlocks):
+        locations = LocationBlocks(*locations)
+
+    if intensMeasure is None and not all(isinstance(sm, USGSshakemapGrid)
+                                         for sm in shakemaps):
+        raise ValueError('intensMeasure is needed to read ShakeMap files')
+
+    nPts, nEvents = locations.npoints(), len(shakemaps)
+
+    # Each event writes a contiguous column
+    median = np.full((nPts, nEvents), np.nan, dtype=outDtype, order='F')
+    std = np.full((nPts, nEvents), np.nan, dtype=outDtype, order='F')
+
+    def lookup_event(j):
+        """Fill in the column of one event, returning the number of
+        locations looked up"""
+        sm = load_shakemap(shakemaps[j], intensMeasure, grids, **kwargs)
+        nDone = 0
+        for i0, i1 in locations.ranges_in(sm.xylims()):
+            m, s = sm.lookup(locations.lon[i0:i1], locations.lat[i0:i1],
+                             method)
+            idx = locations.order[i0:i1]
+            median[idx, j] = m
+            std[idx, j] = s
+            nDone += i1 - i0
+
+        return nDone
+
+    with ThreadPoolExecutor(max(nWorkers, 1)) as pool:
+        list(pool.map(lookup_event, range(nEvents)))
+
+    return median, std
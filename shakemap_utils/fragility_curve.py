@@ -5,7 +5,19 @@
 
 import numpy as np
 import pandas as pd
-from scipy import interpolate
+from scipy import interpolate, special
+
+
+# * Parameters
+
+
+# Number of intensities looked up in the table at a time
+BLOCK_SIZE = 8192
+
+# Gauss-Hermite nodes per location, and number of locations integrated at a
+# time, when integrating over the intensity uncertainty
+QUAD_NODES = 9
+QUAD_CHUNK_SIZE = 65536
 
 
 # * Class definition
@@ -20,6 +32,12 @@ class FragilityCurve:
                  is defined.
     exceedprob: pandas dataframe of exceedance probilities, each column is a
                 different damage state
+    interpolator: scipy PchipInterpolator of all damage states, built once
+    table: numpy array of exceedance probabilities for all damage states at
+           evenly spaced intensities, or None. Set by tabulate(), after
+           which interp_all() looks values up in the table.
+    tableStep: intensity step between rows of the table
+    tableError: bound on the difference of the table from the interpolator
 
     Initialize keyword:
 
@@ -61,6 +79,17 @@ class FragilityCurve:
 
         # TODO: Check that the exceedance prob is monotonically increasing
 
+        # One interpolator for all the damage states, evaluated together
+        self.interpolator = interpolate.PchipInterpolator(
+            self.intensities, self.exceedprob.values.astype(float), axis=0,
+            extrapolate=False)
+
+        # No lookup table until asked for
+        self.table = None
+        self.tableStep = None
+        self.tableError = None
+        self.isTableLinear = True
+
         return
 
     def minintensity(self):
@@ -79,14 +108,124 @@ class FragilityCurve:
         """ Return a list of the fragility curve's damage states."""
         return(self.exceedprob.columns)
 
-    def interp_damagestate(self, myintensities, dstate):
-        """Interpolate the curve at a list of intensities for one damage state.
+    def tabulate(self, step=0.01, isLinear=True):
+        """Tabulate all damage states at evenly spaced intensities so that
+        interp_all() looks them up by index rather than interpolating.
 
-        Returns a numpy vector of exceedance probabilities.
+        Returns a bound on the absolute difference in probability between
+        the table and the interpolator, from the derivatives of the curves.
+
+        Keyword arguments:
+        step = largest intensity step between rows of the table. The step is
+               shortened to fit a whole number of rows between the lowest and
+               highest intensity of the curve.
+        isLinear = if True blend linearly between the two nearest rows,
+                   otherwise take the nearest row.
+
+        """
+        if not step > 0:
+            raise ValueError("Table step must be positive, not %s" % step)
+
+        # Rows at evenly spaced intensities from the min to the max
+        x0, x1 = self.intensities[0], self.intensities[-1]
+        nRows = int(np.ceil((x1 - x0) / step - 1e-9)) + 1
+        xTab = np.linspace(x0, x1, nRows)
+        self.table = self.interpolator(xTab)
+        self.tableStep = (x1 - x0) / max(nRows - 1, 1)
+        self.isTableLinear = isLinear
+
+        # Differences between rows, used for the linear blending, then a
+        # row of zeros for below the curve and of nan for missing values
+        nStates = self.table.shape[1]
+        self._tableSlope = np.vstack([np.diff(self.table, axis=0),
+                                      np.zeros((3, nStates))])
+        self._tableRows = np.vstack([self.table, np.zeros((1, nStates)),
+                                     np.full((1, nStates), np.nan)])
+
+        # Bound the error from the derivatives of the cubic on each interval
+        # of the curve, f(t) = c0 t^3 + c1 t^2 + c2 t + c3 for t in [0, h]
+        c = self.interpolator.c
+        h = np.diff(self.interpolator.x)[:, None]
+        if isLinear:
+            # Linear interpolation is within step^2/8 of max|f''|, and f'' is
+            # linear so largest at one end
+            d2 = np.maximum(np.abs(2 * c[1]), np.abs(6 * c[0] * h + 2 * c[1]))
+            self.tableError = self.tableStep**2 / 8 * np.max(d2)
+        else:
+            # The nearest row is within step/2 of max|f'|, at one end or at
+            # the turning point of f'
+            tTurn = np.zeros_like(c[0])
+            np.divide(-c[1], 3 * c[0], out=tTurn, where=c[0] != 0)
+            tTurn = np.clip(tTurn, 0, h)
+            d1 = np.maximum.reduce([
+                np.abs(c[2]),
+                np.abs(3 * c[0] * h**2 + 2 * c[1] * h + c[2]),
+                np.abs(3 * c[0] * tTurn**2 + 2 * c[1] * tTurn + c[2])])
+            self.tableError = self.tableStep / 2 * np.max(d1)
+
+        return self.tableError
+
+    def interp_table(self, myintensities):
+        """Look up the table made by tabulate() for all damage states at a
+        list of intensities.
+
+        Returns a numpy array as interp_all().
+
+        Keyword arguments:
+        myintensites = numpy vector of intensities.
+
+        """
+        if self.table is None:
+            raise ValueError("No table, call tabulate() first")
+
+        myintensities = np.asarray(myintensities, dtype=float)
+        nRows = len(self.table)
+        nPts = len(myintensities)
+        exceedprob_locs = np.empty((nPts, self.table.shape[1]))
+        blend = np.empty((min(nPts, BLOCK_SIZE), self.table.shape[1]))
+
+        # Work through blocks of intensities that fit in the CPU cache
+        for i0 in range(0, nPts, BLOCK_SIZE):
+            i1 = min(i0 + BLOCK_SIZE, nPts)
+
+            # Position within the table, in rows, limited to the table
+            pos = (myintensities[i0:i1] - self.intensities[0]) / self.tableStep
+            isBelow = pos < 0
+            isMissing = np.isnan(pos)
+            np.clip(pos, 0, nRows - 1, out=pos)
+            pos[isMissing] = 0
+
+            # Row below, or nearest row, then the extra rows for values below
+            # the curve or missing
+            if self.isTableLinear:
+                iRow = pos.astype(np.intp)
+            else:
+                iRow = (pos + 0.5).astype(np.intp)
+            iRow[isBelow] = nRows
+            iRow[isMissing] = nRows + 1
+
+            out = exceedprob_locs[i0:i1]
+            np.take(self._tableRows, iRow, axis=0, out=out)
+            if self.isTableLinear:
+                # Blend with the next row by the fraction of the way to it
+                pos -= iRow
+                b = blend[:i1 - i0]
+                np.take(self._tableSlope, iRow, axis=0, out=b)
+                b *= pos[:, None]
+                out += b
+
+        return exceedprob_locs
+
+    def interp_all(self, myintensities):
+        """Interpolate the curve at a list of intensities for all damage
+        states at once.
+
+        Returns a numpy array of exceedance probabilities with a row for each
+        intensity and a column for each damage state, in the order of
+        damagestates().
 
         Keyword arguments:
         myintensites = numpy vector of intensities.
-        dstate = string of which damage state to interpolate
 
         Notes:
 
@@ -96,19 +235,132 @@ class FragilityCurve:
         * Intensities below the lowest intensity of the curve will get a
           probability of zero.
 
+        * Missing (nan) intensities get nan probabilities.
+
+        * After tabulate() the values come from the table, within tableError
+          of the interpolator.
+
         """
+        if self.table is not None:
+            return self.interp_table(myintensities)
 
-        # Build the interpolator
-        Pchip = interpolate.PchipInterpolator(self.intensities,
-                                              self.exceedprob[dstate].values,
-                                              extrapolate=False)
+        myintensities = np.asarray(myintensities, dtype=float)
 
         # Get the result of the interpolation, allow values over the max by
         # setting them equal to the max
-        exceedprob_locs = Pchip(np.fmin(myintensities, self.maxintensity()))
+        exceedprob_locs = self.interpolator(
+            np.minimum(myintensities, self.intensities[-1]))
 
         # Values below the lowest intensity value
-        # TODO: handling of nan
-        exceedprob_locs[myintensities < self.minintensity()] = 0.0
+        exceedprob_locs[myintensities < self.intensities[0]] = 0.0
+
+        return exceedprob_locs
+
+    def interp_uncertain(self, medians, stddevs, nNodes=QUAD_NODES,
+                         isLognormal=None, chunkSize=QUAD_CHUNK_SIZE):
+        """Average the curve over the uncertainty of the intensity at each
+        location, for all damage states at once.
+
+        Returns a numpy array as interp_all() of the expected exceedance
+        probabilities.
+
+        Keyword arguments:
+        medians = numpy vector of median intensities.
+        stddevs = numpy vector of their standard deviations, as given in the
+                  ShakeMap uncertainty grid.
+        nNodes = number of Gauss-Hermite quadrature nodes per location.
+        isLognormal = if True the intensity is lognormal and stddevs are of
+                      its natural log, as for PGA, PGV and PSA, otherwise
+                      normal, as for MMI. Default is from the intensity
+                      measure.
+        chunkSize = number of locations integrated at a time. Memory used is
+                    about chunkSize*nNodes*(number of damage states) floats.
+
+        Notes:
+
+        * Locations with a zero standard deviation get interp_all() of the
+          median.
+
+        * The step to zero probability below the lowest intensity of the
+          curve is integrated exactly, and the quadrature used for the rest.
+
+        * After tabulate() each node is looked up in the table.
+
+        """
+        medians = np.asarray(medians, dtype=float)
+        stddevs = np.asarray(stddevs, dtype=float)
+        if medians.shape != stddevs.shape:
+            raise ValueError("Medians and standard deviations differ in shape")
+        if isLognormal is None:
+            isLognormal = self.intensity_measure.upper() != 'MMI'
+
+        # Nodes and weights for the expectation over a standard normal
+        nodes, weights = np.polynomial.hermite.hermgauss(nNodes)
+        nodes *= np.sqrt(2)
+        weights /= np.sqrt(np.pi)
+
+        # Lowest intensity of the curve and the probabilities there
+        x0 = self.intensities[0]
+        pLow = self.interp_all(np.array([x0]))[0]
+
+        nPts = len(medians)
+        nStates = len(self.damagestates())
+        exceedprob_locs = np.empty((nPts, nStates))
+        for i0 in range(0, nPts, chunkSize):
+            i1 = min(i0 + chunkSize, nPts)
+
+            m, sd = medians[i0:i1], stddevs[i0:i1]
+
+            # Intensity at each node of each location, kept at or above the
+            # lowest intensity so the curve is continuous
+            if isLognormal:
+                x = m[:, None] * np.exp(sd[:, None] * nodes)
+            else:
+                x = m[:, None] + sd[:, None] * nodes
+            np.maximum(x, x0, out=x)
+
+            # Weighted sum over the nodes for all damage states
+            probs = self.interp_all(x.ravel()).reshape(i1 - i0, nNodes,
+                                                        nStates)
+            out = exceedprob_locs[i0:i1]
+            np.matmul(weights, probs, out=out)
+
+            # Take off the chance of being below the lowest intensity, where
+            # the probability steps down to zero
+            if isLognormal:
+                zLow = np.log(x0) - np.log(m)
+            else:
+                zLow = x0 - m
+            with np.errstate(divide='ignore', invalid='ignore'):
+                zLow /= sd
+            zLow[sd == 0] = np.where(m[sd == 0] < x0, np.inf, -np.inf)
+            out -= special.ndtr(zLow)[:, None] * pLow
+            np.maximum(out, 0.0, out=out)
+
+        return exceedprob_locs
+
+    def interp_damagestate(self, myintensities, dstate):
+        """Interpolate the curve at a list of intensities for one damage state.
+
+        Returns a numpy vector of exceedance probabilities.
+
+        Keyword arguments:
+        myintensites = numpy vector of intensities.
+        dstate = string of which damage state to interpolate
+
+        Notes:
+
+        * See interp_all, which is quicker when all damage states are needed.
+
+        """
+        iState = self.exceedprob.columns.get_loc(dstate)
+        myintensities = np.asarray(myintensities, dtype=float)
+
+        # Interpolate the one damage state from the same coefficients
+        Pchip = interpolate.PPoly(self.interpolator.c[:, :, iState],
+                                  self.interpolator.x, extrapolate=False)
+        exceedprob_locs = Pchip(np.minimum(myintensities,
+                                           self.intensities[-1]))
+        exceedprob_locs[myintensities < self.intensities[0]] = 0.0
 
         return exceedprob_locs
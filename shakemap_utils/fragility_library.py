@@ -0,0 +1,301 @@
+"""Module contains classes for fragility curves of many vulnerability classes.
+
+A portfolio of mixed construction, e.g. wood frame, concrete and steel
+buildings, uses a different FragilityCurve for each vulnerability class.
+The locations are sorted by class once, with a stable argsort of their class
+codes, and each group is evaluated with the interpolator (or table) its
+curve built when it was read. Groups of locations already next to each other
+are evaluated in place, so a portfolio sorted by class, or of one class,
+costs about the same as a single curve.
+
+"""
+
+# * Libraries
+
+
+import numpy as np
+import pandas as pd
+
+from .fragility_curve import FragilityCurve, QUAD_NODES, QUAD_CHUNK_SIZE
+
+
+# * Class definition
+
+
+class FragilityLibrary:
+    """Define the fragility curves of a set of vulnerability classes.
+
+    Variables:
+    classes: list of the vulnerability classes, in the order of their codes
+    curves: dict of vulnerability class to its FragilityCurve
+    intensity_measure: string identifying the intensity measure, the same
+                       for all the curves
+    defaultClass: class used for locations whose class is not in the
+                  library, or None to give them nan probabilities
+    tableStep: largest intensity step of the curve tables, or None. Set by
+               tabulate().
+
+    Initialize keyword:
+
+    library_in : string pointing to a csv file with the vulnerability class
+                 in the first column, then the columns of a FragilityCurve
+                 file, with the rows of each class together or not. For
+                 example...
+
+                 class, mmi, negligible, minor, major, destruction
+                 wood, 6.0, 0.2, 0.05, 1e-4, 1e-12
+                 ...
+                 steel, 6.0, 0.1, 0.01, 1e-5, 1e-13
+                 ...
+
+                 Can also be a pandas dataframe of the same columns, or a
+                 dict of vulnerability class to a FragilityCurve, or to the
+                 file or dataframe to read one from.
+    defaultClass : see above.
+
+    """
+
+    def __init__(self, library_in, defaultClass=None):
+        """Constructor for fragility library"""
+
+        if type(library_in) is str:
+            # Read the whole thing as a pandas data frame from csv
+            ifile = library_in
+            print("Reading %s..." % ifile)
+            library_in = pd.read_csv(ifile)
+
+        if isinstance(library_in, pd.DataFrame):
+            # One curve from the rows of each class
+            library_in = {
+                c: FragilityCurve(rows.iloc[:, 1:].reset_index(drop=True))
+                for c, rows in library_in.groupby(library_in.columns[0],
+                                                  sort=False)}
+
+        self.curves = {c: (v if isinstance(v, FragilityCurve)
+                           else FragilityCurve(v))
+                       for c, v in library_in.items()}
+        self.classes = list(self.curves)
+        if len(self.classes) == 0:
+            raise ValueError("Fragility library has no curves")
+
+        # All curves must give the same columns of probabilities
+        first = self.curves[self.classes[0]]
+        self.intensity_measure = first.intensity_measure
+        for c, curve in self.curves.items():
+            if curve.intensity_measure != self.intensity_measure:
+                raise ValueError(
+                    "Intensity measure %s of class %s is not %s" %
+                    (curve.intensity_measure, c, self.intensity_measure))
+            if list(curve.damagestates()) != list(first.damagestates()):
+                raise ValueError(
+                    "Damage states of class %s differ from class %s" %
+                    (c, self.classes[0]))
+
+        if defaultClass is not None and defaultClass not in self.curves:
+            raise ValueError("Default class %s is not in the library" %
+                             defaultClass)
+        self.defaultClass = defaultClass
+        self.tableStep = None
+
+        return
+
+    def damagestates(self):
+        """ Return a list of the damage states of all the curves."""
+        return self.curves[self.classes[0]].damagestates()
+
+    def tabulate(self, step=0.01, isLinear=True):
+        """Tabulate every curve, see FragilityCurve.tabulate.
+
+        Returns the largest bound on the difference from the interpolators.
+        """
+        err = max(curve.tabulate(step, isLinear)
+                  for curve in self.curves.values())
+        self.tableStep = max(curve.tableStep for curve in self.curves.values())
+
+        return err
+
+    def class_codes(self, classes):
+        """Return a numpy vector of the code of each class, its position in
+        the classes list, with -1 for classes not in the library if there is
+        no default class. Categorical classes are quickest."""
+        # Hash the classes to codes of their own, -1 if missing, then map
+        # the few distinct classes to the library, the last entry of the
+        # mapping being for the missing classes
+        if not isinstance(classes, (pd.Series, pd.Index, pd.Categorical)):
+            classes = np.asarray(classes)
+        localCodes, uniques = pd.factorize(classes)
+        mapping = np.append(pd.Index(self.classes).get_indexer(uniques), -1)
+        isUnknown = mapping < 0
+        isUnknown[-1] = (localCodes < 0).any()
+        if isUnknown.any():
+            if self.defaultClass is not None:
+                mapping[mapping < 0] = self.classes.index(self.defaultClass)
+            else:
+                unknown = [str(u) for u in uniques[isUnknown[:-1]][:5]]
+                if isUnknown[-1]:
+                    unknown.append('(missing)')
+                print("WARNING: no fragility curve for class %s, " %
+                      ', '.join(unknown) +
+                      "those locations get no damage probabilities")
+
+        return mapping[localCodes]
+
+    def for_locations(self, classes):
+        """Return the LocationCurves of a set of locations, given a vector of
+        their vulnerability classes. Keep it to evaluate the same locations
+        many times."""
+        return LocationCurves(self, self.class_codes(classes))
+
+    def interp_all(self, myintensities, classes):
+        """Interpolate the curve of each location's class at its intensity
+        for all damage states at once.
+
+        Returns a numpy array as FragilityCurve.interp_all, with nan rows for
+        locations of classes not in the library.
+
+        Keyword arguments:
+        myintensites = numpy vector of intensities.
+        classes = vector of the vulnerability class of each location.
+
+        """
+        return self.for_locations(classes).interp_all(myintensities)
+
+    def interp_uncertain(self, medians, stddevs, classes, **kwargs):
+        """Average the curve of each location's class over the uncertainty of
+        its intensity, see FragilityCurve.interp_uncertain."""
+        return self.for_locations(classes).interp_uncertain(medians, stddevs,
+                                                            **kwargs)
+
+
+class LocationCurves:
+    """Define the fragility curves of a fixed set of locations, each from a
+    FragilityLibrary by its vulnerability class.
+
+    The locations are grouped by class when created, so evaluating them
+    again, e.g. for each realisation of a simulation, only gathers and
+    scatters the groups. Has the interp_all, interp_uncertain, damagestates
+    and intensity_measure of a FragilityCurve, so can be used in its place
+    for these locations.
+
+    Variables:
+    library: the FragilityLibrary of the curves
+    codes: numpy vector of the class code of each location, -1 if none
+    groups: list of (FragilityCurve, index) of each class with locations,
+            index being a slice if they are next to each other, otherwise
+            a numpy vector of their positions
+    missing: numpy vector of the positions of locations with no curve
+    intensity_measure: as FragilityCurve
+
+    """
+
+    def __init__(self, library, codes):
+        """Constructor, from the library and the class code of each
+        location"""
+        self.library = library
+        self.codes = np.asarray(codes, dtype=np.intp)
+        self.intensity_measure = library.intensity_measure
+
+        # Sort the locations by class, keeping their order within a class.
+        # A stable sort of 16 bit integers is a radix sort, O(n)
+        if len(library.classes) < 2**15:
+            order = np.argsort(self.codes.astype(np.int16), kind='stable')
+        else:
+            order = np.argsort(self.codes, kind='stable')
+        bounds = np.searchsorted(self.codes[order],
+                                 np.arange(len(library.classes) + 1))
+        bounds[-1] = len(order)
+        self.missing = order[:bounds[0]]
+
+        self.groups = []
+        for k, c in enumerate(library.classes):
+            idx = order[bounds[k]:bounds[k + 1]]
+            if len(idx) == 0:
+                continue
+
+            # Locations next to each other are a view, not a copy
+            if idx[-1] - idx[0] + 1 == len(idx):
+                idx = slice(idx[0], idx[-1] + 1)
+            self.groups.append((library.curves[c], idx))
+
+        return
+
+    def __len__(self):
+        return len(self.codes)
+
+    def damagestates(self):
+        """ Return a list of the damage states."""
+        return self.library.damagestates()
+
+    def subset(self, isKept):
+        """Return the LocationCurves of some of the locations, given a
+        boolean or index vector"""
+        return LocationCurves(self.library, self.codes[isKept])
+
+    def is_single(self):
+        """Return True if one curve covers all the locations"""
+        if len(self.missing) > 0 or len(self.groups) != 1:
+            return False
+        idx = self.groups[0][1]
+        return isinstance(idx, slice) and idx == slice(0, len(self))
+
+    def interp_all(self, myintensities):
+        """Interpolate the curve of each location at its intensity for all
+        damage states at once.
+
+        Returns a numpy array as FragilityCurve.interp_all, with nan rows for
+        locations with no curve.
+
+        Keyword arguments:
+        myintensites = numpy vector of intensities, of the locations in
+                       order, or of several realisations of them one after
+                       the other.
+
+        """
+        myintensities = np.asarray(myintensities, dtype=float).ravel()
+        nPts = len(self)
+        nStates = len(self.damagestates())
+        if nPts == 0 or len(myintensities) % nPts != 0:
+            if len(myintensities) == 0:
+                return np.empty((0, nStates))
+            raise ValueError("%i intensities for %i locations" %
+                             (len(myintensities), nPts))
+
+        if self.is_single():
+            return self.groups[0][0].interp_all(myintensities)
+
+        # Evaluate each class for all the realisations together
+        x = myintensities.reshape(-1, nPts)
+        nReal = len(x)
+        exceedprob_locs = np.empty((nReal, nPts, nStates))
+        for curve, idx in self.groups:
+            probs = curve.interp_all(x[:, idx].ravel())
+            exceedprob_locs[:, idx] = probs.reshape(nReal, -1, nStates)
+        exceedprob_locs[:, self.missing] = np.nan
+
+        return exceedprob_locs.reshape(nReal * nPts, nStates)
+
+    def interp_uncertain(self, medians, stddevs, nNodes=QUAD_NODES,
+                         isLognormal=None, chunkSize=QUAD_CHUNK_SIZE):
+        """Average the curve of each location over the uncertainty of its
+        intensity, see FragilityCurve.interp_uncertain.
+
+        Returns a numpy array as interp_all(), with nan rows for locations
+        with no curve.
+        """
+        medians = np.asarray(medians, dtype=float)
+        stddevs = np.asarray(stddevs, dtype=float)
+        if medians.shape != (len(self),) or stddevs.shape != (len(self),):
+            raise ValueError("Medians and standard deviations must have one "
+                             "value per location")
+
+        if self.is_single():
+            return self.groups[0][0].interp_uncertain(
+                medians, stddevs, nNodes, isLognormal, chunkSize)
+
+        exceedprob_locs = np.empty((len(self), len(self.damagestates())))
+        for curve, idx in self.groups:
+            exceedprob_locs[idx] = curve.interp_uncertain(
+                medians[idx], stddevs[idx], nNodes, isLognormal, chunkSize)
+        exceedprob_locs[self.missing] = np.nan
+
+        return exceedprob_locs
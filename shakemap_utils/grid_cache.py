@@ -0,0 +1,210 @@
+"""On-disk cache of parsed ShakeMap grid files.
+
+Each cached grid is stored as two files in the cache folder, named by a key
+computed from the source file:
+
+  <key>.npy  : the field values as a numpy array (field, lat, lon) in the row
+               order of the source file, i.e. north row first.
+  <key>.json : the root attributes, event info, grid limits, field names and
+               the size and modification time of the source file.
+
+The same pair of files is written by convert_grid, and the .npy file can be
+memory mapped read-only so that many processes share one copy of the grid.
+
+Arrays derived from a source file, e.g. damage probability rasters, are
+stored the same way, in a layout of their own, under a key that also includes
+a variant string.
+
+"""
+import os
+import json
+import hashlib
+import numpy as np
+
+
+# Folder name used when the cache is stored next to the source files
+DEFAULT_DIRNAME = '.shakemap_cache'
+
+
+def meta_filename(dataFile):
+    """Return the name of the json file that goes with a .npy field file"""
+    return os.path.splitext(dataFile)[0] + '.json'
+
+
+def save_fields(dataFile, meta, data):
+    """Write the meta data dict and field array to a .npy file and its json
+    partner.
+
+    The files are written to temporary names then renamed, so that other
+    processes never see a partly written file.
+    """
+    metaFile = meta_filename(dataFile)
+    with open(dataFile + '.tmp', 'wb') as f:
+        np.save(f, np.ascontiguousarray(data))
+    with open(metaFile + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(dataFile + '.tmp', dataFile)
+    os.replace(metaFile + '.tmp', metaFile)
+
+    return
+
+
+def load_fields(dataFile, mmap_mode=None):
+    """Read the meta data dict and field array written by save_fields.
+
+    Keyword arguments:
+    mmap_mode : passed to numpy.load. Use 'r' to memory map the array
+                read-only rather than read it, so that the OS page cache holds
+                a single copy shared by all processes using the file.
+    """
+    with open(meta_filename(dataFile), 'r') as f:
+        meta = json.load(f)
+
+    data = np.load(dataFile, mmap_mode=mmap_mode)
+
+    return meta, data
+
+
+class GridFileCache:
+    """ Class defines a folder of parsed ShakeMap grids
+
+    Properties
+     cacheDir: folder for the cache files. If None, a folder named
+       .shakemap_cache next to each source file is used.
+     maxBytes: the total size of the cache files in a folder is kept below
+       this by removing the least recently used entries.
+     useContentHash: (logical) key entries on a hash of the file contents
+       rather than its path, size and modification time.
+    """
+
+    def __init__(self, cacheDir=None, maxBytes=2e9, useContentHash=False):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.useContentHash = useContentHash
+        return
+
+    def folder(self, ifile):
+        """Return the cache folder for a source file"""
+        if self.cacheDir is not None:
+            return self.cacheDir
+
+        return os.path.join(os.path.dirname(os.path.abspath(ifile)),
+                            DEFAULT_DIRNAME)
+
+    def key(self, ifile, variant=None):
+        """Return the cache key for a source file, and a variant string for
+        arrays derived from it"""
+        h = hashlib.sha1()
+        if self.useContentHash:
+            with open(ifile, 'rb') as f:
+                for block in iter(lambda: f.read(1024*1024), b''):
+                    h.update(block)
+        else:
+            st = os.stat(ifile)
+            h.update(('%s|%i|%i' % (os.path.abspath(ifile), st.st_size,
+                                    st.st_mtime_ns)).encode())
+        if variant is not None:
+            h.update(('|' + variant).encode())
+
+        return h.hexdigest()[:24]
+
+    def paths(self, ifile, variant=None):
+        """Return the names of the data and meta data files for a source"""
+        base = os.path.join(self.folder(ifile), self.key(ifile, variant))
+        return base + '.npy', base + '.json'
+
+    def get(self, ifile, mmap_mode=None, variant=None):
+        """Return the meta data dict and field array for a source file, or
+        None if it is not in the cache.
+
+        Keyword arguments:
+        mmap_mode : passed to numpy.load. Use 'r' to memory map the array
+                    rather than read it.
+        variant : (string) identifies an array derived from the source file
+                  rather than its fields.
+        """
+        dataFile, metaFile = self.paths(ifile, variant)
+        if not (os.path.exists(dataFile) and os.path.exists(metaFile)):
+            return None
+
+        meta, data = load_fields(dataFile, mmap_mode)
+
+        # Invalidate if the source changed since it was cached
+        st = os.stat(ifile)
+        if not self.useContentHash and (
+                meta['source_size'] != st.st_size or
+                meta['source_mtime_ns'] != st.st_mtime_ns):
+            self.remove(ifile, variant)
+            return None
+
+        # Record the access for the least recently used eviction
+        os.utime(metaFile)
+
+        return meta, data
+
+    def put(self, ifile, meta, data, variant=None):
+        """Store the meta data dict and field array (in file row order) for a
+        source file, or an array derived from it identified by variant.
+
+        """
+        dataFile = self.paths(ifile, variant)[0]
+        os.makedirs(os.path.dirname(dataFile), exist_ok=True)
+
+        st = os.stat(ifile)
+        meta = dict(meta, source=os.path.abspath(ifile),
+                    source_size=st.st_size, source_mtime_ns=st.st_mtime_ns)
+
+        save_fields(dataFile, meta, data)
+
+        self.evict(os.path.dirname(dataFile))
+
+        return
+
+    def remove(self, ifile, variant=None):
+        """Remove the entry for a source file"""
+        for fnm in self.paths(ifile, variant):
+            if os.path.exists(fnm):
+                os.remove(fnm)
+        return
+
+    def entries(self, cacheDir):
+        """Return a list of (last access time, bytes, key) for the entries in
+        a cache folder, oldest first.
+
+        """
+        out = []
+        for fnm in os.listdir(cacheDir):
+            if not fnm.endswith('.json'):
+                continue
+
+            key = fnm[:-5]
+            metaFile = os.path.join(cacheDir, fnm)
+            dataFile = os.path.join(cacheDir, key + '.npy')
+            try:
+                nBytes = (os.path.getsize(metaFile) +
+                          os.path.getsize(dataFile))
+                out.append((os.path.getmtime(metaFile), nBytes, key))
+            except OSError:
+                # Removed by another process
+                continue
+
+        return sorted(out)
+
+    def evict(self, cacheDir):
+        """Remove the least recently used entries until the folder is within
+        the size limit.
+
+        """
+        items = self.entries(cacheDir)
+        total = sum(i[1] for i in items)
+        for _, nBytes, key in items:
+            if total <= self.maxBytes:
+                break
+
+            for ext in ('.json', '.npy'):
+                fnm = os.path.join(cacheDir, key + ext)
+                if os.path.exists(fnm):
+                    os.remove(fnm)
+            total -= nBytes
+
+        return
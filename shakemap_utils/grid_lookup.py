@@ -0,0 +1,162 @@
+"""Vectorised lookup of ShakeMap grid values at point locations.
+
+The grids are regular, with cell centers at x0 + i*dx, y0 + j*dy and values
+held in 2-d arrays with the south-west cell first. The points are processed
+in blocks. For each block the cell indices and the in-grid test are computed
+once with plain integer and boolean arrays, then used for every grid looked
+up, e.g. the intensity and its standard deviation. Only block sized
+temporaries are created, and the outputs can be passed in to be reused
+between calls.
+
+"""
+import numpy as np
+
+from .grid_parser import INT16_NODATA
+
+
+# Number of points processed at one time
+BLOCK_SIZE = 65536
+
+# Interpolation methods available
+METHODS = ('nearest', 'bilinear')
+
+
+def cell_index(xpts, ypts, x0, y0, dx, dy, nx, ny):
+    """Return the column and row of the grid cell containing each point.
+
+    A point belongs to the cell with the nearest center, so the grid extends
+    half a cell beyond the first and last centers. Returns integer arrays
+    iLon, iLat and a boolean array isIn that is False for points outside the
+    grid, which have indices of 0.
+    """
+    iLon = np.floor((xpts - x0)/dx + 0.5)
+    iLat = np.floor((ypts - y0)/dy + 0.5)
+
+    # Comparisons with nan coordinates are False, so these are outside too
+    isIn = (iLon >= 0) & (iLon < nx) & (iLat >= 0) & (iLat < ny)
+    iLon[~isIn] = 0
+    iLat[~isIn] = 0
+
+    return iLon.astype(np.intp), iLat.astype(np.intp), isIn
+
+
+def cell_weights(xpts, ypts, x0, y0, dx, dy, nx, ny):
+    """Return the south-west corner and weights for bilinear interpolation.
+
+    The corner is the grid center at or to the south-west of each point, and
+    the weights wx, wy are the fractional distances towards the next center
+    east and north. Points in the outer half of the edge cells take the edge
+    values. Returns integer arrays iLon, iLat, float arrays wx, wy, and the
+    isIn boolean array as cell_index.
+    """
+    fx = (xpts - x0)/dx
+    fy = (ypts - y0)/dy
+    isIn = (fx >= -0.5) & (fx < nx - 0.5) & (fy >= -0.5) & (fy < ny - 0.5)
+    fx[~isIn] = 0.0
+    fy[~isIn] = 0.0
+
+    # Hold the edge values in the outer half cells
+    np.clip(fx, 0, nx - 1, out=fx)
+    np.clip(fy, 0, ny - 1, out=fy)
+
+    # Keep the corner inside so the neighbour to the east/north exists
+    iLon = np.minimum(np.floor(fx), max(nx - 2, 0))
+    iLat = np.minimum(np.floor(fy), max(ny - 2, 0))
+
+    return (iLon.astype(np.intp), iLat.astype(np.intp), fx - iLon, fy - iLat,
+            isIn)
+
+
+def decode_into(vals, scale, out):
+    """Write stored grid values into out in their units, converting int16
+    values with a scale, see grid_parser.dequantise.
+
+    """
+    if scale is None:
+        out[...] = vals
+    else:
+        np.multiply(vals, scale, out=out)
+        out[vals == INT16_NODATA] = np.nan
+
+    return out
+
+
+def gather(grid, scale, iLat, iLon, buf):
+    """Return the grid values in their units at the cells iLat, iLon, using
+    buf to hold them.
+
+    """
+    return decode_into(grid[iLat, iLon], scale, buf[:len(iLat)])
+
+
+def lookup_points(grids, scales, xpts, ypts, x0, y0, dx, dy,
+                  method='nearest', out=None, dtype=float,
+                  blockSize=BLOCK_SIZE):
+    """Look up the values of one or more grids at a set of points.
+
+    Points outside the grid get nan.
+
+    Keyword arguments:
+    grids : list of 2-d numpy arrays with the same shape (lat, lon) and the
+            south-west cell first.
+    scales : list of the int16 scale of each grid, or None if the values are
+             stored as they are.
+    xpts, ypts : 1-d numpy arrays of point lon and lat coordinates.
+    x0, y0, dx, dy : lon and lat of the south-west cell center and the grid
+                     spacing.
+    method : 'nearest' takes the value of the cell containing the point.
+             'bilinear' interpolates between the four surrounding centers.
+             Points next to a missing value get nan.
+    out : list of 1-d arrays, one per grid, to write the values into. New
+          arrays of dtype are created if None.
+    blockSize : (int) number of points processed at one time.
+
+    Returns list of arrays with the values of each grid.
+    """
+    if method not in METHODS:
+        raise ValueError('Unknown lookup method %s, use one of %s' %
+                         (method, ', '.join(METHODS)))
+
+    xpts = np.asarray(xpts, dtype=float).ravel()
+    ypts = np.asarray(ypts, dtype=float).ravel()
+    nPts = len(xpts)
+    ny, nx = grids[0].shape
+
+    if out is None:
+        out = [np.empty(nPts, dtype=dtype) for _ in grids]
+    for o in out:
+        if o.shape != (nPts,):
+            raise ValueError('Output buffer has shape %s, expected (%i,)' %
+                             (o.shape, nPts))
+
+    # Scratch space reused for every block of bilinear interpolation
+    bufs = [np.empty((4, min(blockSize, nPts)), dtype=o.dtype) for o in out
+            if method == 'bilinear']
+
+    for i0 in range(0, nPts, blockSize):
+        i1 = min(i0 + blockSize, nPts)
+        x, y = xpts[i0:i1], ypts[i0:i1]
+
+        if method == 'nearest':
+            iLon, iLat, isIn = cell_index(x, y, x0, y0, dx, dy, nx, ny)
+            isOut = ~isIn
+            for grid, scale, o in zip(grids, scales, out):
+                decode_into(grid[iLat, iLon], scale, o[i0:i1])
+                o[i0:i1][isOut] = np.nan
+            continue
+
+        # Bilinear interpolation from the four surrounding centers
+        iLon, iLat, wx, wy, isIn = cell_weights(x, y, x0, y0, dx, dy, nx, ny)
+        iLon1 = np.minimum(iLon + 1, nx - 1)
+        iLat1 = np.minimum(iLat + 1, ny - 1)
+        isOut = ~isIn
+        for grid, scale, o, buf in zip(grids, scales, out, bufs):
+            v00 = gather(grid, scale, iLat, iLon, buf[0])
+            v01 = gather(grid, scale, iLat, iLon1, buf[1])
+            v10 = gather(grid, scale, iLat1, iLon, buf[2])
+            v11 = gather(grid, scale, iLat1, iLon1, buf[3])
+            o[i0:i1] = ((1 - wy)*(v00 + wx*(v01 - v00)) +
+                        wy*(v10 + wx*(v11 - v10)))
+            o[i0:i1][isOut] = np.nan
+
+    return out
@@ -0,0 +1,390 @@
+"""Engine to convert the text of a ShakeMap <grid_data> block into numbers.
+
+The grid data is a block of lines, one per grid point, each holding a
+whitespace separated value for every grid field. Rather than splitting the
+whole text into a list of strings, the parser is fed the text in pieces,
+converts each complete block of lines with numpy's C text reader (or by
+splitting it, on numpy before 1.23) and copies the values straight into a
+preallocated array. The blocks can also be
+converted in parallel by worker processes writing into shared memory.
+
+"""
+import io
+import os
+import numpy as np
+from multiprocessing.shared_memory import SharedMemory
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+
+# Size of the pieces of text passed to the converter at one time
+CHUNK_SIZE = 1024*1024
+
+# np.loadtxt is C code from numpy 1.23, a python loop over lines before
+HAS_C_LOADTXT = np.lib.NumpyVersion(np.__version__) >= '1.23.0'
+
+# Stored value for missing data in quantised (integer) grids, and the largest
+# count stored
+INT16_NODATA = -32768
+INT16_MAX = 32767
+
+
+def quantise(vals, scale, isQuiet=False):
+    """Convert values to int16 counts of scale, e.g. 6.234 -> 6234 for a
+    scale of 0.001. Values outside the int16 range are clipped, with a
+    warning unless isQuiet, and nan values are stored as INT16_NODATA.
+
+    """
+    q = np.round(np.asarray(vals, dtype=float)/scale)
+    isNan = np.isnan(q)
+    isOver = np.abs(q) > INT16_MAX
+    if not isQuiet and isOver.any():
+        print("WARNING: %i values beyond the int16 range of their scale, "
+              "clipped to +/-%i counts" % (isOver.sum(), INT16_MAX))
+    q = np.clip(q, -INT16_MAX, INT16_MAX)
+    q[isNan] = INT16_NODATA
+    return q.astype(np.int16)
+
+
+def count_clipped(q):
+    """Return the number of int16 counts of each row of a quantised array
+    at the ends of the range, i.e. that may have been clipped"""
+    q = np.reshape(q, (len(q), -1))
+    return np.count_nonzero((q == INT16_MAX) | (q == -INT16_MAX), axis=1)
+
+
+def dequantise(q, scale, dtype=np.float32):
+    """Convert int16 counts of scale back to values, with nan for missing"""
+    vals = np.multiply(q, scale, dtype=dtype)
+    vals[q == INT16_NODATA] = np.nan
+    return vals
+
+
+class GridDataParser:
+    """Incrementally convert grid_data text into a preallocated array.
+
+    Properties
+     nCells: number of grid points (lines) expected
+     nFields: number of values on each line
+     usecols: indices of the fields kept, all fields if None
+     out: numpy array with shape (len(usecols), nCells). Each row holds one
+          field in the order of the lines in the file.
+     nDone: number of lines converted so far
+     scales: for an integer output, the scale of each kept field used to
+       quantise the values
+    """
+
+    def __init__(self, nCells, nFields, usecols=None, dtype=float,
+                 scales=None):
+        """Allocate the output for the expected size of the grid.
+
+        Keyword arguments:
+        nCells : (int) number of lines in the grid data, i.e. nlon*nlat
+        nFields : (int) number of values on each line
+        usecols : (list of int) which fields to keep. Default keeps all.
+        dtype : numpy data type of the output array
+        scales : (list of float) for an int16 output, the scale of each kept
+                 field, see quantise.
+        """
+        self.nCells = nCells
+        self.nFields = nFields
+        if usecols is None:
+            usecols = list(range(nFields))
+        self.usecols = list(usecols)
+        self.out = self.allocate((len(self.usecols), nCells), dtype)
+        self.nDone = 0
+        self.scales = None
+        if scales is not None:
+            self.scales = np.asarray(scales, dtype=float)
+
+        # Incomplete line carried over between pieces of text
+        self._tail = None
+
+        return
+
+    def allocate(self, shape, dtype):
+        """Return the output array"""
+        return np.empty(shape, dtype=dtype)
+
+    def feed(self, chunk):
+        """Add a piece of text (str or bytes) to the parser.
+
+        Only complete lines are converted, the remainder is kept until the
+        next call.
+        """
+        if self._tail:
+            chunk = self._tail + chunk
+
+        newline = b'\n' if isinstance(chunk, bytes) else '\n'
+        iEnd = chunk.rfind(newline) + 1
+        self._tail = chunk[iEnd:]
+        if iEnd > 0:
+            self._convert(chunk[:iEnd])
+
+        return
+
+    def close(self):
+        """Convert any remaining text and return the output array"""
+        if self._tail:
+            self._convert(self._tail)
+            self._tail = None
+
+        if self.nDone != self.nCells:
+            raise ValueError('Expected %i grid points, found %i' %
+                             (self.nCells, self.nDone))
+
+        return self.out
+
+    def abort(self):
+        """Stop parsing after an error. Nothing to release here"""
+        return
+
+    def _convert(self, text):
+        """Convert complete lines of text into the next slice of the output"""
+        if not text.strip():
+            return
+
+        vals = convert_lines(text, self.nFields, self.usecols, self.out.dtype,
+                             self.scales)
+
+        n = vals.shape[0]
+        if self.nDone + n > self.nCells:
+            raise ValueError('More than %i grid points in grid data' %
+                             self.nCells)
+
+        self.out[:, self.nDone:self.nDone + n] = vals.T
+        self.nDone += n
+
+        return
+
+
+class SharedBlock(SharedMemory):
+    """Shared memory that stays mapped while arrays made from its buffer are
+    in use. It is unmapped when the last of them goes, rather than failing
+    to close when it is garbage collected first.
+    """
+
+    def __del__(self):
+        try:
+            self.close()
+        except (OSError, BufferError):
+            pass
+
+
+class ParallelGridDataParser(GridDataParser):
+    """Grid data parser that converts the pieces of text in worker processes.
+
+    Each piece of complete lines is sent to a worker with the index of its
+    first line, and the worker writes its values into that slice of the
+    output array, which is a view of shared memory. The main process only
+    splits the text into lines, so conversion scales with the number of
+    workers, and the grid is held once.
+    """
+
+    def __init__(self, nCells, nFields, usecols=None, dtype=float,
+                 scales=None, nWorkers=None):
+        """Start the pool of workers and the shared output array.
+
+        Keyword arguments as GridDataParser, plus:
+        nWorkers : (int) number of worker processes. Default is the number of
+                   cores.
+        """
+        super().__init__(nCells, nFields, usecols, dtype, scales)
+
+        self.nWorkers = nWorkers or os.cpu_count()
+        self._pool = ProcessPoolExecutor(self.nWorkers)
+        self._pending = []
+
+        return
+
+    def allocate(self, shape, dtype):
+        """Return the output array as a view of a new block of shared
+        memory"""
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        self._shm = SharedBlock(create=True, size=max(count*dtype.itemsize, 1))
+        return np.frombuffer(self._shm.buf, dtype, count).reshape(shape)
+
+    def _convert(self, text):
+        """Send complete lines of text to a worker"""
+        text = text.strip()
+        if not text:
+            return
+
+        # Work out where these lines go from the number of lines
+        n = text.count(b'\n' if isinstance(text, bytes) else '\n') + 1
+        if self.nDone + n > self.nCells:
+            self.abort()
+            raise ValueError('More than %i grid points in grid data' %
+                             self.nCells)
+
+        # Limit the amount of text waiting to be converted
+        if len(self._pending) >= 2*self.nWorkers:
+            done, pending = wait(self._pending, return_when=FIRST_COMPLETED)
+            self._pending = list(pending)
+            for f in done:
+                self._check(f)
+
+        self._pending.append(self._pool.submit(
+            convert_into_shared, self._shm.name, self.out.shape,
+            self.out.dtype.str, self.nDone, n, text, self.nFields,
+            self.usecols, self.scales))
+        self.nDone += n
+
+        return
+
+    def _check(self, future):
+        """Raise any error from a worker"""
+        try:
+            future.result()
+        except Exception:
+            self.abort()
+            raise
+
+        return
+
+    def close(self):
+        """Wait for the workers and return the output array"""
+        if self._tail:
+            self._convert(self._tail)
+            self._tail = None
+
+        for f in self._pending:
+            self._check(f)
+        self._pending = []
+
+        if self.nDone != self.nCells:
+            self.abort()
+            raise ValueError('Expected %i grid points, found %i' %
+                             (self.nCells, self.nDone))
+
+        # The output stays a view of the shared memory, which is freed with
+        # the last array using it once its name is removed
+        self.abort()
+
+        return self.out
+
+    def abort(self):
+        """Stop the workers and remove the name of the shared memory"""
+        if self._pool is not None:
+            # Work not started is dropped, as shutdown(cancel_futures=True)
+            # does from python 3.9
+            for f in self._pending:
+                f.cancel()
+            self._pending = []
+            self._pool.shutdown(wait=True)
+            self._pool = None
+            self._shm.unlink()
+
+        return
+
+
+def convert_lines(text, nFields, usecols, dtype=float, scales=None):
+    """Convert complete lines of grid data text (str or bytes) to numbers.
+
+    Returns numpy array with shape (number of lines, len(usecols)). With
+    scales the values are quantised to int16, see quantise.
+    """
+    if isinstance(text, bytes):
+        stream = io.BytesIO(text)
+    else:
+        stream = io.StringIO(text)
+
+    # Check the number of values on the first line before converting
+    for line in stream:
+        if line.strip():
+            break
+    stream.seek(0)
+    if len(line.split()) != nFields:
+        raise ValueError('Expected %i fields in grid data, found %i' %
+                         (nFields, len(line.split())))
+
+    if HAS_C_LOADTXT:
+        vals = np.loadtxt(stream, dtype=dtype if scales is None else float,
+                          usecols=usecols, ndmin=2)
+    else:
+        # Older loadtxt loops over the lines in python, splitting the whole
+        # block and converting the list is quicker
+        vals = np.array(text.split(), dtype=float)
+        if len(vals) % nFields != 0:
+            raise ValueError('Grid data has %i values, not a multiple of '
+                             'the %i fields' % (len(vals), nFields))
+        vals = vals.reshape(-1, nFields)[:, usecols]
+
+    if scales is None:
+        return vals.astype(dtype, copy=False)
+
+    # Clipped values are found by the caller once all the lines are read
+    return quantise(vals, scales, isQuiet=True)
+
+
+def convert_into_shared(shmName, shape, dtype, start, n, text, nFields,
+                        usecols, scales=None):
+    """Worker function for ParallelGridDataParser. Convert n lines of text and
+    write them into columns start:start+n of the array in shared memory.
+
+    """
+    shm = SharedMemory(name=shmName)
+    try:
+        out = np.ndarray(shape, dtype, buffer=shm.buf)
+        vals = convert_lines(text, nFields, usecols, out.dtype, scales)
+        if vals.shape[0] != n:
+            raise ValueError('Expected %i lines of grid data, found %i' %
+                             (n, vals.shape[0]))
+        out[:, start:start + n] = vals.T
+        del out
+    finally:
+        shm.close()
+
+    return n
+
+
+def parse_grid_text(text, nCells, nFields, usecols=None, dtype=float,
+                    chunkSize=CHUNK_SIZE, scales=None):
+    """Convert the full grid_data text, fed to the parser in pieces.
+
+    Returns numpy array with shape (len(usecols), nCells)
+    """
+    parser = GridDataParser(nCells, nFields, usecols, dtype, scales)
+    for i in range(0, len(text), chunkSize):
+        parser.feed(text[i:i + chunkSize])
+
+    return parser.close()
+
+
+def parse_grid_stream(stream, nCells, nFields, usecols=None, dtype=float,
+                      chunkSize=CHUNK_SIZE, head=b'', scales=None,
+                      nWorkers=1):
+    """Convert grid data read from a binary file object positioned after the
+    <grid_data> tag, reading up to the closing </grid_data> tag.
+
+    The stream is read chunkSize bytes at a time so only one chunk of the
+    text is held in memory. Any text already read after the <grid_data> tag
+    is passed as head. If nWorkers is more than 1 the chunks are converted by
+    a pool of worker processes. Returns numpy array with shape
+    (len(usecols), nCells)
+    """
+    if nWorkers > 1:
+        parser = ParallelGridDataParser(nCells, nFields, usecols, dtype,
+                                        scales, nWorkers)
+    else:
+        parser = GridDataParser(nCells, nFields, usecols, dtype, scales)
+    chunk = head
+    try:
+        while True:
+            # The numbers never contain a '<', so the first one is the start
+            # of the closing tag
+            iEnd = chunk.find(b'<')
+            if iEnd >= 0:
+                parser.feed(chunk[:iEnd])
+                break
+
+            parser.feed(chunk)
+
+            chunk = stream.read(chunkSize)
+            if not chunk:
+                break
+    except Exception:
+        parser.abort()
+        raise
+
+    return parser.close()
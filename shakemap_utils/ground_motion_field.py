@@ -0,0 +1,183 @@
+"""Spatially correlated random fields on the lattice of a ShakeMap grid.
+
+Fields of standard normal residuals with an exponential correlation,
+exp(-3 h / corrRange) at a distance h in km, are generated by circulant
+embedding: the grid is embedded in a larger periodic lattice, on which the
+covariance is diagonalised by the 2-d FFT. Each FFT of complex white noise
+gives two independent fields in O(n log n), rather than the O(n^3) of a
+Cholesky factor of the covariance of every pair of cells.
+
+Scaled by grid_std, the residuals give realisations of the intensity, and
+looked up at points they give correlated samples for simulate_damage.
+
+"""
+import numpy as np
+from scipy.fftpack import next_fast_len
+
+from .grid_lookup import cell_index
+from .usgs_shakemap_grid import decode
+
+
+# Distance in km at which the correlation of the residuals falls to 5%
+CORR_RANGE = 20.0
+
+# Km per degree of latitude
+KM_PER_DEGREE = 111.195
+
+# Number of lattice cells of complex noise transformed at a time
+CELLS_PER_BATCH = 2**22
+
+
+def embedding_eigenvalues(ny, nx, dyKm, dxKm, corrRange, maxPad=8):
+    """Return the eigenvalues of the covariance on a periodic lattice that
+    embeds a ny x nx grid, as a 2-d array of the size of the lattice.
+
+    The lattice is padded until the eigenvalues are not negative, up to
+    maxPad times the grid in each direction, after which negative values
+    are set to zero with a warning.
+    """
+    for pad in range(2, maxPad + 1):
+        my = next_fast_len(pad * ny)
+        mx = next_fast_len(pad * nx)
+
+        # Distances from the first cell on the periodic lattice
+        iy = np.minimum(np.arange(my), my - np.arange(my))
+        ix = np.minimum(np.arange(mx), mx - np.arange(mx))
+        h = np.hypot((iy * dyKm)[:, None], (ix * dxKm)[None, :])
+
+        # The covariance is symmetric on the lattice so its FFT is real
+        eigen = np.fft.fft2(np.exp(-3 * h / corrRange)).real
+        if eigen.min() >= -1e-10 * eigen.max():
+            break
+    else:
+        print("WARNING: correlation range %g km too long for the grid, " %
+              corrRange + "field correlation is approximate")
+
+    return np.maximum(eigen, 0.0)
+
+
+class CorrelatedField:
+    """ Class defines random fields of correlated residuals on the lattice of
+    a ShakeMap grid
+
+    Properties
+     shakemap: the USGSshakemapGrid the fields are on
+     corrRange: distance in km at which the correlation falls to 5%
+     dxKm, dyKm: spacing of the grid in km, east-west at the central latitude
+     sqrtEigen: square root of the eigenvalues of the embedded covariance,
+       scaled for the FFT
+    """
+
+    def __init__(self, shakemap, corrRange=CORR_RANGE):
+        """Constructor
+
+        Keyword arguments:
+        shakemap : (USGSshakemapGrid) grid whose lattice and std are used
+        corrRange : (float) distance in km at which the correlation of the
+                    residuals falls to exp(-3), about 5%.
+        """
+        if not corrRange > 0:
+            raise ValueError("Correlation range must be positive, not %s" %
+                             corrRange)
+        self.shakemap = shakemap
+        self.corrRange = corrRange
+
+        # Grid spacing in km, treating the grid as flat at its middle
+        midLat = np.radians(0.5 * (shakemap.y0 + shakemap.y1))
+        self.dyKm = shakemap.dy() * KM_PER_DEGREE
+        self.dxKm = shakemap.dx() * KM_PER_DEGREE * np.cos(midLat)
+
+        eigen = embedding_eigenvalues(shakemap.ny(), shakemap.nx(),
+                                      self.dyKm, self.dxKm, corrRange)
+        self.sqrtEigen = np.sqrt(eigen / eigen.size)
+
+        return
+
+    def batch_size(self):
+        """Return the number of complex fields transformed at a time"""
+        return max(1, CELLS_PER_BATCH // self.sqrtEigen.size)
+
+    def sample(self, nFields, rng=None):
+        """Return nFields fields of standard normal residuals, with unit
+        variance and the correlation of the class, as a numpy array of shape
+        (nFields, ny, nx).
+
+        Keyword arguments:
+        nFields : (int) number of fields.
+        rng : numpy random Generator, or seed of one.
+        """
+        rng = np.random.default_rng(rng)
+        ny, nx = self.shakemap.ny(), self.shakemap.nx()
+        out = np.empty((nFields, ny, nx))
+
+        # Each complex field gives two independent fields, its real and
+        # imaginary parts
+        nPairs = (nFields + 1) // 2
+        for i0 in range(0, nPairs, self.batch_size()):
+            n = min(self.batch_size(), nPairs - i0)
+            noise = rng.standard_normal((n,) + self.sqrtEigen.shape +
+                                        (2,)).view(complex)[..., 0]
+            noise *= self.sqrtEigen
+            fields = np.fft.fft2(noise)[:, :ny, :nx]
+
+            j0 = 2 * i0
+            j1 = min(j0 + 2 * n, nFields)
+            out[j0:j1:2] = fields.real[:(j1 - j0 + 1) // 2]
+            out[j0 + 1:j1:2] = fields.imag[:(j1 - j0) // 2]
+
+        return out
+
+    def residuals(self, nFields, rng=None):
+        """Return fields of residuals in the units of grid_std, the
+        standard normal fields of sample() times grid_std, so that the
+        intensity is grid + residual for MMI, or grid*exp(residual) for
+        lognormal measures. nan where there is no grid_std.
+        """
+        std = decode(self.shakemap.grid_std, self.shakemap.stdScale)
+        return self.sample(nFields, rng) * std
+
+    def sample_points(self, xpts, ypts, nFields, rng=None):
+        """Return standard normal residuals at points, from the grid cell
+        containing each point, as a numpy array of shape (nFields, number of
+        points). nan for points outside the grid.
+        """
+        iLon, iLat, isIn = cell_index(
+            np.asarray(xpts, dtype=float), np.asarray(ypts, dtype=float),
+            self.shakemap.x0, self.shakemap.y0, self.shakemap.dx(),
+            self.shakemap.dy(), self.shakemap.nx(), self.shakemap.ny())
+
+        out = np.empty((nFields, len(iLon)))
+        for i0 in range(0, nFields, 2 * self.batch_size()):
+            i1 = min(i0 + 2 * self.batch_size(), nFields)
+            fields = self.sample(i1 - i0, rng)
+            out[i0:i1] = fields[:, iLat, iLon]
+
+        out[:, ~isIn] = np.nan
+
+        return out
+
+    def sampler(self, xpts, ypts):
+        """Return a PointSampler of residuals at points, for the eps of
+        simulate_damage"""
+        return PointSampler(self, xpts, ypts)
+
+
+class PointSampler:
+    """ Class defines a sampler of correlated residuals at a fixed set of
+    points, called as sampler(rng, nFields) to return an array of shape
+    (nFields, number of points)
+
+    Properties
+     field: the CorrelatedField sampled
+     xpts, ypts: numpy arrays of the lon and lat of the points
+    """
+
+    def __init__(self, field, xpts, ypts):
+        self.field = field
+        self.xpts = np.asarray(xpts, dtype=float)
+        self.ypts = np.asarray(ypts, dtype=float)
+
+        return
+
+    def __call__(self, rng, nFields):
+        return self.field.sample_points(self.xpts, self.ypts, nFields, rng)
@@ -1,25 +1,311 @@
 """ Module for importing and looking up our locations"""
 
 
+import os
+import time
 import pandas as pd
 
+from .fragility_library import FragilityLibrary
 
-def read_locations_csv(ifile_locns, xyBox=[-180.0, 180.0, -90.0, 90.0]):
-    """Read locations from a csv file and find those within a lat/lon limits"""
+
+# Location file formats by file extension. Parquet and feather (Arrow IPC)
+# files need pyarrow
+FILE_FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.pq': 'parquet',
+                '.feather': 'feather', '.arrow': 'feather'}
+
+
+def file_format(fnm):
+    """Return the format of a locations file from its extension"""
+    ext = os.path.splitext(fnm)[1].lower()
+    if ext not in FILE_FORMATS:
+        raise ValueError('Unknown format of %s, use one of %s' %
+                         (fnm, ', '.join(FILE_FORMATS)))
+
+    return FILE_FORMATS[ext]
+
+
+def import_pyarrow():
+    """Return the pyarrow module, with a message if it is not installed"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.ipc
+    except ImportError:
+        raise ImportError('pyarrow is needed to read and write parquet and '
+                          'feather files: pip install pyarrow')
+
+    return pyarrow
+
+
+def location_columns(columns):
+    """Return the list of columns to read, always including lon and lat, or
+    None for all columns"""
+    if columns is None:
+        return None
+
+    return ['lon', 'lat'] + [c for c in columns if c not in ('lon', 'lat')]
+
+
+def read_locations(ifile, columns=None):
+    """Read a csv, parquet or feather file of locations into a pandas
+    dataframe.
+
+    Keyword arguments:
+    columns : (list of strings) only read these columns, plus lon and lat.
+              Default reads all columns.
+    """
+    fmt = file_format(ifile)
+    columns = location_columns(columns)
+
+    if fmt == 'csv':
+        # Type each column from all its rows, not a block at a time
+        return pd.read_csv(ifile, usecols=columns, low_memory=False)
+
+    import_pyarrow()
+    if fmt == 'parquet':
+        return pd.read_parquet(ifile, columns=columns)
+
+    return pd.read_feather(ifile, columns=columns)
+
+
+def merge_dtypes(dtype0, dtype1):
+    """Return the dtype holding the values of a column read as dtype0 in
+    some rows and dtype1 in others: numbers as floats if any are, anything
+    else as strings"""
+    if dtype0 == dtype1:
+        return dtype0
+    if all(pd.api.types.is_numeric_dtype(d) and
+           not pd.api.types.is_bool_dtype(d) for d in (dtype0, dtype1)):
+        return 'float64'
+
+    return 'str'
+
+
+def csv_dtypes(ifile, columns=None, chunkSize=None):
+    """Return a dict of the dtype of each column of a csv file, read
+    chunkSize rows at a time, that reading the whole file would give.
+
+    Each chunk on its own is typed from its own rows, e.g. integers with a
+    missing value in one chunk are floats there, or a column of numbers with
+    a few names is numbers in some chunks and strings in others.
+    """
+    dtypes = {}
+    for locns in pd.read_csv(ifile, usecols=columns, chunksize=chunkSize):
+        for c, dtype in locns.dtypes.items():
+            dtypes[c] = merge_dtypes(dtypes.get(c, dtype), dtype)
+
+    # Strings in a column of mixed types are all read as strings
+    return {c: ('str' if dtype == object else dtype)
+            for c, dtype in dtypes.items()}
+
+
+def iter_locations(ifile, columns=None, chunkSize=None):
+    """Read a csv, parquet or feather file of locations as a sequence of
+    pandas dataframes of up to chunkSize rows.
+
+    Feather files are read a record batch at a time, so chunks are no larger
+    than the batches written. Default reads the whole file at once. The
+    columns of a csv file are typed from all its rows, so every chunk has
+    the same dtypes as reading the whole file, at the cost of reading it
+    twice.
+    """
+    if chunkSize is None:
+        yield read_locations(ifile, columns)
+        return
+
+    fmt = file_format(ifile)
+    columns = location_columns(columns)
+
+    if fmt == 'csv':
+        dtypes = csv_dtypes(ifile, columns, chunkSize)
+        yield from pd.read_csv(ifile, usecols=columns, chunksize=chunkSize,
+                               dtype=dtypes)
+        return
+
+    pa = import_pyarrow()
+    if fmt == 'parquet':
+        for batch in pa.parquet.ParquetFile(ifile).iter_batches(
+                batch_size=chunkSize, columns=columns):
+            yield batch.to_pandas()
+        return
+
+    with pa.memory_map(ifile) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            if columns is not None:
+                batch = batch.select(columns)
+            for j in range(0, batch.num_rows, chunkSize):
+                yield batch.slice(j, chunkSize).to_pandas()
+
+    return
+
+
+class LocationWriter:
+    """ Class writes pandas dataframes of locations to one csv, parquet or
+    feather file, one chunk at a time.
+
+    Properties
+     ofile: output file name
+     fmt: file format, 'csv', 'parquet' or 'feather'
+     nWritten: number of rows written
+    """
+
+    def __init__(self, ofile):
+        self.ofile = ofile
+        self.fmt = file_format(ofile)
+        self.nWritten = 0
+
+        # Open file or pyarrow writer, once the first rows are known
+        self._writer = None
+        self._schema = None
+        self._empty = None
+
+        if self.fmt == 'csv':
+            self._writer = open(ofile, 'w', newline='')
+        else:
+            self._pa = import_pyarrow()
+
+        return
+
+    def write(self, locns):
+        """Add a dataframe of locations to the file"""
+        if self.fmt == 'csv':
+            # Only the first chunk has the header
+            locns.to_csv(self._writer, header=(self._empty is None),
+                         index=False)
+            self._empty = locns.iloc[:0]
+            self.nWritten += len(locns)
+            return
+
+        # The columns are typed from the first rows written
+        if len(locns) == 0:
+            if self._empty is None:
+                self._empty = locns
+            return
+
+        table = self._pa.Table.from_pandas(locns, preserve_index=False)
+        if self._writer is None:
+            # Columns of strings with none in the first rows have no type
+            schema = table.schema
+            for i, field in enumerate(schema):
+                if self._pa.types.is_null(field.type):
+                    schema = schema.set(i, field.with_type(self._pa.string()))
+            self._schema = schema
+            table = table.cast(schema)
+            if self.fmt == 'parquet':
+                self._writer = self._pa.parquet.ParquetWriter(self.ofile,
+                                                              self._schema)
+            else:
+                self._writer = self._pa.ipc.new_file(
+                    self.ofile, self._schema,
+                    options=self._pa.ipc.IpcWriteOptions(compression='lz4'))
+        elif not table.schema.equals(self._schema, check_metadata=False):
+            # e.g. a column of strings with none in these rows. The rows
+            # written already fix the types, so others are an error
+            try:
+                table = table.cast(self._schema)
+            except (self._pa.ArrowInvalid,
+                    self._pa.ArrowNotImplementedError) as e:
+                raise ValueError(
+                    'Rows from %i of %s have columns of other types than '
+                    'the rows written before: %s' %
+                    (self.nWritten, self.ofile, e))
+
+        self._writer.write_table(table)
+        self._empty = locns.iloc[:0]
+        self.nWritten += len(locns)
+
+        return
+
+    def close(self):
+        """Finish the file. Without any rows, only the columns are written"""
+        if self._writer is None and self.fmt != 'csv':
+            if self._empty is not None:
+                if self.fmt == 'parquet':
+                    self._empty.to_parquet(self.ofile, index=False)
+                else:
+                    self._empty.reset_index(drop=True).to_feather(self.ofile)
+            return
+
+        self._writer.close()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_locations_csv(ifile_locns, xyBox=[-180.0, 180.0, -90.0, 90.0],
+                       index=None, columns=None):
+    """Read locations from a csv file and find those within a lat/lon limits
+
+    Keyword arguments:
+    index : (PortfolioIndex) index of the locations in the file, used to find
+            those within the limits without comparing every location.
+    columns : (list of strings) only read these columns, plus lon and lat.
+    The file can also be a parquet or feather file, see read_locations.
+    """
 
     # Read locations
     print("Reading locations from %s" % ifile_locns)
-    locns = pd.read_csv(ifile_locns)
+    locns = read_locations(ifile_locns, columns)
 
     # Keep those in bounds
+    if index is not None:
+        if index.npoints() > len(locns):
+            raise ValueError('Index has %i locations, %s has %i' %
+                             (index.npoints(), ifile_locns, len(locns)))
+        return locns.iloc[index.query(xyBox)]
+
     inLocns = locns[((locns['lon'] >= xyBox[0]) &
                      (locns['lon'] < xyBox[1]) &
-                     (locns['lat'] >= xyloBox[2]) &
+                     (locns['lat'] >= xyBox[2]) &
                      (locns['lat'] < xyBox[3]))]
 
     return inLocns
 
 
+def process_locations(ifile, ofile, func, chunkSize=None, isQuiet=False,
+                      columns=None):
+    """Apply a function to the locations in a file and write the result to
+    another file, a chunk of rows at a time.
+
+    Each chunk is written as soon as it is processed, so the memory used
+    depends on the chunk size rather than the number of locations. The
+    formats of the files (csv, parquet or feather) are set by their
+    extensions.
+
+    Keyword arguments:
+    ifile : (string) file of locations
+    ofile : (string) output file
+    func : function taking a pandas dataframe of locations and returning the
+           dataframe to write
+    chunkSize : (int) number of rows read at one time. Default reads the
+                whole file at once.
+    isQuiet : (logical) True will not report the progress to terminal.
+    columns : (list of strings) only read these columns, plus lon and lat.
+              Default reads all columns.
+
+    Returns the number of rows read and the number written.
+    """
+    nRead = 0
+    t0 = time.perf_counter()
+    with LocationWriter(ofile) as writer:
+        for locns in iter_locations(ifile, columns, chunkSize):
+            writer.write(func(locns))
+            nRead += len(locns)
+
+            if not isQuiet:
+                dt = time.perf_counter() - t0
+                print("\t...%i locations processed, %.0f rows/s" %
+                      (nRead, nRead/max(dt, 1e-9)))
+
+    return nRead, writer.nWritten
+
+
 def add_intensities(locns, shakemap):
     """ Add shakemap intensities to each of the locations"""
 
@@ -40,27 +326,37 @@ def add_intensities(locns, shakemap):
     return
 
 
-def add_damageprobs(locns, intensName, fragilityCurve, useMedian=True):
-    """ Add damage probabilities based on the intensities"""
+def add_damageprobs(locns, intensName, fragilityCurve, useMedian=True,
+                    classColumn=None, **kwargs):
+    """ Add damage probabilities based on the intensities
+
+    If useMedian is False the probabilities are averaged over the uncertainty
+    in the intensity, from the '_std' field, with further keyword arguments
+    passed to FragilityCurve.interp_uncertain.
+
+    fragilityCurve can be a FragilityLibrary, in which case each location
+    uses the curve of its vulnerability class, from the classColumn field.
+    """
 
     # TODO: Check input is a dataframe
     # TODO: Check required fields are there in locns
     # TODO: Check match of intensity names
 
-    if not useMedian:
-        print("WARNING: option not available yet. " +
-              "Damage probabilities only based on median intensities")
-
     intensities = locns[intensName + '_med'].values
 
-    # Loop through all damage states in the fragility curve
-    for c in fragilityCurve.damagestates():
-        # Fieldname for the probabilities at these locations
-        fnm = 'prob_' + c
+    # Curve of each location from its class
+    if isinstance(fragilityCurve, FragilityLibrary):
+        fragilityCurve = fragilityCurve.for_locations(
+            locns[classColumn].values)
 
-        # Get the result of the interpolation, allow values over the max by
-        # setting them equal to the max
-        locns[fnm] = fragilityCurve.interp_damagestate(intensities, c)
+    # Interpolate all damage states in the fragility curve at once
+    if useMedian:
+        probs = fragilityCurve.interp_all(intensities)
+    else:
+        probs = fragilityCurve.interp_uncertain(
+            intensities, locns[intensName + '_std'].values, **kwargs)
+    for i, c in enumerate(fragilityCurve.damagestates()):
+        locns['prob_' + c] = probs[:, i]
 
     return
 
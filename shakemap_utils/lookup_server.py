@@ -0,0 +1,285 @@
+"""Local HTTP server answering ShakeMap lookups from grids kept in memory.
+
+The server loads each ShakeMap grid and fragility curve the first time it is
+asked for, and keeps the most recently used ones in a GridCache, so later
+requests only pay for the lookup itself. Requests are handled in threads.
+
+Requests
+ POST /lookup : look up points in a ShakeMap. The parameters are given in
+   the url query string or, for a JSON body, in the body:
+     shakemap : grid file (xml, xml.zip or converted .npy)
+     uncertainty : uncertainty grid file (optional)
+     intensity_measure : e.g. MMI. Default is the fragility curve measure,
+       or MMI
+     fragility : fragility curve csv file (optional), adds the probability
+       of each damage state
+     method : nearest (default) or bilinear
+   The points are either a JSON body {"lon": [...], "lat": [...], ...},
+   answered with JSON lists (null for no value), or an .npy array of shape
+   (n, 2) of lon, lat with content type application/x-npy, answered with an
+   .npy array of shape (n, number of columns) and the column names in the
+   X-Columns header.
+ GET /metrics : JSON of request counts, latencies and grids in memory.
+ GET /health : "ok"
+
+"""
+import io
+import os
+import json
+import time
+import threading
+import numpy as np
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, urlencode
+from urllib.request import Request, urlopen
+
+from .memory_cache import GridCache
+
+
+# Content type of binary arrays
+NPY_TYPE = 'application/x-npy'
+
+# Number of recent requests kept for the latency metrics
+N_LATENCIES = 1000
+
+
+class LookupServer(ThreadingHTTPServer):
+    """ Class defines a threaded HTTP server holding ShakeMaps in memory
+
+    Properties
+     grids: GridCache of the loaded ShakeMaps and fragility curves
+     dataDir: if set, files requested must be within this folder, and
+       relative names are relative to it
+     gridOptions: keyword arguments passed to USGSshakemapGrid, e.g. cache,
+       dtype
+     stats: dict of request counts
+     latencies: the time taken by recent requests in seconds
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 8765), grids=None, dataDir=None,
+                 isQuiet=False, **gridOptions):
+        """Start listening on address, a tuple (host, port). Use port 0 to
+        pick a free port, see server_address.
+
+        Keyword arguments:
+        grids : (GridCache) cache of the loaded grids, can be shared with
+                other code. Default is a new GridCache of 1 GB.
+        """
+        super().__init__(address, LookupRequestHandler)
+        self.grids = GridCache() if grids is None else grids
+        self.dataDir = dataDir
+        self.isQuiet = isQuiet
+        self.gridOptions = gridOptions
+
+        self.stats = {'requests': 0, 'errors': 0, 'points': 0}
+        self.latencies = deque(maxlen=N_LATENCIES)
+        self.lock = threading.Lock()
+
+        return
+
+    def url(self):
+        """Return the base url of the server"""
+        host, port = self.server_address[:2]
+        return 'http://%s:%i' % (host, port)
+
+    def resolve(self, fnm):
+        """Return the full name of a requested file, checking it is within
+        the data folder if there is one.
+
+        """
+        if self.dataDir is None:
+            return os.path.abspath(fnm)
+
+        root = os.path.realpath(self.dataDir)
+        path = os.path.realpath(os.path.join(root, fnm))
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError('%s is outside the data folder' % fnm)
+
+        return path
+
+    def shakemap(self, ifile, ifile_unc, intensMeasure):
+        """Return the USGSshakemapGrid for the files and intensity measure"""
+        ifile = self.resolve(ifile)
+        if ifile_unc is not None:
+            ifile_unc = self.resolve(ifile_unc)
+
+        return self.grids.shakemap(ifile, intensMeasure, ifile_unc,
+                                   **self.gridOptions)
+
+    def fragility(self, ifile):
+        """Return the FragilityCurve read from a csv file"""
+        return self.grids.fragility(self.resolve(ifile))
+
+    def lookup(self, params, xpts, ypts):
+        """Answer a lookup request.
+
+        Returns a list of column names and a list of numpy arrays of values
+        """
+        frag = None
+        if params.get('fragility'):
+            frag = self.fragility(params['fragility'])
+
+        intensMeasure = params.get('intensity_measure')
+        if intensMeasure is None:
+            intensMeasure = 'MMI' if frag is None else frag.intensity_measure
+        elif frag is not None and intensMeasure != frag.intensity_measure:
+            raise ValueError('Intensity measure %s is not the %s of the '
+                             'fragility curve' %
+                             (intensMeasure, frag.intensity_measure))
+
+        if not params.get('shakemap'):
+            raise ValueError('No shakemap given')
+        sm = self.shakemap(params['shakemap'], params.get('uncertainty'),
+                           intensMeasure)
+
+        median, std = sm.lookup(xpts, ypts, params.get('method', 'nearest'))
+        names, cols = ['median', 'std'], [median, std]
+
+        if frag is not None:
+            probs = frag.interp_all(median)
+            for i, c in enumerate(frag.damagestates()):
+                names.append('prob_' + c)
+                cols.append(probs[:, i])
+
+        return names, cols
+
+    def record(self, dt, nPts, isError):
+        """Add a request to the metrics"""
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['errors'] += int(isError)
+            self.stats['points'] += nPts
+            self.latencies.append(dt)
+
+        return
+
+    def metrics(self):
+        """Return a dict of the request counts, latencies in ms and grids in
+        memory"""
+        with self.lock:
+            out = dict(self.stats)
+            lat = np.array(self.latencies)*1e3
+
+        # Grids in memory
+        out['cache'] = self.grids.stats()
+        out['grids'] = ['%s:%s' % (k[1], k[3]) for k in self.grids.keys()
+                        if k[0] == 'shakemap']
+
+        if len(lat) > 0:
+            out.update(latency_ms_mean=lat.mean(),
+                       latency_ms_p50=np.percentile(lat, 50),
+                       latency_ms_p95=np.percentile(lat, 95),
+                       latency_ms_max=lat.max())
+
+        return out
+
+
+class LookupRequestHandler(BaseHTTPRequestHandler):
+    """Handles the requests to a LookupServer"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def send(self, code, body, contentType, headers={}):
+        """Send a response"""
+        self.send_response(code)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+        return
+
+    def send_json(self, code, obj, headers={}):
+        self.send(code, json.dumps(obj).encode(), 'application/json', headers)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/health':
+            self.send(200, b'ok', 'text/plain')
+        elif path == '/metrics':
+            self.send_json(200, self.server.metrics())
+        else:
+            self.send_json(404, {'error': 'Unknown path %s' % path})
+
+        return
+
+    def do_POST(self):
+        t0 = time.perf_counter()
+        url = urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if url.path != '/lookup':
+            self.send_json(404, {'error': 'Unknown path %s' % url.path})
+            return
+
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        isNpy = self.headers.get('Content-Type', '').startswith(NPY_TYPE)
+        nPts = 0
+        try:
+            # Read the points
+            if isNpy:
+                xy = np.load(io.BytesIO(body), allow_pickle=False)
+                xpts, ypts = xy[:, 0], xy[:, 1]
+            else:
+                request = json.loads(body)
+                params.update({k: v for k, v in request.items()
+                               if k not in ('lon', 'lat')})
+                xpts = np.asarray(request['lon'], dtype=float)
+                ypts = np.asarray(request['lat'], dtype=float)
+            nPts = len(xpts)
+
+            names, cols = self.server.lookup(params, xpts, ypts)
+
+        except Exception as e:
+            # Bad requests and files that can't be read
+            dt = time.perf_counter() - t0
+            self.server.record(dt, nPts, True)
+            self.send_json(400, {'error': '%s: %s' % (type(e).__name__, e)})
+            return
+
+        dt = time.perf_counter() - t0
+        headers = {'X-Columns': ','.join(names),
+                   'X-Elapsed-Ms': '%.3f' % (dt*1e3)}
+        if isNpy:
+            f = io.BytesIO()
+            np.save(f, np.column_stack(cols).astype(float))
+            self.send(200, f.getvalue(), NPY_TYPE, headers)
+        else:
+            self.send_json(200, {n: np.where(np.isnan(c), None, c).tolist()
+                                 for n, c in zip(names, cols)}, headers)
+        self.server.record(time.perf_counter() - t0, nPts, False)
+
+        return
+
+    def log_message(self, format, *args):
+        if not self.server.isQuiet:
+            super().log_message(format, *args)
+
+
+def request_lookup(url, xpts, ypts, shakemap, **params):
+    """Send a lookup request to a LookupServer using .npy arrays.
+
+    Returns a dict of numpy arrays, 'median', 'std' and the damage state
+    probabilities if a fragility curve is given.
+
+    Keyword arguments:
+    url : base url of the server, e.g. 'http://127.0.0.1:8765'
+    xpts, ypts : numpy arrays of the lon and lat of the points
+    shakemap : (string) grid file name on the server
+    Other keyword arguments are the request parameters, uncertainty,
+    intensity_measure, fragility and method.
+    """
+    f = io.BytesIO()
+    np.save(f, np.column_stack([xpts, ypts]).astype(float))
+    query = urlencode(dict(params, shakemap=shakemap))
+    req = Request('%s/lookup?%s' % (url, query), data=f.getvalue(),
+                  headers={'Content-Type': NPY_TYPE}, method='POST')
+    with urlopen(req) as response:
+        names = response.headers['X-Columns'].split(',')
+        vals = np.load(io.BytesIO(response.read()), allow_pickle=False)
+
+    return {n: vals[:, i] for i, n in enumerate(names)}
@@ -0,0 +1,165 @@
+"""Expected losses from damage probabilities, and their totals by group.
+
+The loss at a location is its total insured value (tiv) times the damage
+ratio of its damage state. With exceedance probabilities P_j of damage
+states of increasing severity and damage ratios r_j, the expected damage
+ratio is sum_j P_j (r_j - r_{j-1}), one matrix product for all locations.
+
+Totals are added up a chunk of locations at a time: the groups of a chunk
+are factorised to integer codes, mapped to codes kept across chunks, and
+summed with np.bincount, so the locations never need to be in memory at
+once.
+
+"""
+import numpy as np
+import pandas as pd
+
+
+def read_damage_ratios(ratios_in, damagestates):
+    """Return a numpy vector of the damage ratio of each damage state, in
+    the order of damagestates.
+
+    Keyword arguments:
+    ratios_in : csv file with columns of the damage state and its ratio, a
+                dict of damage state to ratio, a string of comma separated
+                ratios or a list of ratios in the order of damagestates.
+    damagestates : names of the damage states, e.g. from
+                   FragilityCurve.damagestates().
+    """
+    damagestates = list(damagestates)
+
+    if isinstance(ratios_in, str) and ratios_in.endswith('.csv'):
+        # Read the first two columns as the states and ratios
+        print("Reading %s..." % ratios_in)
+        df = pd.read_csv(ratios_in)
+        ratios_in = dict(zip(df.iloc[:, 0], df.iloc[:, 1]))
+    elif isinstance(ratios_in, str):
+        ratios_in = [float(r) for r in ratios_in.split(',')]
+
+    if isinstance(ratios_in, dict):
+        missing = [c for c in damagestates if c not in ratios_in]
+        if missing:
+            raise ValueError("No damage ratio for %s" % ', '.join(missing))
+        ratios_in = [ratios_in[c] for c in damagestates]
+
+    ratios = np.asarray(ratios_in, dtype=float)
+    if len(ratios) != len(damagestates):
+        raise ValueError("%i damage ratios for %i damage states" %
+                         (len(ratios), len(damagestates)))
+    if (ratios < 0).any() or (np.diff(ratios) < 0).any():
+        raise ValueError("Damage ratios must be positive and increase " +
+                         "with the damage state")
+
+    return ratios
+
+
+def expected_loss(probs, tiv, damageRatios):
+    """Return a numpy vector of the expected loss at each location.
+
+    Keyword arguments:
+    probs : numpy array of exceedance probabilities with a row for each
+            location and a column for each damage state, as from
+            FragilityCurve.interp_all.
+    tiv : numpy vector of the total insured value of each location.
+    damageRatios : numpy vector of the damage ratio of each damage state.
+    """
+    # Each state adds its increase in ratio over the state below
+    steps = np.diff(damageRatios, prepend=0.0)
+
+    return (probs @ steps) * tiv
+
+
+def group_key(value):
+    """Return the group of a value, None if it is missing and otherwise a
+    string, with whole numbers written as integers. The same group might be
+    read as 132, 132.0 or '132' in different chunks of a file."""
+    if pd.isna(value):
+        return None
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        value = int(value)
+
+    return str(value)
+
+
+class LossAggregator:
+    """ Class defines running totals of locations, values and expected
+    losses, by group for each of a set of columns
+
+    Properties
+     groupColumns: names of the columns the totals are grouped by
+     groups: dict of column name to a list of the groups seen, in the order
+       of their codes, as strings, or None for missing values
+     totals: dict of column name to a 2-d numpy array, with a row for each
+       group of the number of locations, tiv and expected loss
+    """
+
+    def __init__(self, groupColumns=()):
+        self.groupColumns = list(groupColumns)
+        self.groups = {c: [] for c in self.groupColumns}
+        self.totals = {c: np.zeros((0, 3)) for c in self.groupColumns}
+
+        # Code of each group, per column
+        self._codes = {c: {} for c in self.groupColumns}
+
+        # Totals of all locations
+        self.total = np.zeros(3)
+
+        return
+
+    def group_codes(self, column, values):
+        """Return the codes of the groups of a chunk of values, adding codes
+        for groups not seen before"""
+        # Codes within the chunk, -1 if missing, then the codes kept across
+        # chunks, the last entry of the mapping being for the missing values
+        chunkCodes, uniques = pd.factorize(values)
+        codes = self._codes[column]
+        mapping = np.empty(len(uniques) + 1, dtype=np.intp)
+        keys = [group_key(u) for u in uniques]
+        if (chunkCodes < 0).any():
+            keys.append(None)
+        for i, key in enumerate(keys):
+            if key not in codes:
+                codes[key] = len(codes)
+                self.groups[column].append(key)
+            mapping[i] = codes[key]
+
+        return mapping[chunkCodes]
+
+    def add(self, locns, tiv, loss):
+        """Add a chunk of locations to the totals.
+
+        Keyword arguments:
+        locns : pandas dataframe of the locations, with the group columns.
+        tiv, loss : numpy vectors of the value and expected loss of each
+                    location.
+        """
+        self.total += (len(tiv), np.sum(tiv), np.nansum(loss))
+
+        for c in self.groupColumns:
+            codes = self.group_codes(c, locns[c].values)
+            nGroups = len(self.groups[c])
+            chunk = np.column_stack([
+                np.bincount(codes, minlength=nGroups),
+                np.bincount(codes, weights=tiv, minlength=nGroups),
+                np.bincount(codes, weights=np.nan_to_num(loss),
+                            minlength=nGroups)])
+
+            # New groups extend the totals
+            totals = self.totals[c]
+            if len(totals) < nGroups:
+                totals = np.vstack([totals,
+                                    np.zeros((nGroups - len(totals), 3))])
+            self.totals[c] = totals + chunk
+
+        return
+
+    def table(self, column):
+        """Return a pandas dataframe of the totals by group of a column,
+        largest expected loss first"""
+        out = pd.DataFrame(self.totals[column],
+                           columns=['n_locations', 'tiv', 'expected_loss'],
+                           index=pd.Index(self.groups[column], name=column))
+        out['n_locations'] = out['n_locations'].astype(np.int64)
+        out['loss_ratio'] = out['expected_loss'] / out['tiv']
+
+        return out.sort_values('expected_loss', ascending=False)
@@ -0,0 +1,171 @@
+"""In-memory cache of loaded ShakeMap grids and fragility curves.
+
+Objects are kept up to a total size in bytes, worked out from the arrays
+they hold, and the least recently used are dropped to make room. The cache
+can be shared by threads: each object is loaded by one thread while others
+asking for it wait.
+
+"""
+import os
+import mmap
+import threading
+import numpy as np
+from collections import OrderedDict
+
+from .usgs_shakemap_grid import USGSshakemapGrid
+from .fragility_curve import FragilityCurve
+
+
+def owner(arr):
+    """Return the array holding the memory an array is a view of"""
+    while isinstance(arr.base, np.ndarray):
+        arr = arr.base
+
+    return arr
+
+
+def resident_bytes(obj):
+    """Return the bytes of memory held by the arrays of a USGSshakemapGrid or
+    FragilityCurve. Memory mapped arrays are not counted as they are held by
+    the OS page cache.
+
+    A grid that is a view of the block of several fields parsed together
+    holds the whole block, so the arrays viewed are counted, once each.
+    """
+    if isinstance(obj, USGSshakemapGrid):
+        arrays = [obj.grid]
+        if obj.has_std():
+            arrays.append(obj.grid_std)
+    elif isinstance(obj, FragilityCurve):
+        arrays = [obj.intensities, obj.exceedprob.values,
+                  obj.interpolator.c]
+    elif isinstance(obj, np.ndarray):
+        arrays = [obj]
+    else:
+        arrays = [v for v in getattr(obj, '__dict__', {}).values()
+                  if isinstance(v, np.ndarray)]
+
+    owners = {}
+    for a in arrays:
+        a = owner(a)
+        if not isinstance(a, np.memmap) and not isinstance(a.base, mmap.mmap):
+            owners[id(a)] = a.nbytes
+
+    return sum(owners.values())
+
+
+class GridCache:
+    """ Class defines a least recently used cache of loaded grids
+
+    Properties
+     maxBytes: the total size of the objects kept is below this
+     nBytes: total size of the objects kept
+     hits, misses, evictions: number of requests found in the cache, number
+       loaded, and number of objects dropped to make room
+    """
+
+    def __init__(self, maxBytes=1e9):
+        self.maxBytes = maxBytes
+        self.nBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Objects and their sizes, most recently used last
+        self._items = OrderedDict()
+
+        # One lock for the dict and one per key being loaded
+        self._lock = threading.Lock()
+        self._loading = {}
+
+        return
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, load):
+        """Return the object for a key, calling load() to get it if it is
+        not in the cache.
+
+        Objects bigger than maxBytes are returned but not kept.
+        """
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key][0]
+            keyLock = self._loading.setdefault(key, threading.Lock())
+
+        # Only one thread loads each key, others wait for it
+        with keyLock:
+            with self._lock:
+                if key in self._items:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return self._items[key][0]
+
+            obj = load()
+            nBytes = resident_bytes(obj)
+
+            with self._lock:
+                self.misses += 1
+                self._loading.pop(key, None)
+                if nBytes <= self.maxBytes:
+                    self._items[key] = (obj, nBytes)
+                    self.nBytes += nBytes
+                    self.evict()
+
+        return obj
+
+    def evict(self):
+        """Drop the least recently used objects until within maxBytes. Call
+        with the lock held"""
+        while self.nBytes > self.maxBytes and self._items:
+            _, (_, nBytes) = self._items.popitem(last=False)
+            self.nBytes -= nBytes
+            self.evictions += 1
+
+        return
+
+    def shakemap(self, ifile_xml, intensMeasure, ifile_unc=None, **kwargs):
+        """Return the USGSshakemapGrid for the files, intensity measure and
+        other keyword arguments of USGSshakemapGrid.
+
+        """
+        ifile_xml = os.path.abspath(ifile_xml)
+        if ifile_unc is not None:
+            ifile_unc = os.path.abspath(ifile_unc)
+        key = ('shakemap', ifile_xml, ifile_unc, intensMeasure,
+               tuple(sorted((k, str(v)) for k, v in kwargs.items())))
+        kwargs.setdefault('isQuiet', True)
+
+        return self.get(key, lambda: USGSshakemapGrid(
+            ifile_xml, intensMeasure, ifile_unc, **kwargs))
+
+    def fragility(self, ifile):
+        """Return the FragilityCurve read from a csv file"""
+        ifile = os.path.abspath(ifile)
+        return self.get(('fragility', ifile), lambda: FragilityCurve(ifile))
+
+    def clear(self):
+        """Drop all the objects"""
+        with self._lock:
+            self._items.clear()
+            self.nBytes = 0
+
+        return
+
+    def keys(self):
+        """Return a list of the keys, least recently used first"""
+        with self._lock:
+            return list(self._items)
+
+    def stats(self):
+        """Return a dict of the counters and size of the cache"""
+        with self._lock:
+            return {'items': len(self._items), 'bytes': self.nBytes,
+                    'max_bytes': self.maxBytes, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
@@ -0,0 +1,154 @@
+"""Spatial index of a fixed set of locations.
+
+The locations are bucketed on a coarse lat/lon grid and sorted by bucket, so
+the locations in a row of buckets are contiguous. Finding the locations in a
+bounding box, e.g. the extent of a ShakeMap, then only touches the buckets
+it overlaps, and takes a time proportional to the number found rather than
+the size of the portfolio. The index can be saved to a .npz file and loaded
+again for later events.
+
+"""
+import numpy as np
+import pandas as pd
+
+
+# Size in degrees of the buckets
+CELL_SIZE = 0.1
+
+
+class PortfolioIndex:
+    """ Class defines locations bucketed on a coarse lat/lon grid
+
+    Properties
+     x0, y0: lon and lat of the south-west corner of the first bucket
+     cellSize: size of the buckets in degrees
+     nx, ny: number of buckets in the lon and lat directions
+     order: row index of each location, sorted by bucket (row-major, south
+       row first). Locations without coordinates are not indexed.
+     lon, lat: coordinates of the sorted locations
+     starts: position in order of the first location of each bucket, plus
+       the number of indexed locations at the end
+    """
+
+    def __init__(self, locations, cellSize=CELL_SIZE):
+        """Build the index, or load it from a file.
+
+        Keyword arguments:
+        locations : (string) .npz file written by save, or pandas dataframe
+                    with fields 'lon' and 'lat', or tuple of numpy arrays
+                    (lon, lat).
+        cellSize : (float) size of the buckets in degrees. Smaller buckets
+                   fit the bounding box better but take more memory. Ignored
+                   when loading from file.
+        """
+        if type(locations) is str:
+            # Read a saved index
+            with np.load(locations) as f:
+                self.x0, self.y0, self.cellSize = f['origin']
+                self.nx, self.ny = (int(n) for n in f['shape'])
+                self.order = f['order']
+                self.lon = f['lon']
+                self.lat = f['lat']
+                self.starts = f['starts']
+            return
+
+        if isinstance(locations, pd.DataFrame):
+            xpts, ypts = locations['lon'].values, locations['lat'].values
+        else:
+            xpts, ypts = locations
+        xpts = np.asarray(xpts, dtype=float).ravel()
+        ypts = np.asarray(ypts, dtype=float).ravel()
+
+        # Buckets covering the locations with coordinates
+        isOk = np.isfinite(xpts) & np.isfinite(ypts)
+        self.cellSize = cellSize
+        if isOk.any():
+            self.x0 = np.floor(xpts[isOk].min()/cellSize)*cellSize
+            self.y0 = np.floor(ypts[isOk].min()/cellSize)*cellSize
+            self.nx = int((xpts[isOk].max() - self.x0)//cellSize) + 1
+            self.ny = int((ypts[isOk].max() - self.y0)//cellSize) + 1
+        else:
+            self.x0, self.y0, self.nx, self.ny = 0.0, 0.0, 0, 0
+
+        # Sort by bucket
+        iRow = np.flatnonzero(isOk)
+        iCell = self.cell(xpts[iRow], ypts[iRow])
+        isort = np.argsort(iCell, kind='stable')
+        self.order = iRow[isort]
+        self.lon = xpts[self.order]
+        self.lat = ypts[self.order]
+        self.starts = np.searchsorted(iCell[isort],
+                                      np.arange(self.nx*self.ny + 1))
+
+        return
+
+    def cell(self, xpts, ypts):
+        """Return the bucket number of each location"""
+        ix = np.clip((xpts - self.x0)//self.cellSize, 0, self.nx - 1)
+        iy = np.clip((ypts - self.y0)//self.cellSize, 0, self.ny - 1)
+        return (iy*self.nx + ix).astype(np.intp)
+
+    def npoints(self):
+        """Return the number of indexed locations"""
+        return len(self.order)
+
+    def save(self, ofile):
+        """Write the index to a .npz file"""
+        np.savez(ofile, origin=[self.x0, self.y0, self.cellSize],
+                 shape=[self.nx, self.ny], order=self.order, lon=self.lon,
+                 lat=self.lat, starts=self.starts)
+        return
+
+    def candidates(self, xylims):
+        """Return the positions in the sorted arrays of the locations in the
+        buckets overlapping an extent [xmin, xmax, ymin, ymax]
+
+        """
+        # Range of buckets overlapping the extent, worked out the same way as
+        # the bucket of each location
+        ix0, ix1 = (np.asarray(xylims[:2]) - self.x0)//self.cellSize
+        iy0, iy1 = (np.asarray(xylims[2:]) - self.y0)//self.cellSize
+        ix0, iy0 = int(max(ix0, 0)), int(max(iy0, 0))
+        ix1, iy1 = int(min(ix1, self.nx - 1)), int(min(iy1, self.ny - 1))
+        if ix0 > ix1 or iy0 > iy1:
+            return np.empty(0, dtype=np.intp)
+
+        # The buckets in each row of the range are contiguous
+        rows = np.arange(iy0, iy1 + 1)*self.nx
+        i0 = self.starts[rows + ix0]
+        i1 = self.starts[rows + ix1 + 1]
+
+        return np.concatenate([np.arange(a, b) for a, b in zip(i0, i1)])
+
+    def select(self, xylims):
+        """Return the positions in the sorted arrays of the locations within
+        an extent [xmin, xmax, ymin, ymax], in the order of their rows. Locations on
+        the min edges are included, those on the max edges are not.
+
+        """
+        pos = self.candidates(xylims)
+
+        # Only the locations in the edge buckets can be outside
+        x, y = self.lon[pos], self.lat[pos]
+        pos = pos[(x >= xylims[0]) & (x < xylims[1]) &
+                  (y >= xylims[2]) & (y < xylims[3])]
+
+        return pos[np.argsort(self.order[pos])]
+
+    def query(self, xylims):
+        """Return the row indices, in increasing order, of the locations
+        within an extent [xmin, xmax, ymin, ymax]
+
+        """
+        return self.order[self.select(xylims)]
+
+    def lookup(self, shakemap, method='nearest'):
+        """Look up the locations within the extent of a USGSshakemapGrid.
+
+        Returns the row indices of the locations, in increasing order, and
+        numpy arrays of their median and standard deviation.
+        """
+        pos = self.select(shakemap.xylims())
+        median, std = shakemap.lookup(self.lon[pos], self.lat[pos], method)
+
+        return self.order[pos], median, std
@@ -5,10 +5,90 @@ and it's intensity for usgs shakemap
 import numpy as np
 import numpy.ma as ma
 from zipfile import ZipFile, is_zipfile
-from xml.etree.ElementTree import parse
+from xml.etree.ElementTree import parse, fromstring
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 # import sys
 import pdb
 
+from .grid_parser import parse_grid_text, parse_grid_stream
+from .grid_parser import quantise, dequantise, count_clipped
+from .grid_parser import INT16_NODATA, INT16_MAX
+from .grid_cache import GridFileCache, load_fields, save_fields
+from .grid_lookup import cell_index, lookup_points
+
+# Namespace for reading the xml files
+NAMESPACE = {'shakemap': 'http://earthquake.usgs.gov/eqcenter/shakemap'}
+
+# Step between the values stored when fields are kept as int16. ShakeMap
+# values carry 2-4 significant digits. Fields not listed use the default, or
+# the standard deviation scale if their name starts with STD. Fields with
+# values beyond the int16 range of their step, e.g. PGV or PSA over 327.67,
+# use a coarser step
+INT16_SCALES = {'MMI': 0.001, 'SVEL': 0.1, 'URAT': 0.001}
+DEFAULT_INT16_SCALE = 0.01
+STD_INT16_SCALE = 0.001
+
+
+def int16_scale(fieldName, vmax=None):
+    """Return the scale used to store a field as int16, coarsened by powers
+    of ten if needed for values up to vmax in size to fit"""
+    if fieldName in INT16_SCALES:
+        scale = INT16_SCALES[fieldName]
+    elif fieldName.startswith('STD'):
+        scale = STD_INT16_SCALE
+    else:
+        scale = DEFAULT_INT16_SCALE
+
+    if vmax is not None and np.isfinite(vmax) and vmax/scale > INT16_MAX:
+        scale = round(scale * 10**np.ceil(np.log10(vmax/(scale*INT16_MAX))),
+                      12)
+
+    return scale
+
+
+def field_range(data):
+    """Return the largest absolute value of each field of a 3-d array, nan
+    for fields with no values"""
+    with np.errstate(invalid='ignore'):
+        return [float(np.nanmax(np.abs(f))) if np.isfinite(f).any()
+                else np.nan for f in data]
+
+
+def cache_variant(dtype):
+    """Return the GridFileCache variant of fields stored as dtype. Full
+    precision (float64) fields have none, so keep the key of the source file
+
+    """
+    dtype = np.dtype(dtype)
+    if dtype == np.float64:
+        return None
+
+    return 'fields|' + dtype.str
+
+
+def set_missing(vals, isMissing, scale=None):
+    """Return a copy of stored grid values set to missing (nan, or
+    INT16_NODATA for int16 with a scale) where isMissing is True.
+
+    """
+    if scale is None:
+        return np.where(isMissing, np.nan, vals).astype(vals.dtype)
+
+    return np.where(isMissing, INT16_NODATA, vals).astype(vals.dtype)
+
+
+def decode(vals, scale):
+    """Return stored grid values in their units. Values are returned as they
+    are unless they are int16 with a scale.
+
+    """
+    if scale is None:
+        return vals
+
+    return dequantise(vals, scale)
+
+
 # Functions used to read in the ShakeMap grid ---------------------------------
 
 
@@ -52,8 +132,61 @@ def read_root(ifile):
     return obj.getroot()
 
 
+@contextmanager
+def open_grid(ifile):
+    """Open the xml shakemap file as a binary stream. Can handle the text file
+    or zipped file, which is decompressed as the stream is read.
+
+    """
+
+    if is_zipfile(ifile):
+        # Open zip file
+        with ZipFile(ifile, 'r') as myzip:
+
+            # Get all files in zip
+            fileList = myzip.namelist()
+
+            # Check how many files
+            if len(fileList) > 1:
+                print("WARNING: Multiple files in zip. Using first file found")
+
+            with myzip.open(fileList[0], 'r') as xmlFile:
+                yield xmlFile
+    else:
+        with open(ifile, 'rb') as xmlFile:
+            yield xmlFile
+
+
+def read_stream_header(stream, chunkSize=64*1024):
+    """Read the xml from a binary stream up to the start of the grid data.
+
+    Returns the xml root holding the header elements (event, grid
+    specification, fields), and the bytes read after the <grid_data> tag.
+    """
+    tag = b'<grid_data>'
+    text = b''
+    while True:
+        chunk = stream.read(chunkSize)
+        if not chunk:
+            raise ValueError('No <grid_data> found in shakemap file')
+
+        # Search the new text, allowing for the tag split between chunks
+        iStart = max(len(text) - len(tag), 0)
+        text += chunk
+        i = text.find(tag, iStart)
+        if i >= 0:
+            break
+
+    # Close the root element so the header can be parsed on its own
+    root = fromstring(text[:i] + b'</shakemap_grid>')
+
+    return root, text[i + len(tag):]
+
+
 def print_rootitems(root):
-    """ Print the attributes of the shakemap, event ID, version, etc """
+    """ Print the attributes of the shakemap, event ID, version, etc. Takes the
+    xml root or a dict of its attributes.
+    """
     print("Shakemap key details:")
     for t, v in root.items():
         print("\t", t, ":", v)
@@ -89,41 +222,208 @@ def read_griddims(root, ns):
     return nx, ny
 
 
-def read_gridvals(root, ns, intensMeasure, ny, nx):
+def read_fieldnames(root, ns):
+    """Return a list of the grid column headers in the order of the columns"""
 
     # Number of columns in the grid
     nF = len(root.findall('shakemap:grid_field', ns))
 
-    # Get all the gridded data as a text string
-    t = root.find('shakemap:grid_data', ns).text
-
-    # Convert to number. Previously used np.fromstring(), but this
-    # works faster
-    t = t.replace('\n', ' ').strip()
-    t = t.split(sep=' ')
-    a = np.array(t, dtype=float)
-
     # Get the grid column headers
     fnms = [None]*nF
     for f in root.findall('shakemap:grid_field', ns):
         i = int(f.get('index')) - 1
         fnms[i] = f.get('name')
 
-    # work out which column stores our intensity measure
+    return fnms
+
+
+def field_index(fnms, intensMeasure):
+    """Work out which column stores our intensity measure"""
     if intensMeasure in fnms:
-        iCol = fnms.index(intensMeasure)
+        return fnms.index(intensMeasure)
     else:
         print("Valid fieldnames:\n", fnms)
         raise ValueError('\'%s\' is not in list' % intensMeasure)
 
-    # TODO: check if intensity measure wasn't there
+
+def read_gridvals(root, ns, intensMeasure, ny, nx):
+
+    # Get the grid column headers and which one is our intensity measure
+    fnms = read_fieldnames(root, ns)
+    iCol = field_index(fnms, intensMeasure)
+
+    # Convert the gridded data text to numbers, keeping only our column. The
+    # text is converted in pieces straight into the output array rather than
+    # split into a list of strings
+    t = root.find('shakemap:grid_data', ns).text
+    a = parse_grid_text(t, nx*ny, len(fnms), usecols=[iCol])
 
     # Note it is y-ordered array read in upside down at first
-    gridVal = np.flipud(a[iCol::nF].reshape([ny, nx]))
+    gridVal = np.flipud(a[0].reshape([ny, nx]))
 
     return gridVal
 
 
+def header_from_root(root):
+    """Return a dict of the header details from the xml root.
+
+    Fields are 'hdr' (root attributes), 'eventInfo' (event attributes),
+    'xylims' (coords of the first and last grid centers [x0, x1, y0, y1]),
+    'nx' and 'ny' (grid dimensions) and 'fieldNames' (all grid columns).
+    """
+    nx, ny = read_griddims(root, NAMESPACE)
+    return {'hdr': dict(root.attrib),
+            'eventInfo': dict(root.find('shakemap:event', NAMESPACE).attrib),
+            'xylims': read_gridlims(root, NAMESPACE),
+            'nx': nx,
+            'ny': ny,
+            'fieldNames': read_fieldnames(root, NAMESPACE)}
+
+
+def read_header(ifile):
+    """Read the header details of a shakemap grid file without its grid data.
+
+    Only the start of the file, up to the <grid_data> tag, is read (and
+    decompressed for a zip file), so this is quick even for a large grid.
+    Returns a dict as described in header_from_root.
+    """
+    with open_grid(ifile) as stream:
+        root = read_stream_header(stream, chunkSize=8*1024)[0]
+
+    return header_from_root(root)
+
+
+def check_uncheader(uncHeader, header):
+    """Check the header of the uncertainty file is for the same shakemap and
+    grid as the header of the shakemap file. Headers are dicts as returned by
+    read_header. Returns True if they match.
+
+    """
+    isOk = True
+
+    # Check the event id and version are the same
+    for fnm in ('event_id', 'shakemap_id', 'shakemap_version'):
+        if uncHeader['hdr'].get(fnm) != header['hdr'].get(fnm):
+            print("ERROR: mismatch in %s: %s vs %s" %
+                  (fnm, uncHeader['hdr'].get(fnm), header['hdr'].get(fnm)))
+            isOk = False
+
+    # Check the limits and spacing are the same
+    theseLims = uncHeader['xylims']
+    if (abs(np.sum(np.array(theseLims) - header['xylims'])) > 1e-12 or
+            (uncHeader['nx'], uncHeader['ny']) !=
+            (header['nx'], header['ny'])):
+        print("ERROR: mismatch in grid limits for uncertainty file")
+        print(theseLims, "vs", header['xylims'])
+        isOk = False
+
+    return isOk
+
+
+def read_fields(ifile, fieldNames=None, dtype=float, nWorkers=1):
+    """Read several fields from a shakemap grid file in one pass.
+
+    Keyword arguments:
+    ifile : (string) xml file downloaded from USGS, can be text or zip.
+    fieldNames : (list of strings) which grid fields to keep. Default is all
+                 fields except the LON and LAT coordinates.
+    dtype : numpy data type the fields are stored as, e.g. float32. For
+            int16 each field is stored as a count of its int16_scale.
+    nWorkers : (int) number of processes converting the grid text in
+               parallel. Default is 1, converting in this process.
+
+    Returns the header dict (see header_from_root) with 'fieldNames' set to
+    the fields kept and 'scales' to the int16 scale of each field (None if
+    not int16), and a 3-d numpy array of the fields in the row order of the
+    file, i.e. with the north row first.
+    """
+
+    with open_grid(ifile) as stream:
+
+        # Parse the XML header only
+        root, rest = read_stream_header(stream)
+        meta = header_from_root(root)
+        nx, ny = meta['nx'], meta['ny']
+
+        # Work out which columns of the file we keep
+        fnms = meta['fieldNames']
+        if fieldNames is None:
+            fieldNames = [f for f in fnms if f not in ('LON', 'LAT')]
+        iCols = [field_index(fnms, f) for f in fieldNames]
+        meta['fieldNames'] = list(fieldNames)
+        meta['scales'] = None
+        if np.dtype(dtype) == np.int16:
+            meta['scales'] = [int16_scale(f) for f in fieldNames]
+
+        # Convert all the fields in one pass, decompressing and converting the
+        # text a chunk at a time without holding all of it in memory
+        a = parse_grid_stream(stream, nx*ny, len(fnms), usecols=iCols,
+                              dtype=dtype, head=rest, scales=meta['scales'],
+                              nWorkers=nWorkers)
+    a = a.reshape([len(iCols), ny, nx])
+
+    # Fields that reached the int16 range are read again at full precision
+    # and stored with a scale that fits their values
+    if meta['scales'] is not None:
+        iClipped = np.flatnonzero(count_clipped(a))
+        if len(iClipped) > 0:
+            clipped = [fieldNames[i] for i in iClipped]
+            print("WARNING: %s reached the int16 range of the default "
+                  "scale, reading again to fit the scale to the values" %
+                  ', '.join(clipped))
+            _, vals = read_fields(ifile, clipped, np.float32, nWorkers)
+            for i, v, vmax in zip(iClipped, vals, field_range(vals)):
+                meta['scales'][i] = int16_scale(fieldNames[i], vmax)
+                a[i] = quantise(v, meta['scales'][i])
+
+    return meta, a
+
+
+def cast_fields(meta, data, dtype):
+    """Return the meta data dict and 3-d field array converted to another
+    dtype, with the int16 scales updated.
+
+    """
+    dtype = np.dtype(dtype)
+    scales = meta.get('scales')
+    if data.dtype == dtype:
+        return meta, data
+
+    # Convert stored int16 counts back to values
+    if scales is not None:
+        data = dequantise(data, np.reshape(scales, [-1, 1, 1]),
+                          float if dtype == np.int16 else dtype)
+        scales = None
+
+    if dtype == np.int16:
+        scales = [int16_scale(f, vmax) for f, vmax in
+                  zip(meta['fieldNames'], field_range(data))]
+        data = quantise(data, np.reshape(scales, [-1, 1, 1]))
+    elif data.dtype != dtype:
+        data = data.astype(dtype)
+
+    return dict(meta, scales=scales), data
+
+
+def convert_grid(ifile, ofile, fieldNames=None, dtype=float):
+    """Convert a shakemap grid file to a .npy file of the field values and a
+    .json file of the header details, which can be memory mapped by
+    USGSshakemapFields and USGSshakemapGrid.
+
+    Keyword arguments:
+    ifile : (string) xml file downloaded from USGS, can be text or zip.
+    ofile : (string) output file name ending in .npy. The json file has the
+            same name with the .json extension.
+    fieldNames : (list of strings) which grid fields to keep. Default is all
+                 fields except the LON and LAT coordinates.
+    dtype : numpy data type the fields are stored as, see read_fields.
+    """
+    meta, data = read_fields(ifile, fieldNames, dtype)
+    save_fields(ofile, meta, data)
+
+    return ofile
+
+
 def check_uncgrid(root2, hdr, namespace, xylims):
 
     isOk = True
@@ -148,6 +448,194 @@ def check_uncgrid(root2, hdr, namespace, xylims):
 # ------------------------------------------------------------------------------
 
 
+class USGSshakemapFields:
+    """ Class holds several fields of a USGS shakemap grid file, parsed once
+
+    Properties
+     hdr: root attributes
+     eventInfo: event attributes
+     x0, x1, y0, y1: lon/lat coordinates of the grid cell centers at the
+       west, east, south and north edges of the grid
+     fieldNames: list of the names of the fields held, e.g. ['MMI', 'PGA']
+     data: 3-d numpy array of field values. Field is the first dimension,
+       latitude (y) the second and longitude (x) the third. data[:, 0, 0] is
+       the SW most point
+     scales: list of the int16 scale of each field if the data are stored as
+       int16, otherwise None
+    """
+
+    def __init__(self, ifile_xml, fieldNames=None, isQuiet=False,
+                 cache=None, useMemmap=False, dtype=float, nWorkers=1):
+        """Parse all the requested fields from the grid.xml file in one pass.
+
+        Keyword arguments:
+
+        ifile_xml : (string) xml file downloaded from USGS, can be text or zip.
+                    Can also be a .npy file written by convert_grid.
+        fieldNames : (list of strings) which grid fields to keep. Default is
+                     all fields except the LON and LAT coordinates.
+        isQuiet : (logical) False will report details of the import to
+                  terminal. Default is False.
+        cache : (GridFileCache) if given, the parsed file is loaded from this
+                cache, or all of its fields are stored there after parsing.
+                Each dtype is cached separately.
+        useMemmap : (logical) True keeps the data as a read-only memory map of
+                    the converted or cached file instead of reading it into
+                    memory, so processes opening the same grid share one copy.
+                    All fields are then kept. An xml file is cached next to
+                    the source if no cache is given. Default is False.
+        dtype : numpy data type the fields are stored as. float32 halves the
+                memory of the default float64. int16 quarters it, storing
+                each field as a count of its int16_scale. A memory mapped
+                file stored as a different dtype is converted into memory.
+        nWorkers : (int) number of processes converting the grid text in
+                   parallel when parsing an xml file. Default is 1.
+        """
+
+        # Get the details and field values. Converted files are mapped
+        # directly, xml files come from the cache if we can
+        mapped = None
+        if ifile_xml.endswith('.npy'):
+            mapped = load_fields(ifile_xml, mmap_mode='r')
+        else:
+            if cache is None and useMemmap:
+                cache = GridFileCache()
+
+            # Fields stored at a lower precision have their own entry, so
+            # they are never served to a request for another dtype
+            variant = cache_variant(dtype)
+            if cache is not None:
+                mapped = cache.get(ifile_xml, mmap_mode='r', variant=variant)
+
+            if mapped is None:
+                # Keep all fields if we are going to cache them
+                meta, data = read_fields(ifile_xml,
+                                         None if cache is not None
+                                         else fieldNames, dtype, nWorkers)
+                if cache is not None:
+                    cache.put(ifile_xml, meta, data, variant)
+                    if useMemmap:
+                        mapped = cache.get(ifile_xml, mmap_mode='r',
+                                           variant=variant)
+
+        if mapped is not None:
+            meta, data = mapped
+
+        # Get the shakemap details
+        self.hdr = meta['hdr']
+        if not isQuiet:
+            print_rootitems(self.hdr)
+
+        self.eventInfo = meta['eventInfo']
+
+        # Get grid limits; these are the coords of the first and last grid
+        # centers
+        self.x0, self.x1, self.y0, self.y1 = meta['xylims']
+
+        # Select the fields we want, only these are read from a memory mapped
+        # file unless we keep the memory map itself
+        scales = meta.get('scales')
+        keepAll = (fieldNames is None or
+                   list(fieldNames) == meta['fieldNames'] or
+                   (useMemmap and mapped is not None))
+        if keepAll:
+            self.fieldNames = list(meta['fieldNames'])
+        else:
+            self.fieldNames = list(fieldNames)
+            iSel = [field_index(meta['fieldNames'], f) for f in fieldNames]
+            data = data[iSel]
+            if scales is not None:
+                scales = [scales[i] for i in iSel]
+
+        # Convert to the dtype we want
+        isSameType = data.dtype == np.dtype(dtype)
+        meta, data = cast_fields(dict(meta, fieldNames=self.fieldNames,
+                                      scales=scales), data, dtype)
+        self.scales = meta['scales']
+        if keepAll and isSameType and mapped is not None and not useMemmap:
+            data = np.array(data)
+
+        # The file is y-ordered with the north row first, so flip the lat axis
+        # as a view
+        self.data = data[:, ::-1, :]
+
+        return
+
+    def nx(self):
+        return np.size(self.data, axis=2)
+
+    def ny(self):
+        return np.size(self.data, axis=1)
+
+    def xylims(self):
+        """Return the coordinates of the grid cell centers at the edges as a
+        list [x0, x1, y0, y1]
+
+        """
+        return [self.x0, self.x1, self.y0, self.y1]
+
+    def field(self, fieldName):
+        """Return the 2-d grid of one field as a view on the data (no copy).
+        These are the stored values, which are counts of the scale for int16.
+
+        """
+        return self.data[field_index(self.fieldNames, fieldName)]
+
+    def scale(self, fieldName):
+        """Return the int16 scale of a field, None if not stored as int16"""
+        if self.scales is None:
+            return None
+
+        return self.scales[field_index(self.fieldNames, fieldName)]
+
+    def values(self, fieldName):
+        """Return the 2-d grid of one field in its units"""
+        return decode(self.field(fieldName), self.scale(fieldName))
+
+    def header(self):
+        """Return a dict of the header details as returned by read_header,
+        with the names of the fields held.
+
+        """
+        return {'hdr': self.hdr, 'eventInfo': self.eventInfo,
+                'xylims': self.xylims(), 'nx': self.nx(), 'ny': self.ny(),
+                'fieldNames': self.fieldNames}
+
+    def check_match(self, other):
+        """Check another set of fields, e.g. from the uncertainty file, is for
+        the same shakemap and grid. Returns True if it is.
+
+        """
+        return check_uncheader(other.header(), self.header())
+
+
+def is_xmlfile(ifile):
+    """Return True if ifile is the name of a grid file still to be parsed"""
+    return isinstance(ifile, str) and not ifile.endswith('.npy')
+
+
+def read_fields_concurrently(jobs, nWorkers=None, useThreads=False):
+    """Read several grid files at the same time with a pool of workers.
+
+    Keyword arguments:
+    jobs : list of dicts of the keyword arguments of USGSshakemapFields for
+           each file, e.g. [{'ifile_xml': 'grid.xml.zip'},
+                            {'ifile_xml': 'uncertainty.xml.zip'}]
+    nWorkers : (int) number of workers. Default is one per job.
+    useThreads : (logical) use threads rather than processes. Only worth it
+                 when little parsing is needed, e.g. memory mapped files.
+
+    Returns a list of USGSshakemapFields in the same order as the jobs.
+    """
+    if nWorkers is None:
+        nWorkers = len(jobs)
+
+    Executor = ThreadPoolExecutor if useThreads else ProcessPoolExecutor
+    with Executor(min(nWorkers, len(jobs))) as pool:
+        futures = [pool.submit(USGSshakemapFields, **job) for job in jobs]
+        return [f.result() for f in futures]
+
+
 class USGSshakemapGrid:
     """ Class defines a USGS shakemap grid for a single intensity measure
 
@@ -162,11 +650,15 @@ class USGSshakemapGrid:
      grid: 2-d numpy array of intensity values
        latitude (y) is the first dimension, longitude (x) is the 2nd dimension
        the first value of the grid, ie grid[0,0] is the SW most point
-     grid_std: 2-d numpy array of the standard deviations
+     grid_std: 2-d numpy array of the standard deviations. Read-only zeros
+       taking no memory if there is no uncertainty grid.
+     scale, stdScale: int16 scale of grid and grid_std when stored as int16,
+       otherwise None. Use decode() to get the values in their units.
     """
 
     def __init__(self, ifile_xml, intensMeasure, ifile_unc=None,
-                 isQuiet=False, ignoreSVEL600=False):
+                 isQuiet=False, ignoreSVEL600=False, cache=None,
+                 useMemmap=False, dtype=float, nWorkers=1):
         """Initiate the class based on the grid.xml file.
 
         Focus on one specific intensity measure.
@@ -174,73 +666,132 @@ class USGSshakemapGrid:
         Keyword arguments:
 
         ifile_xml : (string) xml file downloaded from USGS, can be text or zip.
+                    Can also be a USGSshakemapFields object that has already
+                    been read, in which case the grid is a view of its data.
         intensMeasure: (string) which intensity measure to use from the file,
                        corresponding to the name of a grid column/field within
                        the file. e.g. 'mmi', 'pga', 'psa03'
+        ifile_unc : (string) uncertainty xml file, or USGSshakemapFields object
+                    holding the 'STD' field of the intensity measure.
 
         isQuiet : (logical) True will report details of the import to
                   terminal. Default is False.
+        cache : (GridFileCache) on-disk cache used to avoid parsing the same
+                xml files again.
+        useMemmap : (logical) True keeps the grids as read-only memory maps of
+                    the cached or converted (.npy) files rather than reading
+                    them into memory. Default is False.
+        dtype : numpy data type of the stored grids, float64 (default),
+                float32 or int16. Lookups return the same float type, or
+                float32 for int16.
+        nWorkers : (int) if more than 1, the grid and uncertainty xml files
+                   are read at the same time by a pool of worker processes,
+                   after checking their headers match. Without an
+                   uncertainty file the grid text is converted by this many
+                   processes in parallel. Default is 1.
 
         """
 
-        # Namespace for reading the xml files
-        namespace = {'shakemap':
-                     'http://earthquake.usgs.gov/eqcenter/shakemap'}
-
-        # Parse the XML
-        root = read_root(ifile_xml)
+        # Parse the XML, reading the intensity measure and site conditions in
+        # one pass
+        fieldNames = [intensMeasure]
+        if ignoreSVEL600:
+            fieldNames.append('SVEL')
+        gridJob = {'ifile_xml': ifile_xml, 'fieldNames': fieldNames,
+                   'isQuiet': isQuiet, 'cache': cache,
+                   'useMemmap': useMemmap, 'dtype': dtype}
+        uncName = 'STD'+intensMeasure
+
+        if isinstance(ifile_xml, USGSshakemapFields):
+            smFields = ifile_xml
+        elif nWorkers > 1 and is_xmlfile(ifile_xml) and is_xmlfile(ifile_unc):
+            # Check the uncertainty file matches from the headers, then read
+            # both files at the same time
+            if check_uncheader(read_header(ifile_unc), read_header(ifile_xml)):
+                uncJob = dict(gridJob, ifile_xml=ifile_unc,
+                              fieldNames=[uncName], isQuiet=True)
+                smFields, ifile_unc = read_fields_concurrently(
+                    [gridJob, uncJob], nWorkers, useThreads=useMemmap)
+            else:
+                smFields = USGSshakemapFields(nWorkers=nWorkers, **gridJob)
+                ifile_unc = None
+        else:
+            smFields = USGSshakemapFields(nWorkers=nWorkers, **gridJob)
 
         # Get the shakemap details
-        self.hdr = root.attrib
-        if not isQuiet:
-            print_rootitems(root)
+        self.hdr = smFields.hdr
 
         # Display event information
-        self.eventInfo = root.find('shakemap:event', namespace).attrib
+        self.eventInfo = smFields.eventInfo
         # print_eventinfo(self.eventInfo)
 
-        # Get grid limits as vector [x0, x1, y0, y1]; these are the coords of
-        # the first and last grid centers
-        xylims = read_gridlims(root, namespace)
-        self.x0 = xylims[0]
-        self.x1 = xylims[1]
-        self.y0 = xylims[2]
-        self.y1 = xylims[3]
-
-        # Get grid dimensions, x is lon, y is lat
-        # Note the precision is worse if we read the grid spacing from the file
-        nx, ny = read_griddims(root, namespace)
+        # Get grid limits; these are the coords of the first and last grid
+        # centers. Note the precision is worse if we read the grid spacing
+        # from the file
+        self.x0, self.x1, self.y0, self.y1 = smFields.xylims()
 
         # Get grid itself, axis=0 is the y/lat axis
-        self.grid = read_gridvals(root, namespace, intensMeasure, ny, nx)
+        self.grid = smFields.field(intensMeasure)
+        self.scale = smFields.scale(intensMeasure)
         self.intensMeasure = intensMeasure
 
         # Check if we want to remove points in the sea
         if ignoreSVEL600:
-            t = read_gridvals(root, namespace, 'SVEL', ny, nx)
-            t[t == 600] = np.nan
-            t[~np.isnan(t)] = 1.0
-            self.grid = self.grid*t
-        else:
-            t = np.ones(self.grid.shape)
+            isSea = np.isclose(smFields.values('SVEL'), 600)
+            self.grid = set_missing(self.grid, isSea, self.scale)
 
-        # Add the uncertainty file
-        self.grid_std = np.zeros(np.shape(self.grid))
+        # Add the uncertainty file. Without one there is no array stored
+        self.grid_std = None
+        self.stdScale = None
         if ifile_unc is not None:
             # Add from file
             # Parse the XML
-            root2 = read_root(ifile_unc)
-
-            if check_uncgrid(root2, self.hdr, namespace, xylims) is True:
+            if isinstance(ifile_unc, USGSshakemapFields):
+                uncFields = ifile_unc
+            elif (ifile_unc.endswith('.npy') or
+                  check_uncheader(read_header(ifile_unc), smFields.header())):
+                # The header of an xml file is checked before reading the grid
+                uncFields = USGSshakemapFields(ifile_unc, [uncName],
+                                               isQuiet=True, cache=cache,
+                                               useMemmap=useMemmap,
+                                               dtype=self.grid.dtype)
+            else:
+                uncFields = None
+
+            if uncFields is not None and smFields.check_match(uncFields):
                 # Import the grid
-                self.grid_std = read_gridvals(root2, namespace,
-                                              'STD'+self.intensMeasure,
-                                              np.size(self.grid, 0),
-                                              np.size(self.grid, 1))
-                self.grid_std = self.grid_std*t
+                self.grid_std = uncFields.field(uncName)
+                self.stdScale = uncFields.scale(uncName)
+                if ignoreSVEL600:
+                    self.grid_std = set_missing(self.grid_std, isSea,
+                                                self.stdScale)
 
         return
 
+    @property
+    def grid_std(self):
+        if self._grid_std is None:
+            # Zeros that are not allocated for the full grid
+            return np.broadcast_to(np.zeros(1, self.grid.dtype),
+                                   self.grid.shape)
+
+        return self._grid_std
+
+    @grid_std.setter
+    def grid_std(self, value):
+        self._grid_std = value
+
+    def has_std(self):
+        """Return True if the grid has standard deviations from a file"""
+        return self._grid_std is not None
+
+    def out_dtype(self):
+        """Return the float type of values returned by lookups"""
+        if self.scale is not None:
+            return np.dtype(np.float32)
+
+        return self.grid.dtype
+
     # Get the grid spacing
     def dx(self):
         """Return the grid spacing in the lon direction. Won't work if
@@ -331,45 +882,54 @@ class USGSshakemapGrid:
         """
         return {'lon': np.tile(self.xcoords(), self.ny()),
                 'lat': np.repeat(self.ycoords(), self.nx()),
-                'm0': self.grid.flatten(order='C'),
-                'sd': self.grid_std.flatten(order='C')}
+                'm0': decode(self.grid.flatten(order='C'), self.scale),
+                'sd': decode(self.grid_std.flatten(order='C'),
+                             self.stdScale)}
 
     # Get the grid index for specified coordinates
     def grididx(self, xpts, ypts):
-        # Get the indices of the grid for each point
-        iLon = np.floor(self.nx()*(xpts - self.x0)/(self.x1 - self.x0))
-        iLon = iLon.astype(int)
-
-        iLat = np.floor(self.ny()*(ypts - self.y0)/(self.y1 - self.y0))
-        iLat = iLat.astype(int)
+        """Return masked arrays of the lon and lat index of the grid cell
+        containing each point, masked outside the grid.
 
-        # Set nan where outside of grid
-        iLat = ma.masked_outside(iLat, 0, self.ny()-1)
-        iLon = ma.masked_outside(iLon, 0, self.nx()-1)
+        """
+        iLon, iLat, isIn = cell_index(xpts, ypts, self.x0, self.y0, self.dx(),
+                                      self.dy(), self.nx(), self.ny())
 
-        return iLon, iLat
+        return ma.masked_array(iLon, ~isIn), ma.masked_array(iLat, ~isIn)
 
     # Lookup from grid at specified coordinates
-    def lookup(self, xpts, ypts):
-        """ Find grid intensities at each of the points """
-
-        # Get the indices of the grid for each point
-        iLon, iLat = self.grididx(xpts, ypts)
+    def lookup(self, xpts, ypts, method='nearest', out=None):
+        """ Find grid intensities at each of the points
 
-        # Initialize outputs
-        mean = np.empty(xpts.shape)
-        std = np.empty(ypts.shape)
+        Returns the median and standard deviation at each point, nan outside
+        of the grid. The standard deviation is 0 inside the grid if there is
+        no uncertainty grid.
 
-        # Lookup
-        isIn = ~iLon.mask & ~iLat.mask
-        mean[isIn] = self.grid[iLat[isIn], iLon[isIn]]
-        std[isIn] = self.grid_std[iLat[isIn], iLon[isIn]]
-
-        # Set nan where outside of grid
-        mean[~isIn] = np.nan
-        std[~isIn] = np.nan
-
-        return mean, std
+        Keyword arguments:
+        xpts, ypts : numpy arrays of the lon and lat of the points
+        method : 'nearest' (default) takes the value of the grid cell
+                 containing the point, 'bilinear' interpolates between the
+                 four nearest grid cell centers.
+        out : tuple of two arrays, with the size of xpts and type
+              out_dtype(), to write the median and standard deviation into.
+              Use to avoid allocating new arrays on repeated lookups. They
+              must be 1-d or contiguous.
+        """
+        xpts = np.asarray(xpts)
+        if out is not None:
+            # Flattening a non-contiguous array copies it, and the values
+            # would never reach the caller's buffer
+            flat = [np.reshape(o, -1) for o in out]
+            if not all(np.shares_memory(f, o) for f, o in zip(flat, out)):
+                raise ValueError('Output buffers must be 1-d or contiguous')
+            out = flat
+
+        mean, std = lookup_points(
+            [self.grid, self.grid_std], [self.scale, self.stdScale],
+            xpts, ypts, self.x0, self.y0, self.dx(), self.dy(), method,
+            out, self.out_dtype())
+
+        return mean.reshape(xpts.shape), std.reshape(xpts.shape)
 
     # Adjust the grid extent
     def clipxy(self, xyclip):
@@ -399,7 +959,8 @@ class USGSshakemapGrid:
 
         # Update the grid
         self.grid = self.grid[i0:i1+1, j0:j1+1]
-        self.grid_std = self.grid_std[i0:i1+1, j0:j1+1]
+        if self.has_std():
+            self.grid_std = self.grid_std[i0:i1+1, j0:j1+1]
         self.x0 = xi[j0]
         self.x1 = xi[j1]
         self.y0 = yi[i0]
@@ -419,14 +980,14 @@ class USGSshakemapGrid:
         """
 
         # Find values above the grid limits
-        isOver = self.grid >= minIntensity
+        isOver = decode(self.grid, self.scale) >= minIntensity
 
         # Get grid coordinates of these cells
         xi = self.xcoords(np.any(isOver, axis=0))  # use axis=0 since y is axis=1
         yi = self.ycoords(np.any(isOver, axis=1))
 
         # Get half of x and y spacing
-        halfdx, halfdy = 0.5*self.dx, 0.5*self.dy
+        halfdx, halfdy = 0.5*self.dx(), 0.5*self.dy()
 
         # Get the clip bounds
         xyclip = np.array([xi[0]-halfdx, xi[-1]+halfdx,
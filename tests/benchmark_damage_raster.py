@@ -0,0 +1,107 @@
+"""Benchmark damage probabilities from a raster of the grid against
+interpolating the fragility curves at each location.
+
+The direct path looks up the intensity at each location and interpolates the
+curves there, or averages them over its uncertainty. The raster path applies the curves to every grid cell once,
+or loads that raster from the cache, then looks up the probabilities. The
+raster pays off once the portfolios looked up add up to more locations than
+the crossover printed for each case.
+
+Usage: python benchmark_damage_raster.py [nx] [ny] [maxPoints]
+"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+from shakemap_utils import USGSshakemapGrid, FragilityCurve, GridFileCache
+from shakemap_utils.damage_raster import DamageRaster
+from synthetic_shakemap import write_grid, write_uncertainty
+
+
+# Parameters ------------------------------------------------------------------
+nx = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+ny = int(sys.argv[2]) if len(sys.argv) > 2 else 450
+maxPts = int(float(sys.argv[3])) if len(sys.argv) > 3 else 10000000
+fragilityFile = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'example_damage_est', 'my_fragility.csv')
+
+
+# Functions -------------------------------------------------------------------
+
+
+def timed(func, nRepeat=3):
+    """Return the result and best time of a function"""
+    dt = np.inf
+    for _ in range(nRepeat):
+        t0 = time.perf_counter()
+        out = func()
+        dt = min(dt, time.perf_counter() - t0)
+    return out, dt
+
+
+def crossover(dtSetup, dtDirect, dtRaster, n):
+    """Return the number of locations above which the setup time of the
+    raster is paid back, from the times to look up n locations"""
+    saving = (dtDirect - dtRaster) / n
+    return dtSetup / saving if saving > 0 else np.inf
+
+
+# Script ----------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    tmpDir = tempfile.mkdtemp()
+    ifile = write_grid(os.path.join(tmpDir, 'grid.xml'), nx, ny)
+    ifile_unc = write_uncertainty(os.path.join(tmpDir, 'unc.xml'), nx, ny)
+    shakemap = USGSshakemapGrid(ifile, 'MMI', ifile_unc, isQuiet=True)
+    cache = GridFileCache(os.path.join(tmpDir, 'cache'))
+    x0, x1, y0, y1 = shakemap.xylims()
+    rng = np.random.default_rng(2)
+
+    print('%i x %i grid, %i cells' % (nx, ny, nx*ny))
+    cases = (('exact', None, False), ('table, step 0.01', 0.01, False),
+             ('exact, with uncertainty', None, True))
+    for label, step, useUnc in cases:
+        frag = FragilityCurve(fragilityFile)
+        if step is not None:
+            frag.tabulate(step)
+
+        def direct(x, y):
+            median, std = shakemap.lookup(x, y)
+            if useUnc:
+                return frag.interp_uncertain(median, std)
+            return frag.interp_all(median)
+
+        raster, dtBuild = timed(lambda: DamageRaster(
+            shakemap, frag, useUncertainty=useUnc))
+        DamageRaster(ifile, frag, ifile_unc, cache=cache, shakemap=shakemap,
+                     useUncertainty=useUnc)
+        _, dtLoad = timed(lambda: DamageRaster(
+            ifile, frag, ifile_unc, cache=cache, useUncertainty=useUnc))
+
+        print('Fragility %s' % label)
+        print('\tBuild raster: %.3f s, load from cache: %.4f s' %
+              (dtBuild, dtLoad))
+        print('\t%10s %10s %10s' % ('locations', 'direct', 'raster'))
+        n = 1000
+        while n <= (maxPts // 10 if useUnc else maxPts):
+            x = rng.uniform(x0, x1, n)
+            y = rng.uniform(y0, y1, n)
+            probs, dtDirect = timed(lambda: direct(x, y))
+            rasterProbs, dtRaster = timed(lambda: raster.lookup(x, y))
+            assert np.allclose(rasterProbs, probs, atol=1e-6, equal_nan=True)
+            print('\t%10i %9.4fs %9.4fs' % (n, dtDirect, dtRaster))
+            n *= 10
+
+        n //= 10
+        print('\tCrossover: %.3g locations building the raster, '
+              '%.3g loading it (%.2f and %.3f times the grid cells)' %
+              (crossover(dtBuild, dtDirect, dtRaster, n),
+               crossover(dtLoad, dtDirect, dtRaster, n),
+               crossover(dtBuild, dtDirect, dtRaster, n)/(nx*ny),
+               crossover(dtLoad, dtDirect, dtRaster, n)/(nx*ny)))
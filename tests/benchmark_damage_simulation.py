@@ -0,0 +1,83 @@
+"""Benchmark the Monte Carlo simulation of damage to a portfolio.
+
+Compares simulating one realisation at a time, keeping the counts of every
+realisation, against simulate_damage with vectorised batches, with and
+without a table of the fragility curve, and with several processes.
+
+Usage: python benchmark_damage_simulation.py [nPoints] [nRealisations]
+"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import sys
+import time
+import numpy as np
+
+from shakemap_utils import FragilityCurve
+from shakemap_utils.damage_simulation import simulate_damage
+
+
+# Parameters ------------------------------------------------------------------
+nPts = int(float(sys.argv[1])) if len(sys.argv) > 1 else 10000
+nReal = int(float(sys.argv[2])) if len(sys.argv) > 2 else 2000
+fragilityFile = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'example_damage_est', 'my_fragility.csv')
+
+
+# Functions -------------------------------------------------------------------
+
+
+def one_at_a_time(frag, medians, stds, nReal, seed):
+    """Simulate each realisation in turn and each damage state in turn"""
+    rng = np.random.default_rng(seed)
+    counts = []
+    for _ in range(nReal):
+        x = medians + stds * rng.standard_normal(len(medians))
+        u = rng.random(len(medians))
+        counts.append([np.count_nonzero(u < frag.interp_damagestate(x, c))
+                       for c in frag.damagestates()])
+    counts = np.array(counts)
+    return counts.mean(axis=0), np.percentile(counts, 99, axis=0)
+
+
+# Script ----------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    frag = FragilityCurve(fragilityFile)
+    rng = np.random.default_rng(3)
+    medians = rng.uniform(5, 10, nPts)
+    stds = rng.uniform(0.3, 0.8, nPts)
+    nCPU = os.cpu_count()
+
+    print('%i realisations of %i locations, %i CPUs' % (nReal, nPts, nCPU))
+
+    t0 = time.perf_counter()
+    mean, p99 = one_at_a_time(frag, medians, stds, nReal, 1)
+    dt = time.perf_counter() - t0
+    print('\tOne at a time:   %6.2f s, %5.1f M samples/s' %
+          (dt, nPts * nReal / dt / 1e6))
+
+    t0 = time.perf_counter()
+    counts = simulate_damage(frag, medians, stds, nReal, seed=1)
+    dt = time.perf_counter() - t0
+    print('\tBatches:         %6.2f s, %5.1f M samples/s' %
+          (dt, nPts * nReal / dt / 1e6))
+    print('\t  mean %s, p99 %s' % (np.round(counts.mean(), 1),
+                                   counts.percentile(99)))
+    print('\t  one at a time mean %s, p99 %s' % (np.round(mean, 1), p99))
+
+    frag.tabulate(0.01)
+    t0 = time.perf_counter()
+    simulate_damage(frag, medians, stds, nReal, seed=1)
+    dt = time.perf_counter() - t0
+    print('\tBatches, table:  %6.2f s, %5.1f M samples/s' %
+          (dt, nPts * nReal / dt / 1e6))
+
+    nWorkers = max(2, nCPU)
+    t0 = time.perf_counter()
+    simulate_damage(frag, medians, stds, nReal, seed=1, nWorkers=nWorkers)
+    dt = time.perf_counter() - t0
+    print('\t%i processes:     %6.2f s, %5.1f M samples/s' %
+          (nWorkers, dt, nPts * nReal / dt / 1e6))
@@ -0,0 +1,79 @@
+"""Benchmark looking up one portfolio against a set of ShakeMaps.
+
+Compares looking up every location in each ShakeMap in turn with
+lookup_events, which sorts the locations into blocks once and only looks up
+the blocks overlapping each ShakeMap. The locations cover a large area and
+each synthetic ShakeMap a small part of it, as for a national portfolio.
+
+Usage: python benchmark_event_set.py [nPoints] [nEvents] [nWorkers]
+"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+from shakemap_utils import USGSshakemapGrid
+from shakemap_utils.event_set import LocationBlocks, lookup_events
+from synthetic_shakemap import write_grid
+
+
+# Parameters ------------------------------------------------------------------
+nPts = int(float(sys.argv[1])) if len(sys.argv) > 1 else 2000000
+nEvents = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+nWorkers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+
+# Each event is a 3 x 2 degree grid within a 20 x 10 degree portfolio
+nx, ny, dx = 180, 120, 0.0166667
+
+
+# Script ----------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(2)
+    with tempfile.TemporaryDirectory() as tmpDir:
+        ifile = write_grid(os.path.join(tmpDir, 'grid.xml'), nx, ny, dx=dx)
+        sm0 = USGSshakemapGrid(ifile, 'MMI', isQuiet=True)
+
+    # Copies of the grid moved around the portfolio
+    shakemaps = []
+    for j in range(nEvents):
+        sm = USGSshakemapGrid.__new__(USGSshakemapGrid)
+        sm.__dict__.update(sm0.__dict__)
+        sm.x0 = rng.uniform(-125, -108)
+        sm.x1 = sm.x0 + dx*(nx - 1)
+        sm.y0 = rng.uniform(32, 40)
+        sm.y1 = sm.y0 + dx*(ny - 1)
+        shakemaps.append(sm)
+
+    xpts = rng.uniform(-125, -105, nPts)
+    ypts = rng.uniform(32, 42, nPts)
+    print('%i locations, %i events of %i x %i cells' %
+          (nPts, nEvents, nx, ny))
+
+    # Each event in turn
+    t0 = time.perf_counter()
+    ref = np.empty((nPts, nEvents))
+    for j, sm in enumerate(shakemaps):
+        ref[:, j] = sm.lookup(xpts, ypts)[0]
+    dt0 = time.perf_counter() - t0
+
+    # Sort once then look up the blocks overlapping each event
+    t0 = time.perf_counter()
+    locns = LocationBlocks(xpts, ypts)
+    dtSort = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    median, std = lookup_events(locns, shakemaps, nWorkers=nWorkers)
+    dt1 = time.perf_counter() - t0
+
+    if not np.array_equal(ref, median, equal_nan=True):
+        print('ERROR: results differ')
+
+    print('\n%28s %10s' % ('method', 'time (s)'))
+    print('%28s %10.2f' % ('lookup each event', dt0))
+    print('%28s %10.2f' % ('sort into blocks (once)', dtSort))
+    print('%28s %10.2f' % ('lookup_events, %i workers' % nWorkers, dt1))
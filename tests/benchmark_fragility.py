@@ -0,0 +1,86 @@
+"""Benchmark interpolating a fragility curve at many intensities.
+
+Compares building a PchipInterpolator for each damage state on every call,
+as interp_damagestate used to, against evaluating all the damage states at
+once with the interpolator built when the curve is read, and against tables
+of the curve at different steps, with and without linear blending.
+
+Usage: python benchmark_fragility.py [nPoints]
+"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import sys
+import time
+import numpy as np
+from scipy import interpolate
+
+from shakemap_utils import FragilityCurve
+
+
+# Parameters ------------------------------------------------------------------
+nPts = int(float(sys.argv[1])) if len(sys.argv) > 1 else 5000000
+fragilityFile = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'example_damage_est', 'my_fragility.csv')
+
+
+# Functions -------------------------------------------------------------------
+
+
+def timed(func, nRepeat=3):
+    """Return the result and best time of a function"""
+    dt = np.inf
+    for _ in range(nRepeat):
+        t0 = time.perf_counter()
+        out = func()
+        dt = min(dt, time.perf_counter() - t0)
+    return out, dt
+
+
+def per_state(frag, x):
+    """Interpolate each damage state with a new interpolator"""
+    out = {}
+    for c in frag.damagestates():
+        Pchip = interpolate.PchipInterpolator(frag.intensities,
+                                              frag.exceedprob[c].values,
+                                              extrapolate=False)
+        p = Pchip(np.fmin(x, frag.maxintensity()))
+        p[x < frag.minintensity()] = 0.0
+        out[c] = p
+    return out
+
+
+# Script ----------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    frag = FragilityCurve(fragilityFile)
+    x = np.random.default_rng(5).uniform(4, 12, nPts)
+
+    old, dtOld = timed(lambda: per_state(frag, x))
+    new, dtNew = timed(lambda: frag.interp_all(x))
+    for i, c in enumerate(frag.damagestates()):
+        assert np.allclose(old[c], new[:, i])
+
+    print('%i intensities, %i damage states' %
+          (nPts, len(frag.damagestates())))
+    print('\tInterpolator per state: %.3f s' % dtOld)
+    print('\tAll states at once:     %.3f s' % dtNew)
+
+    for step in (0.1, 0.01, 0.001):
+        for isLinear in (True, False):
+            err = frag.tabulate(step, isLinear)
+            tab, dtTab = timed(lambda: frag.interp_all(x))
+            assert np.nanmax(np.abs(tab - new)) <= err + 1e-12
+            print('\tTable, step %-5g %-7s: %.3f s, error %.1e' %
+                  (step, 'linear' if isLinear else 'nearest', dtTab, err))
+    frag.table = None
+
+    # Small batches, as sent to the lookup server
+    x = x[:1000]
+    _, dtOld = timed(lambda: per_state(frag, x), 200)
+    _, dtNew = timed(lambda: frag.interp_all(x), 200)
+    print('1000 intensities')
+    print('\tInterpolator per state: %.3f ms' % (dtOld*1e3))
+    print('\tAll states at once:     %.3f ms' % (dtNew*1e3))
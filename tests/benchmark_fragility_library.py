@@ -0,0 +1,93 @@
+"""Benchmark damage probabilities of a portfolio of mixed vulnerability
+classes.
+
+Compares a single curve for all the locations against a FragilityLibrary of
+three classes, with the locations in random order or sorted by class, and
+against splitting the portfolio with a pandas groupby and running each
+class separately. Times are also given with the grouping done once by
+for_locations, as when the same locations are evaluated again.
+
+Usage: python benchmark_fragility_library.py [nPoints]
+"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from shakemap_utils import FragilityCurve, FragilityLibrary
+
+
+# Parameters ------------------------------------------------------------------
+nPts = int(float(sys.argv[1])) if len(sys.argv) > 1 else 5000000
+exampleDir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'example_damage_est')
+
+
+# Functions -------------------------------------------------------------------
+
+
+def timed(func, nRepeat=3):
+    """Return the result and best time of a function"""
+    dt = np.inf
+    for _ in range(nRepeat):
+        t0 = time.perf_counter()
+        out = func()
+        dt = min(dt, time.perf_counter() - t0)
+    return out, dt
+
+
+def split_classes(library, locns):
+    """Run each class separately, as for separate portfolios"""
+    out = np.empty((len(locns), len(library.damagestates())))
+    for c, rows in locns.groupby('class', sort=False):
+        out[rows.index] = library.curves[c].interp_all(rows['mmi'].values)
+    return out
+
+
+# Script ----------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    frag = FragilityCurve(os.path.join(exampleDir, 'my_fragility.csv'))
+    library = FragilityLibrary(os.path.join(exampleDir,
+                                            'my_fragility_library.csv'))
+    rng = np.random.default_rng(5)
+    x = rng.uniform(4, 12, nPts)
+    classes = np.array(library.classes, dtype=object)[
+        rng.integers(0, 3, nPts)]
+    order = np.argsort(classes, kind='stable')
+    xSorted, classesSorted = x[order], classes[order]
+    categorical = pd.Categorical(classes)
+    locns = pd.DataFrame({'mmi': x, 'class': classes})
+
+    print('%i locations, %i classes' % (nPts, len(library.classes)))
+    for step in (None, 0.01):
+        if step is not None:
+            frag.tabulate(step)
+            library.tabulate(step)
+        print('Fragility %s' % ('exact' if step is None else
+                                'table, step %g' % step))
+
+        _, dtSingle = timed(lambda: frag.interp_all(x))
+        probs, dtLibrary = timed(lambda: library.interp_all(x, classes))
+        _, dtSorted = timed(lambda: library.interp_all(xSorted,
+                                                       classesSorted))
+        curves = library.for_locations(classes)
+        _, dtGrouped = timed(lambda: curves.interp_all(x))
+        curves = library.for_locations(classesSorted)
+        _, dtGroupedSorted = timed(lambda: curves.interp_all(xSorted))
+        _, dtCategorical = timed(lambda: library.interp_all(x, categorical))
+        split, dtSplit = timed(lambda: split_classes(library, locns))
+        assert np.allclose(split, probs)
+
+        print('\tSingle curve:                %.3f s' % dtSingle)
+        print('\tLibrary, random order:       %.3f s (%.3f s grouped once)' %
+              (dtLibrary, dtGrouped))
+        print('\tLibrary, sorted by class:    %.3f s (%.3f s grouped once)' %
+              (dtSorted, dtGroupedSorted))
+        print('\tLibrary, categorical:        %.3f s' % dtCategorical)
+        print('\tpandas groupby of classes:   %.3f s' % dtSplit)
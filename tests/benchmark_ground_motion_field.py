@@ -0,0 +1,77 @@
+"""Benchmark generating spatially correlated fields on a ShakeMap grid.
+
+Compares a Cholesky factor of the dense covariance of all the cells, on small
+grids, with the circulant embedding of CorrelatedField on grids up to the
+size of a typical ShakeMap.
+
+Usage: python benchmark_ground_motion_field.py [nFields]
+"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+from scipy import linalg
+
+from shakemap_utils import USGSshakemapGrid
+from shakemap_utils.ground_motion_field import CorrelatedField
+from synthetic_shakemap import write_grid, write_uncertainty
+
+
+# Parameters ------------------------------------------------------------------
+nFields = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+corrRange = 20.0
+gridSizes = ((40, 30), (80, 60), (120, 90), (600, 450))
+maxCholesky = 12000
+
+
+# Functions -------------------------------------------------------------------
+
+
+def cholesky_fields(field, nFields, rng):
+    """Return fields from the Cholesky factor of the dense covariance"""
+    ny, nx = field.shakemap.ny(), field.shakemap.nx()
+    yy, xx = np.meshgrid(np.arange(ny) * field.dyKm,
+                         np.arange(nx) * field.dxKm, indexing='ij')
+    h = np.hypot(yy.ravel()[:, None] - yy.ravel()[None, :],
+                 xx.ravel()[:, None] - xx.ravel()[None, :])
+    L = linalg.cholesky(np.exp(-3 * h / field.corrRange), lower=True)
+    return (L @ rng.standard_normal((nx * ny, nFields))).T.reshape(
+        nFields, ny, nx)
+
+
+# Script ----------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    print('%i fields, correlation range %g km' % (nFields, corrRange))
+    with tempfile.TemporaryDirectory() as tmpDir:
+        for nx, ny in gridSizes:
+            ifile = write_grid(os.path.join(tmpDir, 'grid.xml'), nx, ny)
+            ifile_unc = write_uncertainty(os.path.join(tmpDir, 'unc.xml'),
+                                          nx, ny)
+            sm = USGSshakemapGrid(ifile, 'MMI', ifile_unc, isQuiet=True)
+            rng = np.random.default_rng(1)
+
+            t0 = time.perf_counter()
+            field = CorrelatedField(sm, corrRange)
+            dtSetup = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            field.sample(nFields, rng)
+            dtFFT = time.perf_counter() - t0
+
+            print('%i x %i grid, %i cells' % (nx, ny, nx * ny))
+            print('\tFFT:      setup %7.3f s, %8.2f ms per field' %
+                  (dtSetup, dtFFT / nFields * 1e3))
+            if nx * ny <= maxCholesky:
+                t0 = time.perf_counter()
+                cholesky_fields(field, nFields, rng)
+                dt = time.perf_counter() - t0
+                print('\tCholesky: total %7.3f s, %8.2f ms per field' %
+                      (dt, dt / nFields * 1e3))
+            else:
+                print('\tCholesky: covariance would need %.0f GB' %
+                      ((nx * ny)**2 * 8 / 1e9))
@@ -0,0 +1,78 @@
+"""Benchmark reading and writing locations as csv, parquet and feather.
+
+The example Hawaii_Mile_Markers_v2.csv locations are repeated, with jittered
+coordinates, up to the number of rows asked for. Each format is timed for
+reading all columns, reading only lon, lat and tiv, and writing the
+locations with one probability column per damage state.
+
+Usage: python benchmark_location_formats.py [nRows]
+"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+
+from shakemap_utils.location_lookup import read_locations, LocationWriter
+
+
+# Parameters ------------------------------------------------------------------
+nRows = int(float(sys.argv[1])) if len(sys.argv) > 1 else 2000000
+ifile = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                     'example_lookup', 'Hawaii_Mile_Markers_v2.csv')
+damageStates = ('negligible', 'moderate', 'substantial', 'very_heavy',
+                'destruction')
+
+
+# Functions -------------------------------------------------------------------
+
+
+def timed(func):
+    """Return the result and time of a function"""
+    t0 = time.perf_counter()
+    out = func()
+    return out, time.perf_counter() - t0
+
+
+def write(locns, ofile):
+    with LocationWriter(ofile) as writer:
+        writer.write(locns)
+
+
+# Script ----------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(8)
+    example = pd.read_csv(ifile)
+    locns = example.iloc[np.arange(nRows) % len(example)].reset_index(
+        drop=True)
+    locns['id'] = np.arange(nRows)
+    locns['lon'] += rng.normal(0, 0.01, nRows)
+    locns['lat'] += rng.normal(0, 0.01, nRows)
+    results = locns.copy()
+    for c in damageStates:
+        results['prob_' + c] = rng.uniform(0, 1, nRows)
+    print('%i locations, %i columns in, %i out' %
+          (nRows, locns.shape[1], results.shape[1]))
+
+    print('\n%8s %10s %12s %12s %12s %12s' %
+          ('format', 'size (MB)', 'read all', 'read 3 cols', 'write out',
+           'total (s)'))
+    with tempfile.TemporaryDirectory() as tmpDir:
+        for ext in ('csv', 'parquet', 'feather'):
+            fnm = os.path.join(tmpDir, 'locns.' + ext)
+            write(locns, fnm)
+            size = os.path.getsize(fnm)/1e6
+
+            _, dtAll = timed(lambda: read_locations(fnm))
+            _, dtCols = timed(lambda: read_locations(fnm, ['tiv']))
+            _, dtWrite = timed(lambda: write(results,
+                                             os.path.join(tmpDir, 'out.' +
+                                                          ext)))
+            print('%8s %10.1f %12.2f %12.2f %12.2f %12.2f' %
+                  (ext, size, dtAll, dtCols, dtWrite, dtCols + dtWrite))
@@ -0,0 +1,89 @@
+"""Benchmark looking up grid values at many points.
+
+Compares the previous lookup, which built numpy masked arrays of the cell
+indices and new output arrays on every call, with the lookup engine in
+grid_lookup for nearest cell and bilinear lookups, with and without reusing
+the output arrays.
+
+Usage: python benchmark_lookup.py [nPoints]
+"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+import numpy as np
+import numpy.ma as ma
+
+from shakemap_utils import USGSshakemapGrid
+from shakemap_utils.usgs_shakemap_grid import decode
+from synthetic_shakemap import write_grid, write_uncertainty
+
+
+# Parameters ------------------------------------------------------------------
+nPts = int(float(sys.argv[1])) if len(sys.argv) > 1 else 10000000
+nx, ny = 600, 450
+
+
+# Functions -------------------------------------------------------------------
+
+
+def masked_lookup(sm, xpts, ypts):
+    """The lookup from before grid_lookup, kept for comparison"""
+    iLon = np.floor(sm.nx()*(xpts - sm.x0)/(sm.x1 - sm.x0)).astype(int)
+    iLat = np.floor(sm.ny()*(ypts - sm.y0)/(sm.y1 - sm.y0)).astype(int)
+    iLat = ma.masked_outside(iLat, 0, sm.ny()-1)
+    iLon = ma.masked_outside(iLon, 0, sm.nx()-1)
+
+    mean = np.empty(xpts.shape, dtype=sm.out_dtype())
+    std = np.empty(ypts.shape, dtype=sm.out_dtype())
+    isIn = ~iLon.mask & ~iLat.mask
+    mean[isIn] = decode(sm.grid[iLat[isIn], iLon[isIn]], sm.scale)
+    std[isIn] = decode(sm.grid_std[iLat[isIn], iLon[isIn]], sm.stdScale)
+    mean[~isIn] = np.nan
+    std[~isIn] = np.nan
+
+    return mean, std
+
+
+def measure(func):
+    """Return the time and peak traced memory of one call"""
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    func()
+    dt = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return dt, peak
+
+
+# Script ----------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmpDir:
+        ifile = write_grid(os.path.join(tmpDir, 'grid.xml'), nx, ny)
+        ifile_unc = write_uncertainty(os.path.join(tmpDir, 'unc.xml'), nx, ny)
+        sm = USGSshakemapGrid(ifile, 'MMI', ifile_unc, isQuiet=True)
+
+    # Random points over the grid and a margin around it
+    rng = np.random.default_rng(1)
+    xylims = sm.xylims()
+    xpts = rng.uniform(xylims[0] - 0.5, xylims[1] + 0.5, nPts)
+    ypts = rng.uniform(xylims[2] - 0.5, xylims[3] + 0.5, nPts)
+    out = (np.empty(nPts), np.empty(nPts))
+    print('%i points on a %i x %i grid' % (nPts, nx, ny))
+    print('\tOutputs: %.0f MB' % (2*nPts*8/1e6))
+
+    print('\n%22s %10s %22s' % ('method', 'time (s)', 'peak allocated (MB)'))
+    for name, func in (
+            ('masked (previous)', lambda: masked_lookup(sm, xpts, ypts)),
+            ('nearest', lambda: sm.lookup(xpts, ypts)),
+            ('nearest, out=', lambda: sm.lookup(xpts, ypts, out=out)),
+            ('bilinear, out=', lambda: sm.lookup(xpts, ypts, 'bilinear',
+                                                 out))):
+        dt, peak = measure(func)
+        print('%22s %10.2f %22.1f' % (name, dt, peak/1e6))
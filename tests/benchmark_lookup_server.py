@@ -0,0 +1,86 @@
+"""Benchmark the latency of the local lookup server.
+
+Starts a LookupServer in a separate process and sends batches of points,
+with a fragility curve, once the grid is loaded. Reports the first (cold)
+request, then the client and server latencies of the following requests.
+
+Usage: python benchmark_lookup_server.py [nPoints] [nRequests]
+"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import multiprocessing
+import numpy as np
+from urllib.request import urlopen
+
+from shakemap_utils.lookup_server import LookupServer, request_lookup
+from synthetic_shakemap import write_grid, write_uncertainty
+
+
+# Parameters ------------------------------------------------------------------
+nPts = int(float(sys.argv[1])) if len(sys.argv) > 1 else 1000
+nRequests = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+port = 8799
+fragilityFile = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'example_damage_est', 'my_fragility.csv')
+
+
+# Functions -------------------------------------------------------------------
+
+
+def serve(dataDir):
+    LookupServer(('127.0.0.1', port), dataDir=dataDir,
+                 isQuiet=True).serve_forever()
+
+
+# Script ----------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmpDir:
+        write_grid(os.path.join(tmpDir, 'grid.xml'), 600, 450)
+        write_uncertainty(os.path.join(tmpDir, 'unc.xml'), 600, 450)
+        shutil.copy(fragilityFile, tmpDir)
+
+        proc = multiprocessing.Process(target=serve, args=(tmpDir,),
+                                       daemon=True)
+        proc.start()
+        url = 'http://127.0.0.1:%i' % port
+        for _ in range(100):
+            try:
+                urlopen(url + '/health').read()
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        rng = np.random.default_rng(9)
+        x = rng.uniform(-158.9, -149, nPts)
+        y = rng.uniform(15, 22.5, nPts)
+        params = {'uncertainty': 'unc.xml', 'fragility': 'my_fragility.csv'}
+
+        t0 = time.perf_counter()
+        request_lookup(url, x, y, 'grid.xml', **params)
+        dtCold = time.perf_counter() - t0
+
+        lat = []
+        for _ in range(nRequests):
+            t0 = time.perf_counter()
+            request_lookup(url, x, y, 'grid.xml', **params)
+            lat.append(time.perf_counter() - t0)
+        lat = np.array(lat)*1e3
+
+        metrics = json.loads(urlopen(url + '/metrics').read())
+        proc.terminate()
+
+    print('%i requests of %i points on a 600 x 450 grid' % (nRequests, nPts))
+    print('\tFirst request, loading the grid: %.0f ms' % (dtCold*1e3))
+    print('\tClient latency: p50 %.2f ms, p95 %.2f ms' %
+          (np.percentile(lat, 50), np.percentile(lat, 95)))
+    print('\tServer time:    p50 %.2f ms, p95 %.2f ms' %
+          (metrics['latency_ms_p50'], metrics['latency_ms_p95']))
@@ -0,0 +1,57 @@
+"""Benchmark totalling expected losses by group.
+
+Compares a pandas groupby of all the locations on their object columns with
+LossAggregator, which adds up chunks of locations with np.bincount.
+
+Usage: python benchmark_loss_aggregation.py [nPoints] [chunkSize]
+"""
+
+
+# Libraries ------------------------------------------------------------------
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from shakemap_utils.loss_aggregation import LossAggregator
+
+
+# Parameters ------------------------------------------------------------------
+nPts = int(float(sys.argv[1])) if len(sys.argv) > 1 else 5000000
+chunkSize = int(float(sys.argv[2])) if len(sys.argv) > 2 else 500000
+
+
+# Script ----------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(8)
+    islands = np.array(['Hawaii', 'Maui', 'Oahu', 'Kauai', 'Molokai',
+                        'Lanai'], dtype=object)
+    routes = np.array(['H-%i' % i for i in range(400)], dtype=object)
+    locns = pd.DataFrame({'island': islands[rng.integers(0, 6, nPts)],
+                          'route': routes[rng.integers(0, 400, nPts)]})
+    tiv = rng.uniform(50, 150, nPts)
+    loss = tiv * rng.uniform(0, 0.1, nPts)
+
+    t0 = time.perf_counter()
+    df = locns.assign(tiv=tiv, expected_loss=loss)
+    byGroup = {c: df.groupby(c)[['tiv', 'expected_loss']].sum()
+               for c in ('island', 'route')}
+    dtPandas = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    agg = LossAggregator(['island', 'route'])
+    for i0 in range(0, nPts, chunkSize):
+        agg.add(locns.iloc[i0:i0+chunkSize], tiv[i0:i0+chunkSize],
+                loss[i0:i0+chunkSize])
+    dtChunks = time.perf_counter() - t0
+
+    for c in ('island', 'route'):
+        table = agg.table(c).loc[byGroup[c].index]
+        assert np.allclose(table['expected_loss'],
+                           byGroup[c]['expected_loss'])
+
+    print('%i locations, 6 islands and 400 routes' % nPts)
+    print('\tpandas groupby of all:      %.3f s' % dtPandas)
+    print('\tbincount in chunks of %i: %.3f s' % (chunkSize, dtChunks))
@@ -0,0 +1,51 @@
+"""Benchmark reading all fields of a grid with different numbers of workers.
+
+The grid data text is converted by a pool of worker processes writing into
+shared memory. The speed up depends on the number of cores available.
+
+Usage: python benchmark_parallel_convert.py [nx] [ny] [nWorkers,...]
+"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+from shakemap_utils.usgs_shakemap_grid import read_fields
+from synthetic_shakemap import write_grid
+
+
+# Parameters ------------------------------------------------------------------
+nx = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+ny = int(sys.argv[2]) if len(sys.argv) > 2 else 750
+if len(sys.argv) > 3:
+    workerCounts = [int(n) for n in sys.argv[3].split(',')]
+else:
+    workerCounts = sorted({1, 2, 4, os.cpu_count()})
+
+
+# Script ----------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmpDir:
+        print('Writing synthetic grid with %i x %i = %i cells...' %
+              (nx, ny, nx*ny))
+        ifile = write_grid(os.path.join(tmpDir, 'grid.xml'), nx, ny)
+        print('\t...%.1f MB, %i cores' % (os.path.getsize(ifile)/1e6,
+                                          os.cpu_count()))
+
+        print('\n%10s %10s %10s' % ('nWorkers', 'time (s)', 'speed up'))
+        ref, t1 = None, None
+        for nWorkers in workerCounts:
+            t0 = time.perf_counter()
+            meta, data = read_fields(ifile, nWorkers=nWorkers)
+            dt = time.perf_counter() - t0
+            if ref is None:
+                ref, t1 = data, dt
+            elif not np.array_equal(ref, data, equal_nan=True):
+                print('ERROR: values differ with %i workers' % nWorkers)
+            print('%10i %10.2f %10.2f' % (nWorkers, dt, t1/dt))
@@ -0,0 +1,83 @@
+"""Benchmark finding the locations of a large portfolio within a ShakeMap.
+
+Compares comparing every location with the ShakeMap extent, and looking up
+every location, against the PortfolioIndex query and lookup for a small
+ShakeMap within a national portfolio.
+
+Usage: python benchmark_portfolio_index.py [nPoints]
+"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+from shakemap_utils import USGSshakemapGrid, PortfolioIndex
+from synthetic_shakemap import write_grid
+
+
+# Parameters ------------------------------------------------------------------
+nPts = int(float(sys.argv[1])) if len(sys.argv) > 1 else 10000000
+
+
+# Functions -------------------------------------------------------------------
+
+
+def timed(func, nRepeat=5):
+    """Return the result and best time of a function"""
+    dt = np.inf
+    for _ in range(nRepeat):
+        t0 = time.perf_counter()
+        out = func()
+        dt = min(dt, time.perf_counter() - t0)
+    return out, dt
+
+
+# Script ----------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(7)
+    xpts = rng.uniform(-125, -67, nPts)
+    ypts = rng.uniform(25, 49, nPts)
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        # A 2 x 1.5 degree ShakeMap
+        ifile = write_grid(os.path.join(tmpDir, 'grid.xml'), 120, 90,
+                           x0=-118.5, y1=35.0)
+        sm = USGSshakemapGrid(ifile, 'MMI', isQuiet=True)
+
+        t0 = time.perf_counter()
+        index = PortfolioIndex((xpts, ypts))
+        dtBuild = time.perf_counter() - t0
+
+        ofile = os.path.join(tmpDir, 'index.npz')
+        index.save(ofile)
+        _, dtLoad = timed(lambda: PortfolioIndex(ofile), 1)
+
+    xylims = sm.xylims()
+    print('%i locations, %i in the ShakeMap extent' %
+          (nPts, len(index.query(xylims))))
+
+    def scan():
+        return np.flatnonzero((xpts >= xylims[0]) & (xpts < xylims[1]) &
+                              (ypts >= xylims[2]) & (ypts < xylims[3]))
+
+    rows0, dtScan = timed(scan)
+    rows1, dtQuery = timed(lambda: index.query(xylims))
+    if not np.array_equal(rows0, rows1):
+        print('ERROR: query differs from scan')
+
+    _, dtLookup = timed(lambda: sm.lookup(xpts, ypts), 1)
+    _, dtIndexLookup = timed(lambda: index.lookup(sm))
+
+    print('\n%28s %10s' % ('method', 'time (ms)'))
+    print('%28s %10.1f' % ('build index (once)', dtBuild*1e3))
+    print('%28s %10.1f' % ('load index from npz', dtLoad*1e3))
+    print('%28s %10.1f' % ('scan all locations', dtScan*1e3))
+    print('%28s %10.1f' % ('index query', dtQuery*1e3))
+    print('%28s %10.1f' % ('lookup all locations', dtLookup*1e3))
+    print('%28s %10.1f' % ('index lookup', dtIndexLookup*1e3))
@@ -0,0 +1,80 @@
+"""Benchmark reading the intensity from a large synthetic ShakeMap grid.
+
+Compares the time and peak memory of the string split conversion previously
+used in read_gridvals with the chunked grid_data parser.
+
+Usage: python benchmark_read_gridvals.py [nx] [ny]
+"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+import numpy as np
+
+from shakemap_utils.usgs_shakemap_grid import read_root, read_griddims
+from shakemap_utils.usgs_shakemap_grid import read_gridvals
+from synthetic_shakemap import write_grid
+
+
+# Parameters ------------------------------------------------------------------
+nx = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+ny = int(sys.argv[2]) if len(sys.argv) > 2 else 750
+namespace = {'shakemap': 'http://earthquake.usgs.gov/eqcenter/shakemap'}
+
+
+# Functions -------------------------------------------------------------------
+
+
+def read_gridvals_split(root, ns, intensMeasure, ny, nx):
+    """The previous conversion via a list of strings"""
+    nF = len(root.findall('shakemap:grid_field', ns))
+    t = root.find('shakemap:grid_data', ns).text
+    t = t.replace('\n', ' ').strip()
+    t = t.split(sep=' ')
+    a = np.array(t, dtype=float)
+
+    fnms = [None]*nF
+    for f in root.findall('shakemap:grid_field', ns):
+        fnms[int(f.get('index')) - 1] = f.get('name')
+    iCol = fnms.index(intensMeasure)
+
+    return np.flipud(a[iCol::nF].reshape([ny, nx]))
+
+
+def run(func, root):
+    """Return the time, peak memory and result of one conversion"""
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    grid = func(root, namespace, 'MMI', ny, nx)
+    dt = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return dt, peak, grid
+
+
+# Script ----------------------------------------------------------------------
+
+
+with tempfile.TemporaryDirectory() as tmpDir:
+    print('Writing synthetic grid with %i x %i = %i cells...' %
+          (nx, ny, nx*ny))
+    ifile = write_grid(os.path.join(tmpDir, 'grid.xml'), nx, ny)
+    print('\t...%.1f MB' % (os.path.getsize(ifile)/1e6))
+
+    root = read_root(ifile)
+    assert read_griddims(root, namespace) == (nx, ny)
+
+    print('\n%16s %10s %14s' % ('method', 'time (s)', 'peak mem (MB)'))
+    results = []
+    for name, func in (('split', read_gridvals_split),
+                       ('chunked parser', read_gridvals)):
+        dt, peak, grid = run(func, root)
+        results.append(grid)
+        print('%16s %10.2f %14.1f' % (name, dt, peak/1e6))
+
+    assert np.array_equal(results[0], results[1])
+    print('\nSize of output grid: %.1f MB' % (results[0].nbytes/1e6))
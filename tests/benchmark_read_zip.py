@@ -0,0 +1,83 @@
+"""Benchmark the peak memory of reading the intensity from a zipped grid.
+
+Compares parsing the whole xml document with ElementTree and then converting
+the grid_data text, against streaming the decompressed text straight into the
+grid parser. Each method runs in a fresh process so the peak resident memory
+of the process can be compared.
+
+Usage: python benchmark_read_zip.py [nx] [ny]
+"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import sys
+import time
+import resource
+import tempfile
+import multiprocessing
+import numpy as np
+
+from shakemap_utils.usgs_shakemap_grid import NAMESPACE, read_root
+from shakemap_utils.usgs_shakemap_grid import read_griddims, read_gridvals
+from shakemap_utils.usgs_shakemap_grid import read_fields
+from synthetic_shakemap import write_grid
+
+
+# Parameters ------------------------------------------------------------------
+nx = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+ny = int(sys.argv[2]) if len(sys.argv) > 2 else 750
+
+
+# Functions -------------------------------------------------------------------
+
+
+def read_dom(ifile):
+    """Parse the whole document then convert the text"""
+    root = read_root(ifile)
+    nx, ny = read_griddims(root, NAMESPACE)
+    return read_gridvals(root, NAMESPACE, 'MMI', ny, nx)
+
+
+def read_stream(ifile):
+    """Stream the decompressed text into the parser"""
+    return read_fields(ifile, ['MMI'])[1][0]
+
+
+def run(func, ifile, queue):
+    """Time one method and report the peak memory of this process"""
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    grid = func(ifile)
+    dt = time.perf_counter() - t0
+    rss1 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((dt, (rss1 - rss0)*1024, float(np.nansum(grid))))
+
+
+# Script ----------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmpDir:
+        print('Writing synthetic zipped grid with %i x %i = %i cells...' %
+              (nx, ny, nx*ny))
+        # Write in another process, as the peak memory of this process is
+        # passed on to the processes it starts
+        ctx = multiprocessing.get_context('spawn')
+        ifile = os.path.join(tmpDir, 'grid.xml.zip')
+        proc = ctx.Process(target=write_grid, args=(ifile, nx, ny),
+                           kwargs={'isZip': True})
+        proc.start()
+        proc.join()
+        print('\t...%.1f MB zipped' % (os.path.getsize(ifile)/1e6))
+        print('\tOutput grid: %.1f MB' % (nx*ny*8/1e6))
+
+        print('\n%16s %10s %18s' % ('method', 'time (s)', 'peak RSS added (MB)'))
+        for name, func in (('xml document', read_dom),
+                           ('streamed', read_stream)):
+            queue = ctx.Queue()
+            proc = ctx.Process(target=run, args=(func, ifile, queue))
+            proc.start()
+            dt, rss, total = queue.get()
+            proc.join()
+            print('%16s %10.2f %18.1f' % (name, dt, rss/1e6))
@@ -0,0 +1,88 @@
+"""Benchmark damage probabilities averaged over the intensity uncertainty.
+
+Compares Gauss-Hermite quadrature in FragilityCurve.interp_uncertain with
+naive Monte Carlo sampling of the intensity at each location, for time and
+for the largest error against a fine integration at some of the locations.
+
+Usage: python benchmark_uncertainty.py [nPoints]
+"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import sys
+import time
+import numpy as np
+
+from shakemap_utils import FragilityCurve
+
+
+# Parameters ------------------------------------------------------------------
+nPts = int(float(sys.argv[1])) if len(sys.argv) > 1 else 100000
+nCheck = 1000
+fragilityFile = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'example_damage_est', 'my_fragility.csv')
+
+
+# Functions -------------------------------------------------------------------
+
+
+def timed(func, nRepeat=3):
+    """Return the result and best time of a function"""
+    dt = np.inf
+    for _ in range(nRepeat):
+        t0 = time.perf_counter()
+        out = func()
+        dt = min(dt, time.perf_counter() - t0)
+    return out, dt
+
+
+def fine_integration(frag, medians, stds):
+    """Average the curve over a fine grid of the normal distribution"""
+    z = np.linspace(-8, 8, 20001)
+    density = np.exp(-z**2 / 2)
+    density /= density.sum()
+    return np.array([density @ frag.interp_all(m + s * z)
+                     for m, s in zip(medians, stds)])
+
+
+def monte_carlo(frag, medians, stds, nSamples, chunkSize=10000):
+    """Average the curve over random samples of the intensity"""
+    rng = np.random.default_rng(1)
+    out = np.empty((len(medians), len(frag.damagestates())))
+    for i0 in range(0, len(medians), chunkSize):
+        m, s = medians[i0:i0+chunkSize], stds[i0:i0+chunkSize]
+        x = m[:, None] + s[:, None] * rng.standard_normal((len(m), nSamples))
+        probs = frag.interp_all(x.ravel()).reshape(len(m), nSamples, -1)
+        out[i0:i0+chunkSize] = probs.mean(axis=1)
+    return out
+
+
+# Script ----------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    frag = FragilityCurve(fragilityFile)
+    rng = np.random.default_rng(7)
+    medians = rng.uniform(4, 11, nPts)
+    stds = rng.uniform(0.3, 1.0, nPts)
+    exact = fine_integration(frag, medians[:nCheck], stds[:nCheck])
+
+    print('%i locations, MMI with std 0.3-1.0, error at %i of them' %
+          (nPts, nCheck))
+    out, dt = timed(lambda: frag.interp_all(medians))
+    print('\tMedian only:           %7.3f s, error %.1e' %
+          (dt, np.abs(out[:nCheck] - exact).max()))
+    for nNodes in (5, 9, 15):
+        out, dt = timed(lambda: frag.interp_uncertain(medians, stds, nNodes))
+        print('\tQuadrature, %2i nodes:  %7.3f s, error %.1e' %
+              (nNodes, dt, np.abs(out[:nCheck] - exact).max()))
+    frag.tabulate(0.01)
+    out, dt = timed(lambda: frag.interp_uncertain(medians, stds, 9))
+    print('\t  with table, 9 nodes: %7.3f s, error %.1e' %
+          (dt, np.abs(out[:nCheck] - exact).max()))
+    frag.table = None
+    for nSamples in (100, 1000):
+        out, dt = timed(lambda: monte_carlo(frag, medians, stds, nSamples), 1)
+        print('\tMonte Carlo, %4i:     %7.3f s, error %.1e' %
+              (nSamples, dt, np.abs(out[:nCheck] - exact).max()))
@@ -0,0 +1,125 @@
+"""Write synthetic USGS ShakeMap grid files for tests and benchmarks.
+
+The files follow the layout of the grid.xml and uncertainty.xml files
+downloaded from the USGS, with a smooth intensity field decaying away from an
+epicenter in the middle of the grid.
+
+"""
+
+# Libraries ------------------------------------------------------------------
+import os
+import numpy as np
+from zipfile import ZipFile, ZIP_DEFLATED
+
+
+# Parameters ------------------------------------------------------------------
+NAMESPACE = 'http://earthquake.usgs.gov/eqcenter/shakemap'
+
+GRID_FIELDS = (('PGA', 'pctg'), ('PGV', 'cms'), ('MMI', 'intensity'),
+               ('PSA03', 'pctg'), ('PSA10', 'pctg'), ('PSA30', 'pctg'),
+               ('STDPGA', 'ln(pctg)'), ('URAT', ''), ('SVEL', 'ms'))
+
+UNC_FIELDS = (('STDPGA', 'ln(pctg)'), ('STDPGV', 'ln(cms)'),
+              ('STDMMI', 'intensity'), ('STDPSA03', 'ln(pctg)'),
+              ('STDPSA10', 'ln(pctg)'), ('STDPSA30', 'ln(pctg)'))
+
+
+# Functions -------------------------------------------------------------------
+
+
+def synthetic_values(nx, ny, x0=-158.9, y1=22.5, dx=0.0166667,
+                     fields=GRID_FIELDS, gains=None):
+    """Return the lon, lat and field values in file order, north row first.
+    gains is a dict of field name to a factor its values are multiplied by.
+
+    OUT: numpy array with shape (nx*ny, 2 + len(fields))
+    """
+    lon = x0 + dx*np.arange(nx)
+    lat = y1 - dx*np.arange(ny)
+    xx, yy = np.meshgrid(lon, lat)
+
+    # Distance in degrees from the center of the grid
+    r = np.hypot(xx - lon.mean(), yy - lat.mean())
+    mmi = np.clip(9.0 - 2.5*np.log10(1.0 + 20*r), 1.0, 10.0)
+
+    vals = [xx, yy]
+    for name, _ in fields:
+        if name == 'MMI':
+            v = mmi
+        elif name == 'SVEL':
+            # Alternate land (760) and sea (600) bands across the grid
+            v = np.where((xx - x0) % 1.0 < 0.2, 600.0, 760.0)
+        elif name == 'STDMMI':
+            v = 0.5 + 0.1*np.cos(xx)
+        elif name.startswith('STD'):
+            v = 0.6 + 0.05*np.sin(yy)
+        elif name == 'URAT':
+            v = np.ones(xx.shape)
+        else:
+            v = 10.0**(0.25*(mmi - 5.0))
+
+        if gains is not None and name in gains:
+            v = v * gains[name]
+        vals.append(v)
+
+    return np.column_stack([np.round(v, 4).ravel() for v in vals])
+
+
+def write_grid(ofile, nx, ny, fields=GRID_FIELDS, isZip=False,
+               eventId='synth01', version='1', x0=-158.9, y1=22.5,
+               dx=0.0166667, gains=None):
+    """Write a synthetic grid file and return its name.
+
+    Keyword arguments:
+    ofile : (string) output file name, the xml is put into a zip with the
+            same name if isZip is True.
+    nx, ny : (int) number of grid points in lon and lat directions
+    fields : sequence of (name, units) tuples for the grid fields after
+             LON and LAT.
+    gains : dict of field name to a factor its values are multiplied by.
+    """
+    vals = synthetic_values(nx, ny, x0, y1, dx, fields, gains)
+
+    header = [
+        '<?xml version="1.0" encoding="US-ASCII" standalone="yes"?>',
+        ('<shakemap_grid xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+         ' xmlns="%s" event_id="%s" shakemap_id="%s"'
+         ' shakemap_version="%s" code_version="4.0"'
+         ' process_timestamp="2020-01-01T00:00:00Z" shakemap_originator="us"'
+         ' map_status="RELEASED" shakemap_event_type="ACTUAL">' %
+         (NAMESPACE, eventId, eventId, version)),
+        ('<event event_id="%s" magnitude="6.9" depth="5.8" lat="19.3"'
+         ' lon="-155.0" event_timestamp="2018-05-04T22:32:54UTC"'
+         ' event_network="us" event_description="Synthetic event" />' %
+         eventId),
+        ('<grid_specification lon_min="%.6f" lat_min="%.6f" lon_max="%.6f"'
+         ' lat_max="%.6f" nominal_lon_spacing="%.6f"'
+         ' nominal_lat_spacing="%.6f" nlon="%i" nlat="%i" />' %
+         (x0, y1 - dx*(ny-1), x0 + dx*(nx-1), y1, dx, dx, nx, ny)),
+        '<grid_field index="1" name="LON" units="dd" />',
+        '<grid_field index="2" name="LAT" units="dd" />']
+    for i, (name, units) in enumerate(fields):
+        header.append('<grid_field index="%i" name="%s" units="%s" />' %
+                      (i + 3, name, units))
+    header.append('<grid_data>\n')
+
+    xmlFile = ofile
+    if isZip:
+        xmlFile = ofile + '.tmp.xml'
+
+    with open(xmlFile, 'w') as f:
+        f.write('\n'.join(header))
+        np.savetxt(f, vals, fmt='%.4f')
+        f.write('</grid_data>\n</shakemap_grid>\n')
+
+    if isZip:
+        with ZipFile(ofile, 'w', ZIP_DEFLATED) as myzip:
+            myzip.write(xmlFile, os.path.basename(ofile).replace('.zip', ''))
+        os.remove(xmlFile)
+
+    return ofile
+
+
+def write_uncertainty(ofile, nx, ny, **kwargs):
+    """Write a synthetic uncertainty grid consistent with write_grid"""
+    return write_grid(ofile, nx, ny, fields=UNC_FIELDS, **kwargs)
@@ -0,0 +1,58 @@
+"""Test the local catalog of downloaded ShakeMap files"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import pytest
+
+from shakemap_utils import ShakemapCatalog
+from synthetic_shakemap import write_grid, write_uncertainty
+
+
+# Tests -----------------------------------------------------------------------
+
+
+def test_catalog(tmp_path):
+    idir = os.path.join(tmp_path, 'usgs_shakemap')
+    os.makedirs(idir)
+    for ev, ver in (('us01', '1'), ('us01', '2'), ('us02', '1')):
+        write_grid(os.path.join(idir, 'grid_%s_v%04.1f.xml.zip' %
+                                (ev, float(ver))), 11, 9, isZip=True,
+                   eventId=ev, version=ver)
+        write_uncertainty(os.path.join(idir, 'uncertainty_%s_v%04.1f.xml.zip'
+                                       % (ev, float(ver))), 11, 9,
+                          isZip=True, eventId=ev, version=ver)
+
+    catalog = ShakemapCatalog(os.path.join(tmp_path, 'catalog.sqlite'))
+    assert catalog.scan(idir, isQuiet=True) == 6
+
+    # Nothing new to read on a second scan
+    assert catalog.scan(idir, isQuiet=True) == 0
+    assert len(catalog.events()) == 3
+
+    # Latest version by default
+    assert catalog.find('us01').endswith('grid_us01_v02.0.xml.zip')
+    assert catalog.find('us01', 1).endswith('grid_us01_v01.0.xml.zip')
+    assert catalog.find('us01', kind='uncertainty').endswith(
+        'uncertainty_us01_v02.0.xml.zip')
+    assert catalog.find('us03') is None
+
+    sm = catalog.open('us01', 'MMI', isQuiet=True)
+    assert sm.hdr['shakemap_version'] == '2'
+    assert sm.grid_std.max() > 0
+
+    with pytest.raises(ValueError):
+        catalog.open('us03', 'MMI')
+
+    # Changed and removed files are picked up
+    write_grid(os.path.join(idir, 'grid_us02_v01.0.xml.zip'), 11, 9,
+               isZip=True, eventId='us02', version='3')
+    os.remove(os.path.join(idir, 'uncertainty_us02_v01.0.xml.zip'))
+    assert catalog.scan(idir, isQuiet=True) == 1
+    assert catalog.find('us02', 3) is not None
+    assert catalog.find('us02', kind='uncertainty') is None
+    catalog.close()
+
+    # Catalog persists between sessions
+    catalog = ShakemapCatalog(os.path.join(tmp_path, 'catalog.sqlite'))
+    assert len(catalog.events()) == 3
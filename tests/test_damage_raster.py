@@ -0,0 +1,98 @@
+"""Test the damage probability rasters of a ShakeMap grid"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import numpy as np
+import pytest
+
+from shakemap_utils import USGSshakemapGrid, FragilityCurve, GridFileCache
+from shakemap_utils.damage_raster import DamageRaster
+from synthetic_shakemap import write_grid, write_uncertainty
+
+
+# Parameters ------------------------------------------------------------------
+FRAGILITY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'example_damage_est', 'my_fragility.csv')
+
+
+# Tests -----------------------------------------------------------------------
+
+
+@pytest.fixture
+def files(tmp_path):
+    return (write_grid(os.path.join(tmp_path, 'grid.xml'), 60, 40),
+            write_uncertainty(os.path.join(tmp_path, 'unc.xml'), 60, 40))
+
+
+def random_points(shakemap, n=2000):
+    """Points over the grid and a margin around it"""
+    rng = np.random.default_rng(3)
+    x0, x1, y0, y1 = shakemap.xylims()
+    x = rng.uniform(x0 - 0.1, x1 + 0.1, n)
+    y = rng.uniform(y0 - 0.1, y1 + 0.1, n)
+    return x, y
+
+
+def test_lookup(files):
+    frag = FragilityCurve(FRAGILITY_FILE)
+    shakemap = USGSshakemapGrid(files[0], 'MMI', files[1], isQuiet=True)
+    x, y = random_points(shakemap)
+    median, std = shakemap.lookup(x, y)
+
+    # Nearest cell probabilities are the curves at the nearest intensity
+    raster = DamageRaster(shakemap, frag, dtype=np.float64)
+    assert raster.raster.shape == (40, 60, 5)
+    probs = raster.lookup(x, y)
+    np.testing.assert_allclose(probs, frag.interp_all(median),
+                               equal_nan=True)
+    assert np.isnan(probs[np.isnan(median)]).all()
+
+    # Averaged over the uncertainty, and stored as float32
+    raster = DamageRaster(shakemap, frag, useUncertainty=True)
+    assert raster.raster.dtype == np.float32
+    np.testing.assert_allclose(raster.lookup(x, y),
+                               frag.interp_uncertain(median, std),
+                               atol=1e-6, equal_nan=True)
+
+    # Bilinear interpolation of the probabilities stays between the cells
+    bilinear = raster.lookup(x, y, 'bilinear')
+    assert np.nanmin(bilinear) >= 0 and np.nanmax(bilinear) <= 1
+    np.testing.assert_array_equal(np.isnan(bilinear[:, 0]),
+                                  np.isnan(median))
+
+
+def test_cache(files, tmp_path):
+    frag = FragilityCurve(FRAGILITY_FILE)
+    cache = GridFileCache(os.path.join(tmp_path, 'cache'))
+
+    first = DamageRaster(files[0], frag, cache=cache)
+    assert not first.isCached
+    second = DamageRaster(files[0], frag, cache=cache, useMemmap=True)
+    assert second.isCached
+    assert isinstance(second.raster, np.memmap)
+    np.testing.assert_array_equal(second.raster, first.raster)
+    assert second.damagestates == first.damagestates
+    assert (second.x0, second.dy()) == (first.x0, first.dy())
+
+    # Other options and curves are kept apart
+    assert not DamageRaster(files[0], frag, files[1], cache=cache,
+                            useUncertainty=True).isCached
+    assert not DamageRaster(files[0], frag, cache=cache,
+                            gridDtype='int16').isCached
+    shakemap = USGSshakemapGrid(files[0], 'MMI', isQuiet=True, dtype='int16')
+    assert DamageRaster(files[0], frag, cache=cache,
+                        shakemap=shakemap).isCached
+    frag.tabulate(0.05)
+    assert not DamageRaster(files[0], frag, cache=cache).isCached
+
+    # A new grid file replaces the raster
+    st = os.stat(files[0])
+    os.utime(files[0], ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert not DamageRaster(files[0], frag, cache=cache).isCached
+
+    # A raster too big for the cache is kept in memory
+    cache = GridFileCache(os.path.join(tmp_path, 'small'), maxBytes=1000)
+    raster = DamageRaster(files[0], frag, cache=cache, useMemmap=True)
+    assert not raster.isCached and not isinstance(raster.raster, np.memmap)
+    assert raster.raster.shape == first.raster.shape
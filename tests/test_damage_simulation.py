@@ -0,0 +1,102 @@
+"""Test the Monte Carlo simulation of damage to a portfolio"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import numpy as np
+import pytest
+
+from shakemap_utils import FragilityCurve
+from shakemap_utils.damage_simulation import DamageCounts, simulate_damage
+from shakemap_utils.loss_aggregation import expected_loss
+
+
+# Parameters ------------------------------------------------------------------
+FRAGILITY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'example_damage_est', 'my_fragility.csv')
+
+
+# Tests -----------------------------------------------------------------------
+
+
+def test_damage_counts():
+    counts = DamageCounts(['minor', 'major'], 3)
+    counts.add(np.array([[3, 1], [2, 0], [2, 0], [1, 0]]))
+    np.testing.assert_array_equal(counts.histogram,
+                                  [[0, 1, 2, 1], [3, 1, 0, 0]])
+    np.testing.assert_allclose(counts.mean(), [2.0, 0.25])
+    np.testing.assert_allclose(counts.std(), [np.sqrt(0.5), np.sqrt(3) / 4])
+    np.testing.assert_array_equal(counts.percentile(50), [2, 0])
+    np.testing.assert_array_equal(counts.percentile(100), [3, 1])
+
+    other = DamageCounts(['minor', 'major'], 3)
+    other.add(np.array([[0, 0]]))
+    counts.merge(other)
+    assert counts.nRealisations == 5 and counts.histogram[0, 0] == 1
+    assert list(counts.summary().columns) == ['mean', 'std', 'p50', 'p90',
+                                              'p99']
+    with pytest.raises(ValueError):
+        counts.merge(DamageCounts(['minor', 'major'], 4))
+
+    # Losses of each batch and merged counts are kept in order
+    assert len(counts.losses) == 0
+    counts = DamageCounts(['minor'], 2)
+    counts.add(np.array([[1], [2]]), np.array([1.0, 2.0]))
+    counts.add(np.array([[0]]), np.array([3.0]))
+    other = DamageCounts(['minor'], 2)
+    other.add(np.array([[2]]), np.array([4.0]))
+    counts.merge(other)
+    np.testing.assert_array_equal(counts.losses, [1.0, 2.0, 3.0, 4.0])
+    counts.add(np.array([[1]]), np.array([5.0]))
+    assert counts.losses[-1] == 5.0 and len(counts.losses) == 5
+
+
+def test_simulate_damage():
+    frag = FragilityCurve(FRAGILITY_FILE)
+    rng = np.random.default_rng(2)
+    medians = np.append(rng.uniform(5, 10, 200), np.nan)
+    stds = np.append(rng.uniform(0.3, 0.8, 200), 0.5)
+
+    counts = simulate_damage(frag, medians, stds, 4000, seed=11,
+                             batchSize=300)
+    assert counts.nRealisations == 4000 and counts.nLocations == 200
+
+    # The mean count is the sum of the probabilities over the uncertainty
+    expected = frag.interp_uncertain(medians[:-1], stds[:-1], 20).sum(axis=0)
+    np.testing.assert_allclose(counts.mean(), expected,
+                               atol=5 * counts.std().max() / np.sqrt(4000))
+
+    # Each location at or above a state is at or above the lower states
+    assert (np.diff(counts.mean()) <= 0).all()
+
+    # The same seed gives the same counts, with any number of workers
+    again = simulate_damage(frag, medians, stds, 4000, seed=11,
+                            batchSize=300, nWorkers=2)
+    np.testing.assert_array_equal(again.histogram, counts.histogram)
+    other = simulate_damage(frag, medians, stds, 4000, seed=12,
+                            batchSize=300)
+    assert (other.histogram != counts.histogram).any()
+
+    # Certain damage without uncertainty
+    counts = simulate_damage(frag, np.full(10, 12.0), np.zeros(10), 50)
+    np.testing.assert_array_equal(counts.percentile(1)[:1], [10])
+
+
+def test_simulate_loss():
+    frag = FragilityCurve(FRAGILITY_FILE)
+    rng = np.random.default_rng(5)
+    medians = rng.uniform(5, 10, 100)
+    stds = rng.uniform(0.3, 0.8, 100)
+    tiv = rng.uniform(50, 150, 100)
+    ratios = np.array([0.02, 0.1, 0.4, 0.8, 1.0])
+
+    # The mean loss is the total expected loss over the uncertainty
+    counts = simulate_damage(frag, medians, stds, 3000, seed=3, tiv=tiv,
+                             damageRatios=ratios, batchSize=500)
+    assert len(counts.losses) == 3000
+    expected = expected_loss(frag.interp_uncertain(medians, stds, 20), tiv,
+                             ratios).sum()
+    summary = counts.loss_summary()
+    assert summary['mean'] == pytest.approx(
+        expected, abs=5 * summary['std'] / np.sqrt(3000))
+    assert summary['p50'] <= summary['p90'] <= summary['p99']
@@ -0,0 +1,76 @@
+"""Test looking up a set of locations against many ShakeMaps"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import numpy as np
+import pytest
+
+from shakemap_utils import USGSshakemapGrid
+from shakemap_utils.event_set import LocationBlocks, lookup_events
+from synthetic_shakemap import write_grid, write_uncertainty
+
+
+# Tests -----------------------------------------------------------------------
+
+
+def test_location_blocks():
+    rng = np.random.default_rng(3)
+    x = rng.uniform(-160, -150, 1000)
+    y = rng.uniform(15, 25, 1000)
+    x[5] = np.nan
+    locns = LocationBlocks(x, y, blockSize=64)
+
+    # Every location is kept once and missing coordinates go last
+    assert np.array_equal(np.sort(locns.order), np.arange(1000))
+    assert locns.order[-1] == 5
+    assert locns.nblocks() == 16
+
+    # Blocks hold their locations
+    for b in range(locns.nblocks()):
+        i0, i1 = locns.starts[b], locns.starts[b + 1]
+        assert np.nanmin(locns.lon[i0:i1]) == locns.bounds[b, 0]
+        assert np.nanmax(locns.lat[i0:i1]) == locns.bounds[b, 3]
+
+    # Neighbouring locations are grouped, so a small extent hits few blocks
+    iBlocks = locns.blocks_in([-151, -150, 15, 16])
+    assert 0 < len(iBlocks) < 8
+
+
+def test_lookup_events(tmp_path):
+    shakemaps = []
+    for i, x0 in enumerate((-158.9, -157.0, -140.0)):
+        ifile = write_grid(os.path.join(tmp_path, 'grid%i.xml' % i), 21, 15,
+                           x0=x0)
+        ifile_unc = write_uncertainty(os.path.join(tmp_path, 'unc%i.xml' % i),
+                                      21, 15, x0=x0)
+        shakemaps.append((ifile, ifile_unc))
+
+    rng = np.random.default_rng(4)
+    x = rng.uniform(-159.2, -156.5, 5000)
+    y = rng.uniform(22.0, 22.7, 5000)
+    locns = LocationBlocks(x, y, blockSize=100)
+
+    for nWorkers in (1, 2):
+        median, std = lookup_events(locns, shakemaps, 'MMI', nWorkers=nWorkers)
+        assert median.shape == (5000, 3)
+
+        # Same as looking up each event in turn
+        for j, (ifile, ifile_unc) in enumerate(shakemaps):
+            sm = USGSshakemapGrid(ifile, 'MMI', ifile_unc, isQuiet=True)
+            m, s = sm.lookup(x, y)
+            np.testing.assert_array_equal(median[:, j], m)
+            np.testing.assert_array_equal(std[:, j], s)
+
+    # The last event is away from all locations
+    assert np.all(np.isnan(median[:, 2]))
+
+    # Loaded grids and coordinate arrays can be passed in
+    sm = USGSshakemapGrid(shakemaps[0][0], 'MMI', shakemaps[0][1],
+                          isQuiet=True)
+    median1, std1 = lookup_events((x, y), [sm], method='bilinear')
+    m, s = sm.lookup(x, y, 'bilinear')
+    np.testing.assert_array_equal(median1[:, 0], m)
+
+    with pytest.raises(ValueError):
+        lookup_events(locns, shakemaps)
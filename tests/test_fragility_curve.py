@@ -0,0 +1,125 @@
+"""Test the interpolation of fragility curves"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import interpolate
+
+from shakemap_utils import FragilityCurve
+from shakemap_utils.location_lookup import add_damageprobs
+
+
+# Parameters ------------------------------------------------------------------
+FRAGILITY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'example_damage_est', 'my_fragility.csv')
+
+
+# Tests -----------------------------------------------------------------------
+
+
+def test_interp_all():
+    frag = FragilityCurve(FRAGILITY_FILE)
+    x = np.concatenate([[4.0, 5.0, 11.0, 12.5, np.nan],
+                        np.random.default_rng(3).uniform(4, 12, 1000)])
+
+    probs = frag.interp_all(x)
+    assert probs.shape == (len(x), len(frag.damagestates()))
+
+    # Same as a separate interpolator for each damage state
+    for i, c in enumerate(frag.damagestates()):
+        Pchip = interpolate.PchipInterpolator(frag.intensities,
+                                              frag.exceedprob[c].values,
+                                              extrapolate=False)
+        expected = Pchip(np.minimum(x, frag.maxintensity()))
+        expected[x < frag.minintensity()] = 0.0
+        np.testing.assert_allclose(probs[:, i], expected, rtol=1e-12)
+        np.testing.assert_array_equal(frag.interp_damagestate(x, c),
+                                      probs[:, i])
+
+    # Zero below the curve, the last value above it, nan where missing
+    assert (probs[0] == 0.0).all()
+    np.testing.assert_allclose(probs[1], frag.exceedprob.values[0])
+    np.testing.assert_allclose(probs[3], frag.exceedprob.values[-1])
+    assert np.isnan(probs[4]).all()
+
+
+def test_tabulate():
+    frag = FragilityCurve(FRAGILITY_FILE)
+    x = np.concatenate([[4.0, 5.0, 11.0, 12.5, np.nan],
+                        np.random.default_rng(4).uniform(4, 12, 20000)])
+    exact = frag.interp_all(x)
+
+    with pytest.raises(ValueError):
+        frag.interp_table(x)
+
+    # The error bound holds, and shrinks with the step
+    errors = []
+    for step in (0.1, 0.01):
+        for isLinear in (True, False):
+            err = frag.tabulate(step, isLinear)
+            probs = frag.interp_all(x)
+            assert probs.shape == exact.shape
+            assert np.nanmax(np.abs(probs - exact)) <= err + 1e-12
+            np.testing.assert_array_equal(np.isnan(probs), np.isnan(exact))
+            assert (probs[0] == 0.0).all()
+            np.testing.assert_allclose(probs[3], exact[3])
+            errors.append(err)
+    assert errors[2] < errors[0] / 50 and errors[3] < errors[1] / 5
+    assert errors[0] < errors[1]
+
+    # Steps are shortened to fit the curve
+    frag.tabulate(0.3)
+    assert frag.tableStep == pytest.approx(6.0 / 20)
+    with pytest.raises(ValueError):
+        frag.tabulate(0)
+
+
+def expected_probs(frag, median, std, isLognormal):
+    """Average the curve over a fine grid of the intensity distribution"""
+    z = np.linspace(-8, 8, 40001)
+    density = np.exp(-z**2 / 2)
+    density /= density.sum()
+    x = median * np.exp(std * z) if isLognormal else median + std * z
+    return density @ frag.interp_all(x)
+
+
+def test_interp_uncertain():
+    frag = FragilityCurve(FRAGILITY_FILE)
+    medians = np.array([4.5, 5.8, 7.2, 9.5, 10.8, np.nan])
+    stds = np.array([0.4, 0.6, 0.5, 0.8, 0.3, 0.5])
+
+    # Close to a fine integration, for normal MMI and lognormal intensities
+    probs = frag.interp_uncertain(medians, stds, nNodes=20)
+    for i in range(5):
+        np.testing.assert_allclose(
+            probs[i], expected_probs(frag, medians[i], stds[i], False),
+            atol=1e-3)
+    assert np.isnan(probs[5]).all()
+    probs = frag.interp_uncertain(medians, stds / 10, nNodes=20,
+                                  isLognormal=True)
+    np.testing.assert_allclose(
+        probs[2], expected_probs(frag, medians[2], stds[2] / 10, True),
+        atol=1e-3)
+
+    # Chunks give the same, and no uncertainty gives the median
+    np.testing.assert_array_equal(
+        frag.interp_uncertain(medians, stds, chunkSize=4),
+        frag.interp_uncertain(medians, stds))
+    np.testing.assert_allclose(
+        frag.interp_uncertain(medians, np.zeros(6)), frag.interp_all(medians),
+        atol=1e-12)
+
+    with pytest.raises(ValueError):
+        frag.interp_uncertain(medians, stds[:3])
+
+
+def test_add_damageprobs():
+    frag = FragilityCurve(FRAGILITY_FILE)
+    locns = pd.DataFrame({'MMI_med': [6.5, 8.0], 'MMI_std': [0.5, 0.7]})
+    add_damageprobs(locns, 'MMI', frag, useMedian=False)
+    probs = frag.interp_uncertain(locns['MMI_med'], locns['MMI_std'])
+    for i, c in enumerate(frag.damagestates()):
+        np.testing.assert_array_equal(locns['prob_' + c], probs[:, i])
@@ -0,0 +1,153 @@
+"""Test the fragility curves of many vulnerability classes"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from shakemap_utils import FragilityCurve, FragilityLibrary
+from shakemap_utils.location_lookup import add_damageprobs
+from shakemap_utils.damage_simulation import simulate_damage
+
+
+# Parameters ------------------------------------------------------------------
+EXAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'example_damage_est')
+LIBRARY_FILE = os.path.join(EXAMPLE_DIR, 'my_fragility_library.csv')
+CLASSES = ('wood_frame', 'concrete', 'steel')
+
+
+# Tests -----------------------------------------------------------------------
+
+
+@pytest.fixture
+def library():
+    return FragilityLibrary(LIBRARY_FILE)
+
+
+def expected_probs(library, x, classes, method='interp_all', *args):
+    """Probabilities from each location's own curve, one at a time"""
+    out = np.full((len(x), len(library.damagestates())), np.nan)
+    for i, c in enumerate(classes):
+        if c in library.curves:
+            curve = library.curves[c]
+            out[i] = getattr(curve, method)(x[i:i+1],
+                                            *[a[i:i+1] for a in args])[0]
+    return out
+
+
+def test_read(library):
+    assert library.classes == list(CLASSES)
+    assert library.intensity_measure == 'MMI'
+    assert list(library.damagestates()) == list(
+        FragilityCurve(os.path.join(EXAMPLE_DIR, 'my_fragility.csv'))
+        .damagestates())
+    np.testing.assert_allclose(library.curves['steel'].intensities,
+                               np.arange(6.0, 13.0))
+
+    # Curves must give the same damage states
+    df = pd.read_csv(os.path.join(EXAMPLE_DIR, 'my_fragility.csv'))
+    frag = FragilityCurve(df)
+    other = FragilityCurve(df.iloc[:, :3])
+    with pytest.raises(ValueError):
+        FragilityLibrary({'a': frag, 'b': other})
+    with pytest.raises(ValueError):
+        FragilityLibrary({'a': frag}, defaultClass='b')
+
+
+def test_interp_all(library):
+    rng = np.random.default_rng(4)
+    n = 3000
+    x = rng.uniform(4, 13, n)
+    x[::97] = np.nan
+    classes = np.array(CLASSES + ('adobe',), dtype=object)[
+        rng.integers(0, 4, n)]
+
+    probs = library.interp_all(x, classes)
+    np.testing.assert_allclose(probs, expected_probs(library, x, classes),
+                               equal_nan=True)
+    assert np.isnan(probs[classes == 'adobe']).all()
+
+    # Sorted by class the groups are slices, and one class is one curve
+    order = np.argsort(classes, kind='stable')
+    np.testing.assert_allclose(library.interp_all(x[order], classes[order]),
+                               probs[order], equal_nan=True)
+    curves = library.for_locations(np.full(n, 'steel'))
+    assert curves.is_single()
+    np.testing.assert_allclose(curves.interp_all(x),
+                               library.curves['steel'].interp_all(x))
+
+    # Unknown classes can take a default curve
+    default = FragilityLibrary(LIBRARY_FILE, defaultClass='wood_frame')
+    probs = default.interp_all(x, classes)
+    isAdobe = classes == 'adobe'
+    np.testing.assert_allclose(
+        probs[isAdobe],
+        library.curves['wood_frame'].interp_all(x[isAdobe]), equal_nan=True)
+
+    # Several realisations of the same locations one after the other
+    curves = library.for_locations(classes[:100])
+    x2 = rng.uniform(4, 13, (5, 100))
+    np.testing.assert_allclose(
+        curves.interp_all(x2.ravel()).reshape(5, 100, -1),
+        [library.interp_all(xi, classes[:100]) for xi in x2], equal_nan=True)
+    with pytest.raises(ValueError):
+        curves.interp_all(x[:150])
+
+
+def test_interp_uncertain(library):
+    rng = np.random.default_rng(6)
+    n = 500
+    medians = rng.uniform(4, 12, n)
+    stddevs = rng.uniform(0, 1, n)
+    classes = np.array(CLASSES)[rng.integers(0, 3, n)]
+
+    probs = library.interp_uncertain(medians, stddevs, classes)
+    np.testing.assert_allclose(
+        probs, expected_probs(library, medians, classes, 'interp_uncertain',
+                              stddevs), atol=1e-12)
+
+
+def test_tabulate(library):
+    x = np.linspace(4, 13, 2000)
+    classes = np.array(CLASSES)[np.arange(2000) % 3]
+    exact = library.interp_all(x, classes)
+    err = library.tabulate(0.05)
+    assert library.tableStep <= 0.05
+    assert np.nanmax(np.abs(library.interp_all(x, classes) - exact)) <= err
+
+
+def test_add_damageprobs(library):
+    locns = pd.DataFrame({'MMI_med': [6.5, 8.0, 9.2, 7.0],
+                          'MMI_std': [0.3, 0.5, 0.4, 0.0],
+                          'class': ['steel', 'wood_frame', 'concrete',
+                                    'steel']})
+    add_damageprobs(locns, 'MMI', library, classColumn='class')
+    np.testing.assert_allclose(
+        locns[['prob_' + c for c in library.damagestates()]].values,
+        expected_probs(library, locns['MMI_med'].values, locns['class']))
+
+    add_damageprobs(locns, 'MMI', library, useMedian=False,
+                    classColumn='class')
+    np.testing.assert_allclose(
+        locns[['prob_' + c for c in library.damagestates()]].values,
+        expected_probs(library, locns['MMI_med'].values, locns['class'],
+                       'interp_uncertain', locns['MMI_std'].values))
+
+
+def test_simulate_damage(library):
+    # A mixed portfolio simulates as the sum of its classes
+    medians = np.array([7.5, 8.0, np.nan, 8.5, 9.0, 7.0])
+    stddevs = np.full(6, 0.5)
+    classes = np.array(['steel', 'wood_frame', 'steel', 'concrete', 'steel',
+                        'wood_frame'])
+    counts = simulate_damage(library.for_locations(classes), medians,
+                             stddevs, 20000, seed=1)
+    assert counts.nLocations == 5
+
+    isValid = ~np.isnan(medians)
+    expected = expected_probs(library, medians, classes, 'interp_uncertain',
+                              stddevs)[isValid].sum(axis=0)
+    np.testing.assert_allclose(counts.mean(), expected, atol=0.05)
@@ -0,0 +1,133 @@
+"""Test the on-disk cache of parsed ShakeMap grids"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import shutil
+import multiprocessing
+import numpy as np
+
+from shakemap_utils import USGSshakemapGrid, USGSshakemapFields
+from shakemap_utils import GridFileCache
+from shakemap_utils.usgs_shakemap_grid import convert_grid
+from synthetic_shakemap import write_grid, write_uncertainty
+
+
+# Tests -----------------------------------------------------------------------
+
+
+def test_cache_roundtrip(tmp_path):
+    ifile = write_grid(os.path.join(tmp_path, 'grid.xml.zip'), 11, 9,
+                       isZip=True)
+    ifile_unc = write_uncertainty(os.path.join(tmp_path, 'unc.xml.zip'),
+                                  11, 9, isZip=True)
+    cache = GridFileCache()
+
+    # First read parses the file and fills the cache next to the source
+    sm0 = USGSshakemapGrid(ifile, 'MMI', ifile_unc, isQuiet=True, cache=cache)
+    cacheDir = os.path.join(tmp_path, '.shakemap_cache')
+    assert len(cache.entries(cacheDir)) == 2
+
+    # Second read comes from the cache and gives the same grids
+    assert cache.get(ifile) is not None
+    sm1 = USGSshakemapGrid(ifile, 'MMI', ifile_unc, isQuiet=True, cache=cache)
+    np.testing.assert_array_equal(sm0.grid, sm1.grid)
+    np.testing.assert_array_equal(sm0.grid_std, sm1.grid_std)
+    assert sm1.hdr == sm0.hdr and sm1.eventInfo == sm0.eventInfo
+    assert sm1.xylims().tolist() == sm0.xylims().tolist()
+
+    # All fields were cached even though we only asked for one
+    smFields = USGSshakemapFields(ifile, isQuiet=True, cache=cache)
+    assert 'PGA' in smFields.fieldNames
+    assert np.array_equal(smFields.field('MMI'), sm0.grid)
+
+
+def test_cache_invalidate_and_evict(tmp_path):
+    ifile = write_grid(os.path.join(tmp_path, 'grid.xml'), 11, 9)
+    ifile2 = write_grid(os.path.join(tmp_path, 'grid2.xml'), 11, 9,
+                        eventId='synth02')
+    cacheDir = os.path.join(tmp_path, 'cache')
+    cache = GridFileCache(cacheDir)
+
+    USGSshakemapFields(ifile, isQuiet=True, cache=cache)
+    nBytes = cache.entries(cacheDir)[0][1]
+
+    # Changing the source file means it is read again
+    write_grid(ifile, 11, 9, version='2')
+    os.utime(ifile, ns=(1, 1))
+    assert cache.get(ifile) is None
+    smFields = USGSshakemapFields(ifile, isQuiet=True, cache=cache)
+    assert smFields.hdr['shakemap_version'] == '2'
+
+    # Only room for one entry in the cache
+    cache.maxBytes = 1.5*nBytes
+    USGSshakemapFields(ifile2, isQuiet=True, cache=cache)
+    assert len(cache.entries(cacheDir)) == 1
+    assert cache.get(ifile2) is not None
+
+    # Content hash keys do not depend on the file name
+    cache = GridFileCache(cacheDir, useContentHash=True)
+    shutil.copy(ifile2, ifile2 + '.copy')
+    assert cache.key(ifile2 + '.copy') == cache.key(ifile2)
+    assert cache.key(ifile2) != cache.key(ifile)
+
+
+def test_cache_dtype(tmp_path):
+    ifile = write_grid(os.path.join(tmp_path, 'grid.xml'), 11, 9)
+    cache = GridFileCache(os.path.join(tmp_path, 'cache'))
+
+    # Quantised fields are not given back to a full precision request
+    smInt = USGSshakemapFields(ifile, isQuiet=True, cache=cache, dtype='int16')
+    smFloat = USGSshakemapFields(ifile, isQuiet=True, cache=cache)
+    exact = USGSshakemapFields(ifile, isQuiet=True)
+    assert smInt.data.dtype == np.int16
+    assert smFloat.data.dtype == np.float64
+    np.testing.assert_array_equal(smFloat.values('PGA'), exact.values('PGA'))
+
+    # Each dtype is then loaded from its own entry
+    assert len(cache.entries(os.path.join(tmp_path, 'cache'))) == 2
+    again = USGSshakemapFields(ifile, isQuiet=True, cache=cache,
+                               dtype='int16', useMemmap=True)
+    np.testing.assert_array_equal(again.data, smInt.data)
+
+
+def lookup_in_worker(ifile):
+    """Open a converted grid in another process and look up one point"""
+    sm = USGSshakemapGrid(ifile, 'MMI', isQuiet=True, useMemmap=True)
+    return sm.lookup(np.array([sm.x0]), np.array([sm.y0]))[0][0]
+
+
+def test_memmap_grid(tmp_path):
+    ifile = write_grid(os.path.join(tmp_path, 'grid.xml'), 11, 9)
+    ifile_unc = write_uncertainty(os.path.join(tmp_path, 'unc.xml'), 11, 9)
+    ofile = convert_grid(ifile, os.path.join(tmp_path, 'grid.npy'))
+    ofile_unc = convert_grid(ifile_unc, os.path.join(tmp_path, 'unc.npy'))
+
+    sm0 = USGSshakemapGrid(ifile, 'MMI', ifile_unc, isQuiet=True)
+    sm1 = USGSshakemapGrid(ofile, 'MMI', ofile_unc, isQuiet=True,
+                           useMemmap=True)
+    assert isinstance(sm1.grid.base, np.memmap)
+    assert not sm1.grid.flags.writeable
+
+    # Everything works the same on top of the memory map
+    x = np.linspace(sm0.x0, sm0.x1, 23)
+    y = np.linspace(sm0.y0, sm0.y1, 23)
+    for a, b in zip(sm0.lookup(x, y), sm1.lookup(x, y)):
+        np.testing.assert_array_equal(a, b)
+    for k, v in sm0.as_dict().items():
+        np.testing.assert_array_equal(v, sm1.as_dict()[k])
+
+    sw = sm1.grid[0, 0]
+    xyclip = [sm0.x0 + 0.05, sm0.x1, sm0.y0, sm0.y1 - 0.05]
+    sm0.clipxy(xyclip)
+    sm1.clipxy(xyclip)
+    np.testing.assert_array_equal(sm0.grid, sm1.grid)
+
+    # xml files are memory mapped from the cache
+    sm2 = USGSshakemapGrid(ifile, 'MMI', isQuiet=True, useMemmap=True)
+    assert isinstance(sm2.grid.base, np.memmap)
+
+    # Several processes can open the same file
+    with multiprocessing.Pool(2) as pool:
+        out = pool.map(lookup_in_worker, [ofile]*2)
+    assert out == [sw]*2
@@ -0,0 +1,95 @@
+"""Test the lookup of grid values at points"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import numpy as np
+import pytest
+
+from shakemap_utils import USGSshakemapGrid
+from synthetic_shakemap import write_grid, write_uncertainty
+
+
+# Tests -----------------------------------------------------------------------
+
+
+@pytest.fixture
+def shakemap(tmp_path):
+    ifile = write_grid(os.path.join(tmp_path, 'grid.xml'), 11, 9)
+    ifile_unc = write_uncertainty(os.path.join(tmp_path, 'unc.xml'), 11, 9)
+    return USGSshakemapGrid(ifile, 'MMI', ifile_unc, isQuiet=True)
+
+
+def test_nearest(shakemap):
+    sm = shakemap
+    xi, yi = np.meshgrid(sm.xcoords(), sm.ycoords())
+
+    # Points near the centers, including the last row and column, take the
+    # value of that cell
+    for offset in (0.0, 0.4, -0.4):
+        m, s = sm.lookup(xi + offset*sm.dx(), yi - offset*sm.dy())
+        np.testing.assert_array_equal(m, sm.grid)
+        np.testing.assert_array_equal(s, sm.grid_std)
+
+    # Outside the cell edges, or without coordinates, there is no value
+    xlims, ylims = sm.xlims(), sm.ylims()
+    x = np.array([xlims[0] - 1e-6, xlims[1] + 1e-6, sm.x0, np.nan])
+    y = np.array([sm.y0, sm.y0, ylims[1] + 1e-6, sm.y0])
+    m, s = sm.lookup(x, y)
+    assert np.all(np.isnan(m)) and np.all(np.isnan(s))
+
+    # Masked indices are still available
+    iLon, iLat = sm.grididx(np.array([x[0], sm.x1]), np.array([sm.y1, sm.y1]))
+    assert iLon.mask[0] and iLat.mask[0]
+    assert iLon[1] == sm.nx() - 1 and iLat[1] == sm.ny() - 1
+
+
+def test_bilinear(shakemap):
+    sm = shakemap
+    xi, yi = np.meshgrid(sm.xcoords(), sm.ycoords())
+
+    # Interpolated values at the centers are the grid values
+    m, s = sm.lookup(xi, yi, method='bilinear')
+    np.testing.assert_allclose(m, sm.grid)
+    np.testing.assert_allclose(s, sm.grid_std)
+
+    # Half way between four centers is their average
+    x = sm.x0 + 2.5*sm.dx()
+    y = sm.y0 + 3.5*sm.dy()
+    m, s = sm.lookup(np.array([x]), np.array([y]), method='bilinear')
+    np.testing.assert_allclose(m[0], sm.grid[3:5, 2:4].mean())
+
+    # The edge half cells take the edge values
+    m, s = sm.lookup(np.array([sm.x0 - 0.4*sm.dx()]), np.array([sm.y0]),
+                     method='bilinear')
+    np.testing.assert_allclose(m[0], sm.grid[0, 0])
+
+    with pytest.raises(ValueError):
+        sm.lookup(xi, yi, method='cubic')
+
+
+def test_out_buffers(shakemap):
+    sm = shakemap
+    x = np.linspace(sm.x0 - 0.1, sm.x1 + 0.1, 1000)
+    y = np.linspace(sm.y0 - 0.1, sm.y1 + 0.1, 1000)
+    m0, s0 = sm.lookup(x, y)
+
+    # Values are written into the buffers given
+    out = (np.empty(1000), np.empty(1000))
+    m, s = sm.lookup(x, y, out=out)
+    assert np.shares_memory(m, out[0]) and np.shares_memory(s, out[1])
+    np.testing.assert_array_equal(m, m0)
+    np.testing.assert_array_equal(s, s0)
+
+    with pytest.raises(ValueError):
+        sm.lookup(x, y, out=(np.empty(10), np.empty(10)))
+
+    # Strided 1-d buffers are written through, buffers that would be copied
+    # to flatten are refused
+    buf = np.empty((2, 2000))
+    m, s = sm.lookup(x, y, out=(buf[0, ::2], buf[1, 1::2]))
+    np.testing.assert_array_equal(buf[0, ::2], m0)
+    np.testing.assert_array_equal(buf[1, 1::2], s0)
+    out = (np.empty((20, 50)).T, np.empty((50, 20)))
+    with pytest.raises(ValueError):
+        sm.lookup(x.reshape(50, 20), y.reshape(50, 20), out=out)
@@ -0,0 +1,266 @@
+"""Test the grid_data parser against a synthetic ShakeMap grid"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import numpy as np
+import pytest
+
+from shakemap_utils import USGSshakemapGrid, USGSshakemapFields
+from shakemap_utils import GridFileCache
+from shakemap_utils.grid_parser import GridDataParser, parse_grid_text
+from shakemap_utils.grid_parser import parse_grid_stream, ParallelGridDataParser
+from shakemap_utils.grid_parser import quantise
+from shakemap_utils import grid_parser
+from shakemap_utils.usgs_shakemap_grid import NAMESPACE, read_fields
+from shakemap_utils.usgs_shakemap_grid import open_grid, read_stream_header
+from shakemap_utils.usgs_shakemap_grid import read_griddims, read_header
+from shakemap_utils.usgs_shakemap_grid import read_fields_concurrently
+from shakemap_utils.usgs_shakemap_grid import convert_grid
+from synthetic_shakemap import write_grid, write_uncertainty, synthetic_values
+
+
+# Tests -----------------------------------------------------------------------
+
+
+def test_parse_text_in_pieces():
+    vals = synthetic_values(7, 5)
+    text = '\n' + '\n'.join(' '.join('%.4f' % v for v in row)
+                            for row in vals) + '\n'
+
+    # Small pieces so that lines are split between calls to feed
+    out = parse_grid_text(text, 35, vals.shape[1], chunkSize=13)
+    np.testing.assert_allclose(out, vals.T)
+
+    out = parse_grid_text(text.encode(), 35, vals.shape[1], usecols=[4],
+                          chunkSize=50)
+    np.testing.assert_allclose(out[0], vals[:, 4])
+
+
+def test_parse_old_numpy(monkeypatch):
+    # Lines are split rather than read by np.loadtxt before numpy 1.23
+    monkeypatch.setattr(grid_parser, 'HAS_C_LOADTXT', False)
+    vals = synthetic_values(7, 5)
+    text = '\n'.join(' '.join('%.4f' % v for v in row) for row in vals)
+    out = parse_grid_text(text, 35, vals.shape[1], usecols=[2, 4],
+                          chunkSize=40)
+    np.testing.assert_allclose(out, vals[:, [2, 4]].T)
+
+    with pytest.raises(ValueError):
+        parse_grid_text('1 2\n3\n', 2, 2)
+
+
+def test_parse_wrong_size():
+    parser = GridDataParser(3, 2)
+    parser.feed('1 2\n3 4\n')
+    with pytest.raises(ValueError):
+        parser.close()
+
+    parser = GridDataParser(3, 2)
+    with pytest.raises(ValueError):
+        parser.feed('1 2 3\n')
+
+
+def test_read_grid(tmp_path):
+    ifile = write_grid(os.path.join(tmp_path, 'grid.xml'), 11, 9)
+    vals = synthetic_values(11, 9)
+
+    sm = USGSshakemapGrid(ifile, 'MMI', isQuiet=True)
+
+    # First value in the file is the NW corner, grid[0, 0] is the SW corner
+    assert sm.grid.shape == (9, 11)
+    assert sm.grid[-1, 0] == vals[0, 4]
+    np.testing.assert_allclose(np.flipud(sm.grid).ravel(), vals[:, 4])
+
+
+def test_read_all_fields(tmp_path):
+    ifile = write_grid(os.path.join(tmp_path, 'grid.xml'), 11, 9)
+    ifile_unc = write_uncertainty(os.path.join(tmp_path, 'unc.xml'), 11, 9)
+    vals = synthetic_values(11, 9)
+
+    smFields = USGSshakemapFields(ifile, isQuiet=True)
+    assert smFields.fieldNames[0] == 'PGA' and 'LON' not in smFields.fieldNames
+    assert smFields.data.shape == (len(smFields.fieldNames), 9, 11)
+
+    # Grids for different intensity measures share the parsed data
+    mmi = USGSshakemapGrid(smFields, 'MMI', ifile_unc=ifile_unc)
+    pga = USGSshakemapGrid(smFields, 'PGA')
+    assert np.shares_memory(mmi.grid, smFields.data)
+    assert np.shares_memory(pga.grid, smFields.data)
+    np.testing.assert_allclose(np.flipud(pga.grid).ravel(), vals[:, 2])
+    assert mmi.grid_std.max() > 0.0
+
+    # Sea points are removed from both grids
+    sm = USGSshakemapGrid(ifile, 'MMI', ifile_unc=ifile_unc, isQuiet=True,
+                          ignoreSVEL600=True)
+    isSea = np.flipud(vals[:, -1].reshape(9, 11)) == 600
+    assert np.all(np.isnan(sm.grid[isSea]))
+    assert np.all(np.isnan(sm.grid_std[isSea]))
+    assert not np.any(np.isnan(sm.grid[~isSea]))
+
+    with pytest.raises(ValueError):
+        smFields.field('PSA99')
+
+
+def test_stream_zipped_grid(tmp_path):
+    ifile = write_grid(os.path.join(tmp_path, 'grid.xml.zip'), 11, 9,
+                       isZip=True)
+    vals = synthetic_values(11, 9)
+
+    meta, data = read_fields(ifile, ['MMI', 'PGA'])
+    assert data.shape == (2, 9, 11)
+    np.testing.assert_allclose(data[0].ravel(), vals[:, 4])
+    np.testing.assert_allclose(data[1].ravel(), vals[:, 2])
+    assert meta['hdr']['event_id'] == 'synth01'
+    assert meta['eventInfo']['magnitude'] == '6.9'
+
+    # Same result when the tags are split between the pieces read
+    with open_grid(ifile) as stream:
+        root, rest = read_stream_header(stream, chunkSize=7)
+        assert read_griddims(root, NAMESPACE) == (11, 9)
+        out = parse_grid_stream(stream, 99, 11, usecols=[4], chunkSize=5,
+                                head=rest)
+    np.testing.assert_allclose(out[0], vals[:, 4])
+
+
+def test_read_header(tmp_path):
+    ifile = write_grid(os.path.join(tmp_path, 'grid.xml'), 300, 200)
+    header = read_header(ifile)
+    assert (header['nx'], header['ny']) == (300, 200)
+    assert header['fieldNames'][:3] == ['LON', 'LAT', 'PGA']
+    assert header['hdr']['shakemap_version'] == '1'
+    assert header['eventInfo']['event_id'] == 'synth01'
+    np.testing.assert_allclose(header['xylims'][0], -158.9)
+
+    # Only the start of the file is needed
+    with open(ifile, 'rb') as f:
+        start = f.read(20000)
+    with open(ifile, 'wb') as f:
+        f.write(start)
+    assert read_header(ifile) == header
+
+
+def test_uncertainty_mismatch(tmp_path, capsys):
+    ifile = write_grid(os.path.join(tmp_path, 'grid.xml'), 11, 9)
+    ifile_unc = write_uncertainty(os.path.join(tmp_path, 'unc.xml'), 11, 9,
+                                  version='2')
+
+    sm = USGSshakemapGrid(ifile, 'MMI', ifile_unc, isQuiet=True)
+    assert 'mismatch in shakemap_version' in capsys.readouterr().out
+    assert np.all(sm.grid_std == 0.0)
+
+
+def test_compact_dtypes(tmp_path):
+    ifile = write_grid(os.path.join(tmp_path, 'grid.xml'), 11, 9)
+    ifile_unc = write_uncertainty(os.path.join(tmp_path, 'unc.xml'), 11, 9)
+    x = np.linspace(-159.0, -158.7, 31)
+    y = np.linspace(22.3, 22.6, 31)
+
+    sm64 = USGSshakemapGrid(ifile, 'MMI', ifile_unc, isQuiet=True,
+                            ignoreSVEL600=True)
+    m64, s64 = sm64.lookup(x, y)
+
+    for dtype, tol in (('float32', 1e-6), ('int16', 1e-3)):
+        sm = USGSshakemapGrid(ifile, 'MMI', ifile_unc, isQuiet=True,
+                              ignoreSVEL600=True, dtype=dtype)
+        assert sm.grid.dtype == dtype and sm.grid_std.dtype == dtype
+        m, s = sm.lookup(x, y)
+        assert m.dtype == np.float32
+        np.testing.assert_allclose(m, m64, atol=tol)
+        np.testing.assert_allclose(s, s64, atol=tol)
+        np.testing.assert_allclose(sm.as_dict()['m0'], sm64.as_dict()['m0'],
+                                   atol=tol)
+
+    # No uncertainty grid is stored without a file
+    sm = USGSshakemapGrid(ifile, 'MMI', isQuiet=True, dtype='int16')
+    assert not sm.has_std() and sm.grid_std.strides == (0, 0)
+    m, s = sm.lookup(x, y)
+    assert np.all(s[~np.isnan(m)] == 0.0) and np.all(np.isnan(s[np.isnan(m)]))
+
+    # Cached float64 fields are converted on load
+    cache = GridFileCache(os.path.join(tmp_path, 'cache'))
+    USGSshakemapFields(ifile, isQuiet=True, cache=cache)
+    smFields = USGSshakemapFields(ifile, ['MMI', 'PGA'], isQuiet=True,
+                                  cache=cache, dtype='int16')
+    assert smFields.data.dtype == np.int16
+    assert smFields.scale('MMI') == 0.001
+    pga = USGSshakemapGrid(ifile, 'PGA', isQuiet=True).grid
+    np.testing.assert_allclose(smFields.values('PGA'), pga, atol=0.005)
+
+
+def test_int16_range(tmp_path, capsys):
+    # PGV up to 500, beyond the 327.67 of the default 0.01 scale
+    ifile = write_grid(os.path.join(tmp_path, 'grid.xml'), 11, 9,
+                       gains={'PGV': 50.0})
+    pgv = USGSshakemapFields(ifile, ['PGV'], isQuiet=True).values('PGV')
+    assert np.nanmax(pgv) > 400
+
+    for nWorkers in (1, 2):
+        meta, data = read_fields(ifile, ['MMI', 'PGV'], dtype='int16',
+                                 nWorkers=nWorkers)
+        assert 'PGV reached the int16 range' in capsys.readouterr().out
+        assert meta['scales'] == [0.001, 0.1]
+        np.testing.assert_allclose(np.flipud(data[1]*0.1), pgv, atol=0.05)
+
+    # Converting float fields picks the scale from their range
+    npyFile = convert_grid(ifile, os.path.join(tmp_path, 'grid.npy'))
+    smFields = USGSshakemapFields(npyFile, ['MMI', 'PGV'], isQuiet=True,
+                                  dtype='int16')
+    assert smFields.scale('PGV') == 0.1
+    np.testing.assert_allclose(smFields.values('PGV'), pgv, atol=0.05)
+
+    # Clipping by quantise itself is reported
+    q = quantise(np.array([1.0, 400.0, -500.0, np.nan]), 0.01)
+    assert 'WARNING: 2 values beyond the int16 range' in \
+        capsys.readouterr().out
+    assert q.tolist() == [100, 32767, -32767, -32768]
+
+
+def test_concurrent_read(tmp_path, capsys):
+    ifile = write_grid(os.path.join(tmp_path, 'grid.xml.zip'), 11, 9,
+                       isZip=True)
+    ifile_unc = write_uncertainty(os.path.join(tmp_path, 'unc.xml.zip'),
+                                  11, 9, isZip=True)
+
+    sm0 = USGSshakemapGrid(ifile, 'MMI', ifile_unc, isQuiet=True,
+                           ignoreSVEL600=True)
+    sm1 = USGSshakemapGrid(ifile, 'MMI', ifile_unc, isQuiet=True,
+                           ignoreSVEL600=True, nWorkers=2)
+    np.testing.assert_array_equal(sm0.grid, sm1.grid)
+    np.testing.assert_array_equal(sm0.grid_std, sm1.grid_std)
+
+    # Mismatched uncertainty file is found from the headers
+    ifile_unc = write_uncertainty(os.path.join(tmp_path, 'unc2.xml'), 11, 9,
+                                  eventId='synth02')
+    sm = USGSshakemapGrid(ifile, 'MMI', ifile_unc, isQuiet=True, nWorkers=2)
+    assert 'mismatch in event_id' in capsys.readouterr().out
+    assert not sm.has_std()
+
+    smFields = read_fields_concurrently([{'ifile_xml': ifile},
+                                         {'ifile_xml': ifile_unc}])
+    assert smFields[1].fieldNames[0] == 'STDPGA'
+
+
+def test_parallel_convert(tmp_path):
+    ifile = write_grid(os.path.join(tmp_path, 'grid.xml.zip'), 60, 50,
+                       isZip=True)
+    vals = synthetic_values(60, 50)
+
+    # Small chunks so the work is split across the workers
+    with open_grid(ifile) as stream:
+        root, rest = read_stream_header(stream)
+        out = parse_grid_stream(stream, 3000, 11, usecols=[2, 4],
+                                chunkSize=1000, head=rest, nWorkers=3)
+    np.testing.assert_allclose(out, vals[:, [2, 4]].T)
+
+    meta, data = read_fields(ifile, ['MMI'], dtype='int16', nWorkers=2)
+    np.testing.assert_allclose(data[0].ravel()*0.001, vals[:, 4], atol=5e-4)
+
+    sm = USGSshakemapGrid(ifile, 'MMI', isQuiet=True, nWorkers=2)
+    np.testing.assert_allclose(np.flipud(sm.grid).ravel(), vals[:, 4])
+
+    # Errors in the workers are raised
+    parser = ParallelGridDataParser(3, 2, nWorkers=2)
+    parser.feed('1 2\n3 x\n6 7\n')
+    with pytest.raises(ValueError):
+        parser.close()
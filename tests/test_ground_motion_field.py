@@ -0,0 +1,80 @@
+"""Test the spatially correlated fields on a ShakeMap grid"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import numpy as np
+import pytest
+
+from shakemap_utils import USGSshakemapGrid, FragilityCurve
+from shakemap_utils.ground_motion_field import CorrelatedField
+from shakemap_utils.damage_simulation import simulate_damage
+from synthetic_shakemap import write_grid, write_uncertainty
+
+
+# Parameters ------------------------------------------------------------------
+FRAGILITY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'example_damage_est', 'my_fragility.csv')
+
+
+# Tests -----------------------------------------------------------------------
+
+
+@pytest.fixture
+def shakemap(tmp_path):
+    ifile = write_grid(os.path.join(tmp_path, 'grid.xml'), 60, 40)
+    ifile_unc = write_uncertainty(os.path.join(tmp_path, 'unc.xml'), 60, 40)
+    return USGSshakemapGrid(ifile, 'MMI', ifile_unc, isQuiet=True)
+
+
+def test_correlation(shakemap):
+    field = CorrelatedField(shakemap, corrRange=20.0)
+    eps = field.sample(301, rng=5)
+    assert eps.shape == (301, 40, 60)
+
+    # Unit variance, and the correlation falls off with the distance
+    assert abs(eps.var() - 1) < 0.05
+    for k in (1, 4, 10):
+        rhoX = np.mean(eps[:, :, :-k] * eps[:, :, k:])
+        rhoY = np.mean(eps[:, :-k, :] * eps[:, k:, :])
+        assert rhoX == pytest.approx(np.exp(-3 * k * field.dxKm / 20),
+                                     abs=0.05)
+        assert rhoY == pytest.approx(np.exp(-3 * k * field.dyKm / 20),
+                                     abs=0.05)
+
+    # Repeatable with a seed, and split into batches the same way
+    np.testing.assert_array_equal(field.sample(3, rng=5), eps[:3])
+
+    # Residuals are in the units of the std
+    std = shakemap.grid_std
+    np.testing.assert_allclose(field.residuals(2, rng=5), eps[:2] * std)
+
+    with pytest.raises(ValueError):
+        CorrelatedField(shakemap, corrRange=0)
+
+
+def test_sample_points(shakemap):
+    field = CorrelatedField(shakemap)
+    x = np.array([shakemap.x0, shakemap.xcoords()[7], shakemap.x1 + 1])
+    y = np.array([shakemap.y0, shakemap.ycoords()[3], shakemap.y0])
+
+    eps = field.sample_points(x, y, 5, rng=2)
+    fields = field.sample(5, rng=2)
+    np.testing.assert_array_equal(eps[:, 0], fields[:, 0, 0])
+    np.testing.assert_array_equal(eps[:, 1], fields[:, 3, 7])
+    assert np.isnan(eps[:, 2]).all()
+
+
+def test_correlated_damage(shakemap):
+    frag = FragilityCurve(FRAGILITY_FILE)
+    rng = np.random.default_rng(4)
+    x = rng.uniform(*shakemap.xlims(), 300)
+    y = rng.uniform(*shakemap.ylims(), 300)
+    median, std = shakemap.lookup(x, y)
+
+    # The same mean, but a wider spread than independent locations
+    sampler = CorrelatedField(shakemap, 50.0).sampler(x, y)
+    counts = simulate_damage(frag, median, std, 400, seed=1, sampler=sampler)
+    indep = simulate_damage(frag, median, std, 400, seed=1)
+    assert counts.mean()[1] == pytest.approx(indep.mean()[1], rel=0.1)
+    assert (counts.std() > 1.5 * indep.std()).all()
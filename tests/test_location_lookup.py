@@ -0,0 +1,155 @@
+"""Test reading, processing and writing files of locations"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from shakemap_utils.location_lookup import process_locations
+from shakemap_utils.location_lookup import read_locations, iter_locations
+from shakemap_utils.location_lookup import LocationWriter
+
+
+# Tests -----------------------------------------------------------------------
+
+
+def test_process_in_chunks(tmp_path):
+    ifile = os.path.join(tmp_path, 'locns.csv')
+    pd.DataFrame({'lon': np.linspace(-159, -158, 101),
+                  'lat': np.linspace(22, 23, 101)}).to_csv(ifile, index=False)
+
+    def keep_north(locns):
+        locns['x'] = 2*locns['lon']
+        return locns[locns['lat'] > 22.5]
+
+    # Chunks that don't divide the number of rows give the same file as one
+    ofiles = []
+    for chunkSize in (None, 7, 1000):
+        ofiles.append(os.path.join(tmp_path, 'out_%s.csv' % chunkSize))
+        nRead, nWritten = process_locations(ifile, ofiles[-1], keep_north,
+                                            chunkSize, isQuiet=True)
+        assert nRead == 101 and nWritten == 50
+
+    with open(ofiles[0]) as f:
+        expected = f.read()
+    for ofile in ofiles[1:]:
+        with open(ofile) as f:
+            assert f.read() == expected
+
+    out = pd.read_csv(ofiles[1])
+    assert list(out.columns) == ['lon', 'lat', 'x'] and len(out) == 50
+
+
+def test_chunk_dtypes(tmp_path):
+    # Whole numbers with a few missing, and numbers with a few names, only
+    # in some of the chunks
+    n = 100
+    tiv = np.full(n, 100.0)
+    tiv[[13, 57]] = np.nan
+    route = [str(130 + i % 5) for i in range(n)]
+    route[88] = 'H-2'
+    ifile = os.path.join(tmp_path, 'locns.csv')
+    pd.DataFrame({'lon': np.linspace(-159, -158, n),
+                  'lat': np.linspace(22, 23, n),
+                  'tiv': tiv, 'route': route}).to_csv(ifile, index=False)
+
+    whole = read_locations(ifile)
+    chunks = list(iter_locations(ifile, chunkSize=20))
+    for locns in chunks:
+        assert locns.dtypes.equals(whole.dtypes)
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), whole)
+
+    # So the files written are the same
+    ofiles = []
+    for chunkSize in (None, 20):
+        ofiles.append(os.path.join(tmp_path, 'out_%s.csv' % chunkSize))
+        process_locations(ifile, ofiles[-1], lambda df: df, chunkSize,
+                          isQuiet=True)
+    with open(ofiles[0]) as f0, open(ofiles[1]) as f1:
+        assert f0.read() == f1.read()
+
+
+def test_columnar_formats(tmp_path):
+    pytest.importorskip('pyarrow')
+    n = 1000
+    locns = pd.DataFrame({'id': np.arange(n),
+                          'lon': np.linspace(-159, -158, n),
+                          'lat': np.linspace(22, 23, n),
+                          'tiv': np.full(n, 100.0),
+                          'island': ['Maui']*n})
+    ifile = os.path.join(tmp_path, 'locns.csv')
+    locns.to_csv(ifile, index=False)
+
+    def add_x(locns):
+        locns['x'] = 2*locns['lon']
+        return locns[locns['lat'] < 22.5]
+
+    # Converting between formats in chunks keeps the values
+    for ext in ('parquet', 'feather'):
+        ofile = os.path.join(tmp_path, 'out.' + ext)
+        nRead, nWritten = process_locations(ifile, ofile, add_x, 300,
+                                            isQuiet=True)
+        assert nRead == n and nWritten == 500
+
+        out = read_locations(ofile)
+        expected = add_x(locns.copy())
+        pd.testing.assert_frame_equal(out, expected)
+
+        # Only the columns asked for, plus the coordinates
+        out = read_locations(ofile, ['tiv'])
+        assert list(out.columns) == ['lon', 'lat', 'tiv']
+
+        chunks = list(iter_locations(ofile, ['id'], 200))
+        assert max(len(c) for c in chunks) == 200
+        pd.testing.assert_frame_equal(
+            pd.concat(chunks, ignore_index=True),
+            expected[['lon', 'lat', 'id']].reset_index(drop=True))
+
+    # Without any rows written the file still has the columns
+    ofile = os.path.join(tmp_path, 'none.parquet')
+    process_locations(ifile, ofile, lambda df: df.iloc[:0], 300,
+                      isQuiet=True)
+    assert list(read_locations(ofile).columns) == list(locns.columns)
+
+    with pytest.raises(ValueError):
+        read_locations(os.path.join(tmp_path, 'locns.txt'))
+
+
+def test_chunk_types_written(tmp_path):
+    pytest.importorskip('pyarrow')
+
+    # A route column of numbers until a name far into the file
+    ifile = os.path.join(tmp_path, 'locns.csv')
+    n = 100
+    route = ['132']*n
+    route[90] = 'H-2'
+    note = [None]*n
+    note[50] = 'bridge'
+    pd.DataFrame({'lon': np.linspace(-159, -158, n),
+                  'lat': np.linspace(22, 23, n),
+                  'route': route, 'note': note}).to_csv(ifile, index=False)
+
+    for ext in ('parquet', 'feather'):
+        ofile = os.path.join(tmp_path, 'out.' + ext)
+        process_locations(ifile, ofile, lambda df: df, 20, isQuiet=True)
+        out = read_locations(ofile)
+        assert out['route'].tolist() == route
+        assert out['note'][50] == 'bridge' and out['note'].isna().sum() == 99
+
+    # Strings in later rows of a column with none at first
+    ofile = os.path.join(tmp_path, 'out.parquet')
+    locns = pd.DataFrame({'lon': [-159.0], 'lat': [22.0],
+                          'note': pd.Series([None], dtype=object)})
+    with LocationWriter(ofile) as writer:
+        writer.write(locns)
+        writer.write(locns.assign(note=['bridge']))
+    assert read_locations(ofile)['note'].tolist()[1] == 'bridge'
+
+    # Types that can't hold the rows written first are an error
+    locns = pd.DataFrame({'lon': [-159.0], 'lat': [22.0], 'route': [132]})
+    with pytest.raises(ValueError):
+        with LocationWriter(ofile) as writer:
+            writer.write(locns)
+            writer.write(locns.assign(route=['H-2']))
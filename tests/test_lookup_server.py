@@ -0,0 +1,105 @@
+"""Test the local lookup server"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import json
+import shutil
+import threading
+import numpy as np
+import pytest
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from concurrent.futures import ThreadPoolExecutor
+
+from shakemap_utils import USGSshakemapGrid, FragilityCurve
+from shakemap_utils.lookup_server import LookupServer, request_lookup
+from synthetic_shakemap import write_grid, write_uncertainty
+
+
+# Parameters ------------------------------------------------------------------
+FRAGILITY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'example_damage_est', 'my_fragility.csv')
+
+
+# Tests -----------------------------------------------------------------------
+
+
+@pytest.fixture
+def server(tmp_path):
+    write_grid(os.path.join(tmp_path, 'grid.xml'), 21, 15)
+    write_uncertainty(os.path.join(tmp_path, 'unc.xml'), 21, 15)
+    shutil.copy(FRAGILITY_FILE, tmp_path)
+    server = LookupServer(('127.0.0.1', 0), dataDir=str(tmp_path),
+                          isQuiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post_json(url, obj):
+    req = Request(url + '/lookup', data=json.dumps(obj).encode(),
+                  headers={'Content-Type': 'application/json'},
+                  method='POST')
+    with urlopen(req) as response:
+        return json.loads(response.read())
+
+
+def test_lookup(server, tmp_path):
+    sm = USGSshakemapGrid(os.path.join(tmp_path, 'grid.xml'), 'MMI',
+                          os.path.join(tmp_path, 'unc.xml'), isQuiet=True)
+    x = np.linspace(sm.x0 - 0.05, sm.x1, 50)
+    y = np.linspace(sm.y0, sm.y1, 50)
+    m, s = sm.lookup(x, y)
+
+    # Binary arrays, with damage probabilities
+    out = request_lookup(server.url(), x, y, 'grid.xml',
+                         uncertainty='unc.xml', fragility='my_fragility.csv')
+    np.testing.assert_array_equal(out['median'], m)
+    np.testing.assert_array_equal(out['std'], s)
+    frag = FragilityCurve(FRAGILITY_FILE)
+    for c in frag.damagestates():
+        np.testing.assert_allclose(out['prob_' + c],
+                                   frag.interp_damagestate(m, c))
+
+    # JSON, with null where there is no value
+    out = post_json(server.url(), {'shakemap': 'grid.xml',
+                                   'lon': x.tolist(), 'lat': y.tolist()})
+    assert out['median'][0] is None
+    np.testing.assert_array_equal(np.array(out['median'], dtype=float), m)
+
+    # Concurrent requests share the loaded grid
+    with ThreadPoolExecutor(4) as pool:
+        outs = list(pool.map(
+            lambda i: request_lookup(server.url(), x, y, 'grid.xml',
+                                     method='bilinear'), range(8)))
+    for out in outs:
+        np.testing.assert_array_equal(out['median'],
+                                      sm.lookup(x, y, 'bilinear')[0])
+
+    with urlopen(server.url() + '/metrics') as response:
+        metrics = json.loads(response.read())
+    assert metrics['requests'] == 10 and metrics['errors'] == 0
+    assert len(metrics['grids']) == 2
+    assert metrics['latency_ms_max'] > 0
+
+
+def test_bad_requests(server):
+    # Files outside the data folder, or missing, are refused
+    for fnm in ('../grid.xml', 'missing.xml'):
+        with pytest.raises(HTTPError) as e:
+            request_lookup(server.url(), [0.0], [0.0], fnm)
+        assert e.value.code == 400
+
+    with pytest.raises(HTTPError) as e:
+        post_json(server.url(), {'lon': [0.0], 'lat': [0.0]})
+    assert e.value.code == 400
+
+    # Fragility curves are only evaluated on their own intensity measure
+    with pytest.raises(HTTPError) as e:
+        request_lookup(server.url(), [0.0], [0.0], 'grid.xml',
+                       intensity_measure='PGA', fragility='my_fragility.csv')
+    assert e.value.code == 400
+    assert server.metrics()['errors'] == 4
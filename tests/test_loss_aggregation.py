@@ -0,0 +1,101 @@
+"""Test the expected losses and their totals by group"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from shakemap_utils import FragilityCurve
+from shakemap_utils.loss_aggregation import read_damage_ratios, expected_loss
+from shakemap_utils.loss_aggregation import LossAggregator, group_key
+from shakemap_utils.location_lookup import read_locations, iter_locations
+
+
+# Parameters ------------------------------------------------------------------
+FRAGILITY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'example_damage_est', 'my_fragility.csv')
+LOCATIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'example_lookup', 'Hawaii_Mile_Markers_v2.csv')
+
+
+# Tests -----------------------------------------------------------------------
+
+
+def test_damage_ratios(tmp_path):
+    states = ['minor', 'major', 'destroyed']
+    expected = np.array([0.1, 0.5, 1.0])
+    ofile = os.path.join(tmp_path, 'ratios.csv')
+    pd.DataFrame({'state': states[::-1], 'ratio': expected[::-1]}).to_csv(
+        ofile, index=False)
+
+    for ratios_in in ('0.1,0.5,1', [0.1, 0.5, 1.0], ofile,
+                      dict(zip(states, expected))):
+        np.testing.assert_array_equal(read_damage_ratios(ratios_in, states),
+                                      expected)
+
+    for ratios_in in ('0.1,0.5', '0.5,0.1,1', {'minor': 0.1}):
+        with pytest.raises(ValueError):
+            read_damage_ratios(ratios_in, states)
+
+
+def test_expected_loss():
+    frag = FragilityCurve(FRAGILITY_FILE)
+    ratios = np.array([0.02, 0.1, 0.4, 0.8, 1.0])
+    probs = frag.interp_all(np.array([4.0, 6.5, 8.0, 12.0]))
+    tiv = np.array([100.0, 200.0, 50.0, 10.0])
+
+    # Probability of being in each state, times its ratio
+    inState = probs - np.column_stack([probs[:, 1:], np.zeros(4)])
+    np.testing.assert_allclose(expected_loss(probs, tiv, ratios),
+                               inState @ ratios * tiv)
+    assert expected_loss(probs, tiv, ratios)[0] == 0
+
+
+def test_totals():
+    rng = np.random.default_rng(6)
+    locns = pd.DataFrame({'island': rng.choice(['Maui', 'Oahu', None], 1000),
+                          'route': rng.integers(0, 30, 1000)})
+    tiv = rng.uniform(50, 150, 1000)
+    loss = tiv * rng.uniform(0, 0.1, 1000)
+
+    # Chunks give the same totals as a groupby of all the locations
+    agg = LossAggregator(['island', 'route'])
+    for i0 in range(0, 1000, 170):
+        agg.add(locns.iloc[i0:i0+170], tiv[i0:i0+170], loss[i0:i0+170])
+    np.testing.assert_allclose(agg.total, [1000, tiv.sum(), loss.sum()])
+
+    df = locns.assign(tiv=tiv, expected_loss=loss)
+    for c in ('island', 'route'):
+        expected = df.groupby(c, dropna=False)[['tiv', 'expected_loss']].sum()
+        table = agg.table(c)
+        assert table['expected_loss'].is_monotonic_decreasing
+        table = table.loc[expected.index.map(group_key)]
+        np.testing.assert_allclose(table['tiv'], expected['tiv'])
+        np.testing.assert_allclose(table['expected_loss'],
+                                   expected['expected_loss'])
+        assert table['n_locations'].sum() == 1000
+
+
+def test_group_types():
+    # The same route read as a number in some chunks and a string in others
+    agg = LossAggregator(['route'])
+    for route in ([132, 132, 360], ['132', 'H-2', None], [132.0, np.nan]):
+        n = len(route)
+        agg.add(pd.DataFrame({'route': pd.Series(route, dtype=object)}),
+                np.ones(n), np.ones(n))
+    assert agg.groups['route'] == ['132', '360', 'H-2', None]
+    assert agg.table('route').loc['132', 'n_locations'] == 4
+
+    # Chunks of a file give the totals of the whole file
+    whole = LossAggregator(['island', 'route'])
+    locns = read_locations(LOCATIONS_FILE)
+    whole.add(locns, locns['tiv'].values, 0.01*locns['tiv'].values)
+    chunked = LossAggregator(['island', 'route'])
+    for locns in iter_locations(LOCATIONS_FILE, chunkSize=20):
+        chunked.add(locns, locns['tiv'].values, 0.01*locns['tiv'].values)
+    for c in ('island', 'route'):
+        assert whole.table(c).index.is_unique
+        pd.testing.assert_frame_equal(chunked.table(c).sort_index(),
+                                      whole.table(c).sort_index())
@@ -0,0 +1,92 @@
+"""Test the in-memory cache of loaded grids"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import time
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from shakemap_utils import GridCache, lookup_events
+from shakemap_utils import USGSshakemapGrid, USGSshakemapFields
+from shakemap_utils.memory_cache import resident_bytes
+from shakemap_utils.usgs_shakemap_grid import convert_grid
+from synthetic_shakemap import write_grid, write_uncertainty
+
+
+# Tests -----------------------------------------------------------------------
+
+
+def test_byte_budget(tmp_path):
+    ifiles = [write_grid(os.path.join(tmp_path, 'grid%i.xml' % i), 20, 10)
+              for i in range(3)]
+    ifile_unc = write_uncertainty(os.path.join(tmp_path, 'unc.xml'), 20, 10)
+
+    # Room for two grids of 20*10 float64 values
+    grids = GridCache(maxBytes=2*1600)
+    sm0 = grids.shakemap(ifiles[0], 'MMI')
+    assert resident_bytes(sm0) == 1600
+    assert grids.shakemap(ifiles[0], 'MMI') is sm0
+    grids.shakemap(ifiles[1], 'MMI')
+    grids.shakemap(ifiles[0], 'MMI')
+
+    # The least recently used is dropped
+    grids.shakemap(ifiles[2], 'MMI')
+    assert grids.stats() == {'items': 2, 'bytes': 3200, 'max_bytes': 3200,
+                             'hits': 2, 'misses': 3, 'evictions': 1}
+    assert [k[1] for k in grids.keys()] == [ifiles[0], ifiles[2]]
+
+    # Options are part of the key and change the size
+    sm = grids.shakemap(ifiles[0], 'MMI', dtype='float32')
+    assert sm is not sm0 and resident_bytes(sm) == 800
+    assert grids.nBytes == 2400
+
+    # The uncertainty grid is counted, filling the budget on its own
+    sm = grids.shakemap(ifiles[1], 'PGA', ifile_unc)
+    assert resident_bytes(sm) == 3200
+    assert grids.nBytes == 3200 and len(grids) == 1
+
+    # Objects bigger than the budget are returned but not kept
+    bigFile = write_grid(os.path.join(tmp_path, 'big.xml'), 41, 10)
+    sm = grids.shakemap(bigFile, 'MMI')
+    assert resident_bytes(sm) == 3280
+    assert grids.nBytes == 3200 and len(grids) == 1
+    assert grids.shakemap(bigFile, 'MMI') is not sm
+
+    # Memory maps are held by the OS rather than the process
+    npyFile = os.path.join(tmp_path, 'grid.npy')
+    convert_grid(ifiles[0], npyFile)
+    sm = grids.shakemap(npyFile, 'MMI', useMemmap=True)
+    assert resident_bytes(sm) == 0
+
+    # A grid viewing the block of all the fields holds all of it, counted
+    # once for the grid and its fields
+    smFields = USGSshakemapFields(ifiles[0], isQuiet=True)
+    sm = USGSshakemapGrid(smFields, 'MMI')
+    assert np.shares_memory(sm.grid, smFields.data)
+    assert resident_bytes(sm) == smFields.data.nbytes
+    assert resident_bytes(smFields) == smFields.data.nbytes
+
+
+def test_threads(tmp_path):
+    grids = GridCache()
+    nLoads = []
+
+    def load():
+        nLoads.append(threading.get_ident())
+        time.sleep(0.05)
+        return np.zeros(10)
+
+    # Threads asking for the same key at the same time wait for one load
+    with ThreadPoolExecutor(8) as pool:
+        outs = list(pool.map(lambda i: grids.get('key', load), range(16)))
+    assert len(nLoads) == 1 and all(o is outs[0] for o in outs)
+    assert grids.hits == 15 and grids.misses == 1
+
+    # Shared by an event set lookup
+    ifile = write_grid(os.path.join(tmp_path, 'grid.xml'), 20, 10)
+    x, y = np.array([-158.8]), np.array([22.45])
+    for _ in range(3):
+        lookup_events((x, y), [ifile, ifile], 'MMI', grids=grids)
+    assert grids.misses == 2 and grids.hits == 20
@@ -0,0 +1,66 @@
+"""Test the spatial index of locations"""
+
+
+# Libraries ------------------------------------------------------------------
+import os
+import numpy as np
+import pandas as pd
+
+from shakemap_utils import USGSshakemapGrid, PortfolioIndex
+from shakemap_utils.location_lookup import read_locations_csv
+from synthetic_shakemap import write_grid
+
+
+# Tests -----------------------------------------------------------------------
+
+
+def brute_force(x, y, xylims):
+    return np.flatnonzero((x >= xylims[0]) & (x < xylims[1]) &
+                          (y >= xylims[2]) & (y < xylims[3]))
+
+
+def test_query(tmp_path):
+    rng = np.random.default_rng(5)
+    x = np.round(rng.uniform(-125, -105, 20000), 2)
+    y = np.round(rng.uniform(32, 42, 20000), 2)
+    x[7] = np.nan
+    index = PortfolioIndex((x, y), cellSize=0.25)
+    assert index.npoints() == 19999
+
+    # Boxes inside, across the edge of, and away from the locations,
+    # including edges on the buckets and locations
+    boxes = [[-120, -118, 35, 36], [-130, -124.5, 30, 33.25],
+             [-118.03, -117.5, 40.01, 45], [0, 10, 0, 10],
+             [-125, -105, 32, 42]]
+    for xylims in boxes:
+        np.testing.assert_array_equal(index.query(xylims),
+                                      brute_force(x, y, xylims))
+
+    # Saved indexes give the same answers
+    ofile = os.path.join(tmp_path, 'index.npz')
+    index.save(ofile)
+    index2 = PortfolioIndex(ofile)
+    for xylims in boxes:
+        np.testing.assert_array_equal(index2.query(xylims),
+                                      index.query(xylims))
+
+    # Used to read locations in a box
+    ifile = os.path.join(tmp_path, 'locns.csv')
+    pd.DataFrame({'lon': x, 'lat': y}).to_csv(ifile, index=False)
+    locns = read_locations_csv(ifile, boxes[0], index2)
+    pd.testing.assert_frame_equal(locns, read_locations_csv(ifile, boxes[0]))
+
+
+def test_lookup(tmp_path):
+    ifile = write_grid(os.path.join(tmp_path, 'grid.xml'), 21, 15)
+    sm = USGSshakemapGrid(ifile, 'MMI', isQuiet=True)
+
+    rng = np.random.default_rng(6)
+    x = rng.uniform(-160, -155, 5000)
+    y = rng.uniform(20, 23, 5000)
+    index = PortfolioIndex(pd.DataFrame({'lon': x, 'lat': y}))
+
+    rows, median, std = index.lookup(sm)
+    m, s = sm.lookup(x, y)
+    np.testing.assert_array_equal(rows, np.flatnonzero(~np.isnan(m)))
+    np.testing.assert_array_equal(median, m[rows])